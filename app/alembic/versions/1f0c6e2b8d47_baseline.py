@@ -0,0 +1,93 @@
+"""baseline
+
+The schema init_db used to create with Base.metadata.create_all, before any
+revision. A database created that way is already at this revision: run
+`alembic stamp 1f0c6e2b8d47` once, then `alembic upgrade head`.
+
+Revision ID: 1f0c6e2b8d47
+Revises:
+Create Date: 2026-10-18 11:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f0c6e2b8d47'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'restaurant',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(25), nullable=False, unique=True),
+        sa.Column('password', sa.Text()),
+        sa.Column('name', sa.String(25), unique=True),
+        sa.Column('email', sa.String(80), unique=True),
+        sa.Column('address', sa.String(25)),
+        sa.Column('phone_number', sa.String(20), unique=True),
+        sa.Column('is_administrator', sa.Boolean()),
+        sa.Column('is_staff', sa.Boolean()),
+    )
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(25), unique=True),
+        sa.Column('name', sa.String(20)),
+        sa.Column('lastname', sa.String(20)),
+        sa.Column('email', sa.String(80), unique=True),
+        sa.Column('password', sa.Text()),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('phone_number', sa.String(20), nullable=False),
+        sa.Column('address', sa.String(25)),
+        sa.Column('time_joined', sa.DateTime()),
+    )
+    op.create_table(
+        'food_category',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('category_name', sa.String(10)),
+    )
+    op.create_table(
+        'fooditem',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(20), nullable=False),
+        sa.Column('description', sa.String(100)),
+        sa.Column('ingredients', sa.String(100)),
+        sa.Column('price', sa.DECIMAL(precision=8, scale=2)),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('category_id', sa.Integer(), sa.ForeignKey('food_category.id')),
+        sa.Column('restaurant_id', sa.Integer(), sa.ForeignKey('restaurant.id')),
+    )
+    op.create_table(
+        'orders',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        # sqlalchemy_utils ChoiceType stores the code as VARCHAR(255)
+        sa.Column('order_status', sa.String(255)),
+        sa.Column('order_time', sa.DateTime()),
+        sa.Column('estimated_time', sa.DateTime()),
+        sa.Column('delivery_address', sa.String(100)),
+        sa.Column('comment', sa.String(300)),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+        sa.Column('restaurant_id', sa.Integer(), sa.ForeignKey('restaurant.id')),
+    )
+    op.create_table(
+        'order_item',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('comment', sa.String(20)),
+        sa.Column('food_item_id', sa.Integer(), sa.ForeignKey('fooditem.id')),
+        sa.Column('orders_id', sa.Integer(), sa.ForeignKey('orders.id')),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('order_item')
+    op.drop_table('orders')
+    op.drop_table('fooditem')
+    op.drop_table('food_category')
+    op.drop_table('users')
+    op.drop_table('restaurant')
@@ -0,0 +1,38 @@
+"""order prices
+
+Revision ID: 5e1b7c9d2a40
+Revises: c2d8f4a1b9e3
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1b7c9d2a40'
+down_revision = 'c2d8f4a1b9e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Prices are copied at order time, later menu price changes don't rewrite old orders
+    op.add_column('orders', sa.Column('total_price', sa.DECIMAL(precision=10, scale=2), nullable=True))
+    op.add_column('order_item', sa.Column('unit_price', sa.DECIMAL(precision=8, scale=2), nullable=True))
+    # Existing orders get the menu's current prices, the closest thing to what was charged
+    op.execute("""
+        UPDATE order_item SET unit_price = fooditem.price
+        FROM fooditem WHERE fooditem.id = order_item.food_item_id
+    """)
+    op.execute("""
+        UPDATE orders SET total_price = coalesce((
+            SELECT sum(order_item.quantity * order_item.unit_price)
+            FROM order_item WHERE order_item.orders_id = orders.id
+        ), 0)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('order_item', 'unit_price')
+    op.drop_column('orders', 'total_price')
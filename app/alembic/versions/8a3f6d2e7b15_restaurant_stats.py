@@ -0,0 +1,67 @@
+"""restaurant stats summary tables
+
+Revision ID: 8a3f6d2e7b15
+Revises: 5e1b7c9d2a40
+Create Date: 2026-10-18 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3f6d2e7b15'
+down_revision = '5e1b7c9d2a40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'restaurant_daily_stats',
+        sa.Column('restaurant_id', sa.Integer(), sa.ForeignKey('restaurant.id'), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('orders', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revenue', sa.DECIMAL(precision=12, scale=2), nullable=False, server_default='0'),
+    )
+    op.create_table(
+        'restaurant_status_count',
+        sa.Column('restaurant_id', sa.Integer(), sa.ForeignKey('restaurant.id'), primary_key=True),
+        sa.Column('order_status', sa.String(255), primary_key=True),
+        sa.Column('orders', sa.Integer(), nullable=False, server_default='0'),
+    )
+    op.create_table(
+        'restaurant_item_sales',
+        sa.Column('restaurant_id', sa.Integer(), sa.ForeignKey('restaurant.id'), primary_key=True),
+        sa.Column('food_item_id', sa.Integer(), sa.ForeignKey('fooditem.id'), primary_key=True),
+        sa.Column('quantity', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revenue', sa.DECIMAL(precision=12, scale=2), nullable=False, server_default='0'),
+    )
+
+    # Backfill from the existing orders, from here on app.stats keeps the tables current
+    op.execute("""
+        INSERT INTO restaurant_daily_stats (restaurant_id, day, orders, revenue)
+        SELECT restaurant_id, order_time::date, count(*), coalesce(sum(total_price), 0)
+        FROM orders WHERE restaurant_id IS NOT NULL
+        GROUP BY restaurant_id, order_time::date
+    """)
+    op.execute("""
+        INSERT INTO restaurant_status_count (restaurant_id, order_status, orders)
+        SELECT restaurant_id, order_status, count(*)
+        FROM orders WHERE restaurant_id IS NOT NULL AND order_status IS NOT NULL
+        GROUP BY restaurant_id, order_status
+    """)
+    op.execute("""
+        INSERT INTO restaurant_item_sales (restaurant_id, food_item_id, quantity, revenue)
+        SELECT orders.restaurant_id, order_item.food_item_id, sum(order_item.quantity),
+               coalesce(sum(order_item.quantity * order_item.unit_price), 0)
+        FROM orders JOIN order_item ON order_item.orders_id = orders.id
+        WHERE orders.restaurant_id IS NOT NULL AND order_item.food_item_id IS NOT NULL
+        GROUP BY orders.restaurant_id, order_item.food_item_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('restaurant_item_sales')
+    op.drop_table('restaurant_status_count')
+    op.drop_table('restaurant_daily_stats')
@@ -0,0 +1,41 @@
+"""restaurant roles version for revoking role claims
+
+Revision ID: a4d6f8b0c2e5
+Revises: e3c5a8f0b2d4
+Create Date: 2026-10-18 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d6f8b0c2e5'
+down_revision = 'e3c5a8f0b2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('restaurant', sa.Column('roles_version', sa.Integer(), nullable=False, server_default='1'))
+    # In the database rather than the app, so role changes made by scripts or plain SQL revoke the tokens too
+    op.execute("""
+        CREATE FUNCTION restaurant_bump_roles_version() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.is_staff IS DISTINCT FROM OLD.is_staff OR NEW.is_administrator IS DISTINCT FROM OLD.is_administrator THEN
+                NEW.roles_version := OLD.roles_version + 1;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER restaurant_roles_version BEFORE UPDATE OF is_staff, is_administrator ON restaurant
+        FOR EACH ROW EXECUTE FUNCTION restaurant_bump_roles_version()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER restaurant_roles_version ON restaurant")
+    op.execute("DROP FUNCTION restaurant_bump_roles_version()")
+    op.drop_column('restaurant', 'roles_version')
@@ -0,0 +1,25 @@
+"""order version for optimistic status transitions
+
+Revision ID: b7e4d2a9c1f6
+Revises: f2a9c3e5d871
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d2a9c1f6'
+down_revision = 'f2a9c3e5d871'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A constant default doesn't rewrite the partitions, existing orders start at version 1
+    op.add_column('orders', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'version')
@@ -0,0 +1,37 @@
+"""food search index
+
+Revision ID: c2d8f4a1b9e3
+Revises: 1f0c6e2b8d47
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d8f4a1b9e3'
+down_revision = '1f0c6e2b8d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Generated column: Postgres keeps it in sync on every insert/update of fooditem
+    op.execute("""
+        ALTER TABLE fooditem ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(ingredients, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+        ) STORED
+    """)
+    op.create_index('ix_fooditem_search_vector', 'fooditem', ['search_vector'], postgresql_using='gin')
+    op.create_index('ix_fooditem_name_trgm', 'fooditem', ['name'], postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_fooditem_name_trgm', table_name='fooditem')
+    op.drop_index('ix_fooditem_search_vector', table_name='fooditem')
+    op.drop_column('fooditem', 'search_vector')
@@ -0,0 +1,103 @@
+"""partition orders by order_time, hot path indexes
+
+Revision ID: d41f8a6c2e97
+Revises: 8a3f6d2e7b15
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f8a6c2e97'
+down_revision = '8a3f6d2e7b15'
+branch_labels = None
+depends_on = None
+
+
+# Monthly partitions created ahead of time, app.archive keeps creating them
+MONTHS_AHEAD = 3
+
+
+def upgrade() -> None:
+    # A unique constraint on a partitioned table has to include the partition key, so
+    # order_item.orders_id can't reference orders(id) any more
+    op.drop_constraint('order_item_orders_id_fkey', 'order_item', type_='foreignkey')
+
+    op.rename_table('orders', 'orders_unpartitioned')
+    op.execute("ALTER TABLE orders_unpartitioned RENAME CONSTRAINT orders_pkey TO orders_unpartitioned_pkey")
+    op.execute("""
+        CREATE TABLE orders (
+            id integer NOT NULL DEFAULT nextval('orders_id_seq'),
+            order_status varchar(255),
+            order_time timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            estimated_time timestamp,
+            delivery_address varchar(100),
+            comment varchar(300),
+            user_id integer REFERENCES users (id),
+            restaurant_id integer REFERENCES restaurant (id),
+            total_price numeric(10, 2),
+            CONSTRAINT orders_pkey PRIMARY KEY (id, order_time)
+        ) PARTITION BY RANGE (order_time)
+    """)
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    # Catches rows outside every monthly partition instead of failing the insert;
+    # app.archive creates partitions ahead of time so it normally stays empty
+    op.execute("CREATE TABLE orders_default PARTITION OF orders DEFAULT")
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', coalesce((SELECT min(order_time) FROM orders_unpartitioned), now())),
+                    date_trunc('month', now()) + interval '{MONTHS_AHEAD} months',
+                    interval '1 month')::date
+            LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF orders FOR VALUES FROM (%L) TO (%L)',
+                               'orders_' || to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+            END LOOP;
+        END $$
+    """)
+    op.execute("""
+        INSERT INTO orders (id, order_status, order_time, estimated_time, delivery_address, comment,
+                            user_id, restaurant_id, total_price)
+        SELECT id, order_status, coalesce(order_time, now() AT TIME ZONE 'utc'), estimated_time, delivery_address,
+               comment, user_id, restaurant_id, total_price
+        FROM orders_unpartitioned
+    """)
+    op.drop_table('orders_unpartitioned')
+
+    # Created on the parent, Postgres adds them to every partition, present and future.
+    # /shop/orders?q=<status>, /shop/orders and /order/my-orders, all newest first with (order_time, id) cursors
+    op.execute("CREATE INDEX ix_orders_restaurant_status_time ON orders (restaurant_id, order_status, order_time DESC, id DESC)")
+    op.execute("CREATE INDEX ix_orders_restaurant_time ON orders (restaurant_id, order_time DESC, id DESC)")
+    op.execute("CREATE INDEX ix_orders_user_time ON orders (user_id, order_time DESC, id DESC)")
+    op.create_index('ix_order_item_orders_id', 'order_item', ['orders_id'])
+    op.execute("ANALYZE orders")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_item_orders_id', table_name='order_item')
+    op.rename_table('orders', 'orders_partitioned')
+    op.execute("ALTER TABLE orders_partitioned RENAME CONSTRAINT orders_pkey TO orders_partitioned_pkey")
+    op.execute("""
+        CREATE TABLE orders (
+            id integer NOT NULL DEFAULT nextval('orders_id_seq') PRIMARY KEY,
+            order_status varchar(255),
+            order_time timestamp,
+            estimated_time timestamp,
+            delivery_address varchar(100),
+            comment varchar(300),
+            user_id integer REFERENCES users (id),
+            restaurant_id integer REFERENCES restaurant (id),
+            total_price numeric(10, 2)
+        )
+    """)
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    op.execute("INSERT INTO orders SELECT id, order_status, order_time, estimated_time, delivery_address, comment, "
+               "user_id, restaurant_id, total_price FROM orders_partitioned")
+    op.execute("DROP TABLE orders_partitioned CASCADE")
+    op.create_foreign_key('order_item_orders_id_fkey', 'order_item', 'orders', ['orders_id'], ['id'])
@@ -0,0 +1,32 @@
+"""unique food item name per restaurant
+
+Revision ID: f2a9c3e5d871
+Revises: d41f8a6c2e97
+Create Date: 2026-10-18 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9c3e5d871'
+down_revision = 'd41f8a6c2e97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing duplicates are kept (order lines point at them) but renamed "<name>#<id>"
+    op.execute("""
+        UPDATE fooditem SET name = left(fooditem.name, 19 - length(fooditem.id::text)) || '#' || fooditem.id
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY restaurant_id, name ORDER BY id) AS position FROM fooditem
+        ) AS duplicates
+        WHERE fooditem.id = duplicates.id AND duplicates.position > 1
+    """)
+    op.create_unique_constraint('uq_fooditem_restaurant_name', 'fooditem', ['restaurant_id', 'name'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_fooditem_restaurant_name', 'fooditem', type_='unique')
@@ -0,0 +1,143 @@
+"""Partition maintenance for the orders table (see the d41f8a6c2e97 migration).
+
+Run it daily, e.g. from cron:
+
+    python -m app.archive --months-ahead 3 --keep-months 12
+
+- creates the monthly orders_YYYY_MM partitions for the coming months, moving
+  any rows that landed in orders_default meanwhile
+- detaches partitions older than --keep-months whose orders are all DELIVERED
+  or CANCELED, moves them to the `archive` schema and their order_item lines
+  with them, so the hot tables and their indexes only hold recent history
+"""
+import argparse
+import datetime
+import re
+
+from sqlalchemy import text, bindparam
+
+from app.database import engine
+
+
+ARCHIVABLE_STATUSES = ('DELIVERED', 'CANCELED')
+PARTITION_NAME = re.compile(r'^orders_(\d{4})_(\d{2})$')
+# Attaching and detaching need exclusive locks: give up rather than queue behind long queries
+LOCK_TIMEOUT = '5s'
+
+
+def add_months(month, count):
+    month_index = month.year * 12 + month.month - 1 + count
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def current_month():
+    # order_time is stored in UTC, so is the month a partition covers
+    return datetime.datetime.utcnow().date().replace(day=1)
+
+
+def partition_name(month):
+    return f'orders_{month:%Y_%m}'
+
+
+def list_partitions(connection):
+    rows = connection.execute(text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'orders'
+    """)).scalars()
+    partitions = {}
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def ensure_partitions(connection, months_ahead, since=None):
+    """Create the missing monthly partitions from `since` (default this month) to months_ahead.
+
+    Run it in a transaction: orders_default stays locked until it commits.
+    """
+    existing = list_partitions(connection)
+    this_month = current_month()
+    first_month = (since or this_month).replace(day=1)
+    first_offset = (first_month.year - this_month.year) * 12 + first_month.month - this_month.month
+    created = []
+    for offset in range(first_offset, months_ahead + 1):
+        month = add_months(this_month, offset)
+        if month in existing:
+            continue
+        name = partition_name(month)
+        bounds = {'start': month, 'end': add_months(month, 1)}
+        if not created:
+            # A new partition can't be attached over rows sitting in the default partition, move them first;
+            # the lock (the one ATTACH takes anyway) keeps inserts from landing there until the ATTACH is done
+            connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            connection.execute(text("LOCK TABLE orders_default IN ACCESS EXCLUSIVE MODE"))
+        connection.execute(text(f"CREATE TABLE {name} (LIKE orders INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        connection.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM orders_default WHERE order_time >= :start AND order_time < :end RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), bounds)
+        connection.execute(text(f"ALTER TABLE orders ATTACH PARTITION {name} FOR VALUES FROM (:start) TO (:end)"), bounds)
+        created.append(name)
+    return created
+
+
+def archive_partitions(connection, keep_months, dry_run=False):
+    """Detach and archive old partitions, one transaction each so locks are held briefly."""
+    cutoff = add_months(current_month(), -keep_months)
+    with connection.begin():
+        partitions = sorted(list_partitions(connection).items())
+    archived, skipped = [], []
+    for month, name in partitions:
+        if add_months(month, 1) > cutoff:
+            continue
+        with connection.begin():
+            pending = connection.execute(
+                text(f"SELECT count(*) FROM {name} WHERE order_status IS NULL OR order_status NOT IN :statuses")
+                .bindparams(bindparam('statuses', ARCHIVABLE_STATUSES, expanding=True)),
+            ).scalar()
+            if pending:
+                skipped.append((name, pending))
+                continue
+            archived.append(name)
+            if dry_run:
+                continue
+            connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            connection.execute(text("CREATE SCHEMA IF NOT EXISTS archive"))
+            connection.execute(text("CREATE TABLE IF NOT EXISTS archive.order_item (LIKE order_item INCLUDING DEFAULTS)"))
+            connection.execute(text(f"ALTER TABLE orders DETACH PARTITION {name}"))
+            connection.execute(text(f"ALTER TABLE {name} SET SCHEMA archive"))
+            connection.execute(text(f"""
+                WITH moved AS (
+                    DELETE FROM order_item WHERE orders_id IN (SELECT id FROM archive.{name}) RETURNING *
+                )
+                INSERT INTO archive.order_item SELECT * FROM moved
+            """))
+    return archived, skipped
+
+
+def main(args):
+    with engine.connect() as connection:
+        if not args.dry_run:
+            with connection.begin():
+                for name in ensure_partitions(connection, args.months_ahead):
+                    print(f"created   {name}")
+
+        archived, skipped = archive_partitions(connection, args.keep_months, args.dry_run)
+        for name in archived:
+            print(f"{'would archive' if args.dry_run else 'archived'}  {name}")
+        for name, pending in skipped:
+            print(f"skipped   {name}: {pending} orders not in {', '.join(ARCHIVABLE_STATUSES)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--months-ahead', type=int, default=3)
+    parser.add_argument('--keep-months', type=int, default=12)
+    parser.add_argument('--dry-run', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+"""Per-request cost of authorizing a shop request, old path vs role claims.
+
+old:    verify the token, then SELECT the restaurant by username (with the menu
+        the model used to join eagerly) to read is_staff/is_administrator
+claims: verify the token and read pid/kind/staff/admin from it, checking its
+        roles_version against the one cached for ROLES_VERSION_TTL
+cached: token without claims, principal served from principal_cache
+
+    python -m app.benchmarks.auth --username pizzerie --requests 2000
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi_jwt_auth import AuthJWT
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from starlette.requests import Request
+
+import app.main  # noqa: F401, registers the AuthJWT settings
+from app.database import AsyncSession, async_engine
+from app.models import Restaurant
+from app.principals import Principal, create_tokens
+from app.routers.base import check_authorization, check_shop_authorization
+
+
+def request_for(token):
+    return Request({'type': 'http', 'method': 'GET', 'headers': [(b'authorization', f'Bearer {token}'.encode())]})
+
+
+def authorize(token):
+    return AuthJWT(request_for(token))
+
+
+async def old_check(token):
+    async with AsyncSession() as session:
+        Authorize = authorize(token)
+        check_authorization(request_for(token), Authorize)
+        statement = select(Restaurant).filter_by(username=Authorize.get_jwt_subject()).options(joinedload(Restaurant.food_items))
+        result = await session.execute(statement)
+        shop_user = result.unique().scalars().first()
+        assert shop_user.is_staff and shop_user.is_administrator
+
+
+async def new_check(token):
+    async with AsyncSession() as session:
+        Authorize = authorize(token)
+        subject = check_authorization(request_for(token), Authorize)
+        await check_shop_authorization(session, subject, Authorize)
+
+
+async def run(check, token, requests):
+    await check(token)   # warm the pool and the principal cache
+    start = time.perf_counter()
+    for _ in range(requests):
+        await check(token)
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+async def main(args):
+    async with AsyncSession() as session:
+        result = await session.execute(select(Restaurant).filter_by(username=args.username))
+        shop = result.scalars().one()
+    tokens = create_tokens(AuthJWT(), Principal.from_model(shop, 'shop'))
+    legacy_token = AuthJWT().create_access_token(subject=shop.username)
+
+    print(f"{'':8}{'us/request':>12}")
+    for name, check, token in (('old', old_check, legacy_token),
+                               ('claims', new_check, tokens['access_token']),
+                               ('cached', new_check, legacy_token)):
+        print(f"{name:8}{await run(check, token, args.requests):>12.1f}")
+
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--username', required=True, help="a staff/administrator restaurant")
+    parser.add_argument('--requests', type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
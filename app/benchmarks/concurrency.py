@@ -0,0 +1,75 @@
+"""Before/after benchmark for the async database path.
+
+Simulates N concurrent `async def` handlers that each make one DB round trip
+(`SELECT pg_sleep(delay)`), first through the sync psycopg2 Session (the old
+handlers) and then through AsyncSession. With the sync session every round trip
+blocks the event loop, so wall time grows with concurrency; with the async
+session the round trips overlap and wall time stays close to one round trip.
+
+    python -m app.benchmarks.concurrency --requests 200 --concurrency 50 --delay 0.01
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from app.database import Session, AsyncSession, engine, async_engine
+
+QUERY = text("SELECT pg_sleep(:delay)")
+
+
+async def sync_handler(delay):
+    # What the handlers did before: a blocking round trip inside an async def
+    with Session() as session:
+        session.execute(QUERY, {'delay': delay})
+
+
+async def async_handler(delay):
+    async with AsyncSession() as session:
+        await session.execute(QUERY, {'delay': delay})
+
+
+async def run(handler, requests, concurrency, delay):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await handler(delay)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'wall_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main(args):
+    # Warm both pools so connection setup isn't part of the measurement
+    await run(sync_handler, args.concurrency, args.concurrency, 0)
+    await run(async_handler, args.concurrency, args.concurrency, 0)
+
+    before = await run(sync_handler, args.requests, args.concurrency, args.delay)
+    after = await run(async_handler, args.requests, args.concurrency, args.delay)
+    print(f"{'':8}{'wall_s':>10}{'req/s':>10}{'p50_ms':>10}{'p99_ms':>10}")
+    for name, result in (('sync', before), ('async', after)):
+        print(f"{name:8}{result['wall_s']:>10}{result['throughput_rps']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}")
+
+    await async_engine.dispose()
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--delay', type=float, default=0.01, help="server side time per round trip, seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""Cold start: OpenAPI schema generation, old getsource scan vs app.openapi.
+
+old:  get_openapi, then inspect.getsource() of every endpoint three times per
+      method and a regex for jwt_required to decide which routes need a token
+cold: get_openapi with security taken from the route dependencies, then written
+      to the OPENAPI_CACHE file (first worker of a deploy)
+warm: the schema loaded from the cache file (every later worker)
+
+Each run is a fresh interpreter, so imports are included in "import" and the
+schema timings are what the first /docs or /openapi.json hit used to pay.
+
+    python -m app.benchmarks.openapi --runs 5
+"""
+import argparse
+import inspect
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def legacy_openapi(app):
+    from fastapi.openapi.utils import get_openapi
+    from fastapi.routing import APIRoute
+
+    openapi_schema = get_openapi(title="My Auth API", version="1.0", description="An API with an Authorize Button",
+                                 routes=app.routes)
+    openapi_schema["components"]["securitySchemes"] = {
+        "Bearer Auth": {"type": "apiKey", "in": "header", "name": "Authorization"}
+    }
+    for route in [route for route in app.routes if isinstance(route, APIRoute)]:
+        for method in [method.lower() for method in route.methods]:
+            if (
+                re.search("jwt_required", inspect.getsource(route.endpoint)) or
+                re.search("fresh_jwt_required", inspect.getsource(route.endpoint)) or
+                re.search("jwt_optional", inspect.getsource(route.endpoint))
+            ):
+                openapi_schema["paths"][route.path][method]["security"] = [{"Bearer Auth": []}]
+    return openapi_schema
+
+
+def child(mode):
+    start = time.perf_counter()
+    from app.main import app
+    from app.openapi import cached_openapi
+    imported = time.perf_counter()
+    if mode == 'old':
+        legacy_openapi(app)
+    else:
+        cached_openapi(app)
+    done = time.perf_counter()
+    print(json.dumps({'import_ms': (imported - start) * 1000, 'schema_ms': (done - imported) * 1000}))
+
+
+def run_child(mode, cache):
+    env = {**os.environ, 'OPENAPI_CACHE': cache}
+    output = subprocess.run([sys.executable, '-m', 'app.benchmarks.openapi', '--child', mode],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args):
+    cache = os.path.join(tempfile.mkdtemp(), 'openapi.json')
+    print(f"{'':8}{'import ms':>12}{'schema ms':>12}")
+    for mode in ('old', 'cold', 'warm'):
+        results = []
+        for _ in range(args.runs):
+            if mode == 'cold' and os.path.exists(cache):
+                os.remove(cache)
+            results.append(run_child(mode, cache))
+        print(f"{mode:8}{statistics.median(r['import_ms'] for r in results):>12.1f}"
+              f"{statistics.median(r['schema_ms'] for r in results):>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=['old', 'cold', 'warm'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+    else:
+        main(args)
@@ -0,0 +1,91 @@
+"""Throughput of placing 50-line orders, row-by-row vs app.ordering.
+
+old: one SELECT per line to check the item, then OrderItem objects flushed
+     through the ORM (the old handler plus the validation it never did)
+new: place_order, the whole order priced and inserted in one statement
+
+Needs a restaurant with at least --lines active, priced menu items.
+
+    python -m app.benchmarks.orders --restaurant-id 1 --user-id 1 --orders 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select, delete
+
+from app.database import AsyncSession, async_engine
+from app.models import Orders, OrderItem, FoodItem
+from app.ordering import place_order
+from app.schemas import CreateOrders
+
+
+async def old_place(order, user_id):
+    async with AsyncSession() as session:
+        lines = []
+        for line in order.list_orders:
+            item = await session.get(FoodItem, line.food_item_id)
+            assert item.restaurant_id == order.restaurant_id and item.is_active
+            lines.append(OrderItem(quantity=line.quantity, comment=line.comment, food_item_id=item.id, unit_price=item.price))
+        session.add(Orders(delivery_address=order.delivery_address, comment=order.comment, user_id=user_id,
+                           restaurant_id=order.restaurant_id, orders_list=lines,
+                           total_price=sum(line.unit_price * line.quantity for line in lines)))
+        await session.commit()
+
+
+async def new_place(order, user_id):
+    async with AsyncSession() as session:
+        await place_order(session, user_id, order)
+        await session.commit()
+
+
+async def run(handler, order, user_id, orders, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler(order, user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(orders)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    async with AsyncSession() as session:
+        statement = (
+            select(FoodItem.id)
+            .filter(FoodItem.restaurant_id == args.restaurant_id, FoodItem.is_active, FoodItem.price.is_not(None))
+            .limit(args.lines)
+        )
+        food_item_ids = (await session.execute(statement)).scalars().all()
+    assert len(food_item_ids) == args.lines, f"restaurant {args.restaurant_id} has fewer than {args.lines} items"
+    order = CreateOrders(
+        restaurant_id=args.restaurant_id,
+        delivery_address='1960 W CHELSEA AVE',
+        comment='benchmark',
+        list_orders=[{'food_item_id': food_item_id, 'quantity': 1, 'comment': ''} for food_item_id in food_item_ids],
+    )
+
+    print(f"{'':8}{'wall_s':>10}{'orders/s':>10}{'lines/s':>10}")
+    for name, handler in (('old', old_place), ('new', new_place)):
+        await run(handler, order, args.user_id, args.concurrency, args.concurrency)   # warm up
+        elapsed = await run(handler, order, args.user_id, args.orders, args.concurrency)
+        print(f"{name:8}{elapsed:>10.2f}{args.orders / elapsed:>10.1f}{args.orders * args.lines / elapsed:>10.0f}")
+
+    async with AsyncSession() as session:
+        benchmark_orders = select(Orders.id).filter(Orders.comment == 'benchmark')
+        await session.execute(delete(OrderItem).filter(OrderItem.orders_id.in_(benchmark_orders)))
+        await session.execute(delete(Orders).filter(Orders.comment == 'benchmark'))
+        await session.commit()
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restaurant-id', type=int, required=True)
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--lines', type=int, default=50)
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
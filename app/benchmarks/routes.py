@@ -0,0 +1,218 @@
+"""Per-route latency benchmark, in-process against the configured database.
+
+Drives app.main:app through an httpx ASGI client (no sockets, no uvicorn), so
+the numbers are the app's own cost: routing, auth, queries, serialization.
+Every route runs at each concurrency level and the report records p50/p95/p99,
+throughput, error count and the X-Query-Count of the responses.
+
+The database needs the migrations applied and data to run against, --seed
+generates it with app.datagen first:
+
+    python -m app.benchmarks.routes --seed --out before.json
+    ... change something ...
+    python -m app.benchmarks.routes --out after.json --compare before.json
+
+--compare exits with status 1 when a route's p95 grows by more than
+--threshold or it starts running more queries.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from fastapi_jwt_auth import AuthJWT
+from sqlalchemy import select
+
+from app import datagen
+from app.main import app
+from app.database import AsyncSession, async_engine
+from app.models import Restaurant, User, FoodItem, Orders
+from app.principals import Principal, create_tokens
+
+
+async def fixtures(rng):
+    async with AsyncSession() as session:
+        # Generated accounts first: their password is known, so the login routes can run too
+        generated = f'{datagen.USERNAME_PREFIX}\\_%'
+        shops = (await session.execute(
+            select(Restaurant).filter(Restaurant.is_staff, Restaurant.is_administrator)
+            .order_by(Restaurant.username.like(generated).desc(), Restaurant.id).limit(100)
+        )).scalars().all()
+        users = (await session.execute(
+            select(User).order_by(User.username.like(generated).desc(), User.id).limit(100)
+        )).scalars().all()
+        assert shops and users, "no data to run against, use --seed"
+        shop, user = rng.choice(shops), rng.choice(users)
+        food_ids = (await session.execute(select(FoodItem.id).filter(FoodItem.restaurant_id == shop.id, FoodItem.is_active, FoodItem.price.is_not(None)).limit(50))).scalars().all()
+        order_ids = (await session.execute(select(Orders.id).filter(Orders.user_id == user.id).limit(50))).scalars().all()
+    Authorize = AuthJWT()
+    return {
+        'shop': shop.username, 'user': user.username, 'shop_id': shop.id, 'food_ids': food_ids, 'order_ids': order_ids or [0],
+        'shop_tokens': create_tokens(Authorize, Principal.from_model(shop, 'shop')),
+        'user_tokens': create_tokens(Authorize, Principal.from_model(user, 'user')),
+    }
+
+
+def scenarios(f, rng):
+    """(name, method, url, token, body) factories, one request each call."""
+    shop = {'Authorization': f"Bearer {f['shop_tokens']['access_token']}"}
+    user = {'Authorization': f"Bearer {f['user_tokens']['access_token']}"}
+    refresh = {'Authorization': f"Bearer {f['user_tokens']['refresh_token']}"}
+    generated = f"{datagen.USERNAME_PREFIX}_"
+    known_password = f['user'].startswith(generated) and f['shop'].startswith(generated)
+
+    def order():
+        return {'restaurant_id': f['shop_id'], 'delivery_address': 'Bench street', 'comment': 'benchmark',
+                'list_orders': [{'food_item_id': rng.choice(f['food_ids']), 'quantity': 1, 'comment': ''} for _ in range(3)]}
+
+    routes = [
+        ('GET /shops', lambda: ('GET', '/shops', user, None)),
+        ('GET /shop/{id}', lambda: ('GET', f"/shop/{f['shop_id']}", user, None)),
+        ('GET /categories', lambda: ('GET', '/categories', user, None)),
+        ('GET /food/{id}', lambda: ('GET', f"/food/{rng.choice(f['food_ids'])}", user, None)),
+        ('GET /foods', lambda: ('GET', '/foods', user, None)),
+        ('GET /foods?q=', lambda: ('GET', f'/foods?q={rng.choice(datagen.WORDS)}', user, None)),
+        ('GET /foods?fields=', lambda: ('GET', '/foods?fields=id,name,price', user, None)),
+        ('GET /auth/refresh-token', lambda: ('GET', '/auth/refresh-token', refresh, None)),
+        ('GET /shop/orders', lambda: ('GET', '/shop/orders', shop, None)),
+        ('GET /shop/orders?q=', lambda: ('GET', '/shop/orders?q=PENDING', shop, None)),
+        ('GET /shop/stats', lambda: ('GET', '/shop/stats', shop, None)),
+        ('GET /shop/menu/export', lambda: ('GET', '/shop/menu/export', shop, None)),
+        ('GET /order/my-orders', lambda: ('GET', '/order/my-orders', user, None)),
+        ('GET /order/order/{id}', lambda: ('GET', f"/order/order/{rng.choice(f['order_ids'])}", user, None)),
+        ('POST /order/place-order', lambda: ('POST', '/order/place-order', user, order())),
+    ]
+    if known_password:
+        routes += [
+            ('POST /auth/login', lambda: ('POST', '/auth/login', {}, {'username': f['user'], 'password': datagen.DEFAULT_PASSWORD})),
+            ('POST /auth/shop/login', lambda: ('POST', '/auth/shop/login', {}, {'username': f['shop'], 'password': datagen.DEFAULT_PASSWORD})),
+        ]
+    return routes
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+async def run_route(client, make_request, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, queries, statuses = [], [], {}
+
+    async def one():
+        method, url, headers, body = make_request()
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, headers=headers, json=body)
+            latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if 'x-query-count' in response.headers:
+            queries.append(int(response.headers['x-query-count']))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': sum(count for code, count in statuses.items() if code >= 400),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    previous = {(result['route'], result['concurrency']): result for result in baseline['results']}
+    regressions = []
+    print(f"\n{'route':32}{'conc':>5}{'p95 before':>12}{'p95 after':>12}{'change':>9}{'queries':>10}")
+    for result in report['results']:
+        before = previous.get((result['route'], result['concurrency']))
+        if before is None:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        queries = f"{before['queries_max']}->{result['queries_max']}"
+        flag = ''
+        if change > threshold or (result['queries_max'] or 0) > (before['queries_max'] or 0):
+            regressions.append(result['route'])
+            flag = '  REGRESSION'
+        print(f"{result['route']:32}{result['concurrency']:>5}{before['p95_ms']:>12}{result['p95_ms']:>12}{change:>+9.0%}{queries:>10}{flag}")
+    return regressions
+
+
+async def main(args):
+    rng = random.Random(args.random_seed)
+    routes = scenarios(await fixtures(rng), rng)
+    if args.routes:
+        routes = [route for route in routes if any(pattern in route[0] for pattern in args.routes)]
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'started_at': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'results': [],
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        print(f"{'route':32}{'conc':>5}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'errors':>8}")
+        for name, make_request in routes:
+            await run_route(client, make_request, args.warmup, 1)
+            for concurrency in args.concurrency:
+                result = {'route': name, 'concurrency': concurrency, **await run_route(client, make_request, args.requests, concurrency)}
+                report['results'].append(result)
+                print(f"{name:32}{concurrency:>5}{result['throughput_rps']:>9}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+                      f"{result['p99_ms']:>9}{str(result['queries_mean']):>9}{result['errors']:>8}")
+    await async_engine.dispose()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(sorted(set(regressions)))}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', action='store_true', help="generate a data set with app.datagen first")
+    parser.add_argument('--restaurants', type=int, default=50)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=100_000)
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=200, help="per route and concurrency level")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--routes', nargs='*', help="only routes whose name contains one of these")
+    parser.add_argument('--out', help="write the JSON report here")
+    parser.add_argument('--compare', help="JSON report of a previous run")
+    parser.add_argument('--threshold', type=float, default=0.2, help="p95 growth counted as a regression")
+    args = parser.parse_args()
+    if args.seed:
+        datagen.main(datagen.build_parser().parse_args([
+            '--restaurants', str(args.restaurants), '--users', str(args.users),
+            '--orders', str(args.orders), '--seed', str(args.random_seed),
+        ]))
+    asyncio.run(main(args))
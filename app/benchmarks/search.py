@@ -0,0 +1,94 @@
+"""Latency of the /foods text search at large menu sizes.
+
+By default builds the in-process fallback index over N synthetic food items
+and times exact, multi-word and misspelled queries. With --postgres it runs
+the same queries through search_food_items against the configured database,
+which must already hold the items (see `python -m app.datagen`) and have the
+c2d8f4a1b9e3 migration applied.
+
+    python -m app.benchmarks.search --items 1000000
+    python -m app.benchmarks.search --postgres
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app.search import FoodSearchIndex, search_food_items
+
+WORDS = [
+    'pizza', 'margherita', 'pepperoni', 'burger', 'cheese', 'salad', 'chicken', 'spicy', 'tomato',
+    'basil', 'mozzarella', 'garlic', 'bread', 'pasta', 'carbonara', 'lasagna', 'sushi', 'salmon',
+    'tuna', 'avocado', 'rice', 'noodles', 'beef', 'pork', 'vegan', 'tofu', 'mushroom', 'onion',
+    'pepper', 'olive', 'bacon', 'egg', 'fries', 'kebab', 'falafel', 'hummus', 'curry', 'naan',
+    'paneer', 'taco', 'burrito', 'nachos', 'chocolate', 'cake', 'icecream', 'lemon', 'mango',
+]
+QUERIES = ['pizza', 'spicy chicken', 'margherita basil', 'mozarella', 'peperoni pizza', 'carbonarra']
+
+
+def synthetic_items(count, seed=1):
+    rng = random.Random(seed)
+    for item_id in range(1, count + 1):
+        yield (
+            item_id,
+            ' '.join(rng.choices(WORDS, k=2)),
+            ' '.join(rng.choices(WORDS, k=8)),
+            ', '.join(rng.choices(WORDS, k=4)),
+        )
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {p: round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000, 3) for p in (50, 95, 99)}
+
+
+def report(name, timings):
+    for query, samples in timings.items():
+        p = percentiles(samples)
+        print(f"{name:10}{query!r:22}p50={p[50]:>9}ms  p95={p[95]:>9}ms  p99={p[99]:>9}ms")
+
+
+def bench_fallback(args):
+    index = FoodSearchIndex()
+    start = time.perf_counter()
+    for item in synthetic_items(args.items):
+        index.add(*item)
+    index.loaded = True
+    print(f"indexed {len(index)} items in {time.perf_counter() - start:.1f}s")
+
+    timings = {}
+    for query in QUERIES:
+        timings[query] = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            index.search(query, args.limit)
+            timings[query].append(time.perf_counter() - start)
+    report('fallback', timings)
+
+
+async def bench_postgres(args):
+    from app.database import AsyncSession, async_engine
+
+    timings = {}
+    async with AsyncSession() as session:
+        for query in QUERIES:
+            timings[query] = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                await search_food_items(session, query, args.limit)
+                timings[query].append(time.perf_counter() - start)
+    await async_engine.dispose()
+    report('postgres', timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1_000_000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--postgres', action='store_true')
+    args = parser.parse_args()
+    if args.postgres:
+        asyncio.run(bench_postgres(args))
+    else:
+        bench_fallback(args)
@@ -0,0 +1,79 @@
+"""Serialization cost of a 10k row list, old path vs app.serializers.
+
+old: jsonable_encoder per ORM row, then FastAPI validates the list against
+     response_model=List[GetFoodItem] and encodes it again with json.dumps
+new: precomputed ModelSerializer dicts encoded straight to bytes
+
+    python -m app.benchmarks.serialization --rows 10000
+"""
+import argparse
+import datetime
+import decimal
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from app.models import FoodItem, FoodCategory, Orders
+from app.schemas import GetFoodItem
+from app.serializers import serializer_for, dumps
+
+
+def food_items(rows):
+    category = FoodCategory(id=1, category_name='pizza')
+    return [
+        FoodItem(id=i, name=f'item {i}', description='Tomato sauce, mozzarella and basil', ingredients='tomato, mozzarella',
+                 price=decimal.Decimal('6.99'), is_active=True, category_id=1, restaurant_id=1, category=category)
+        for i in range(rows)
+    ]
+
+
+def orders(rows):
+    now = datetime.datetime.utcnow()
+    return [
+        Orders(id=i, order_status='PENDING', order_time=now, delivery_address='1960 W CHELSEA AVE',
+               comment='Can you please pack them on letter', user_id=1, restaurant_id=1)
+        for i in range(rows)
+    ]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main(args):
+    items = food_items(args.rows)
+    order_rows = orders(args.rows)
+
+    def old_foods():
+        data = [jsonable_encoder(item) for item in items]
+        validated = parse_obj_as(List[GetFoodItem], data)
+        json.dumps(jsonable_encoder(validated)).encode()
+
+    def new_foods():
+        dumps(serializer_for(FoodItem).to_list(items))
+
+    def old_orders():
+        json.dumps([jsonable_encoder(order, exclude={'user'}) for order in order_rows]).encode()
+
+    def new_orders():
+        dumps(serializer_for(Orders, exclude={'user'}).to_list(order_rows))
+
+    for name, old, new in (('foods', old_foods, new_foods), ('orders', old_orders, new_orders)):
+        old_ms = best_of(args.repeat, old)
+        new_ms = best_of(args.repeat, new)
+        print(f"{name:8} {args.rows} rows  old={old_ms:9.1f}ms  new={new_ms:8.1f}ms  speedup={old_ms / new_ms:5.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,128 @@
+"""Concurrent order status updates, load/mutate/commit/refresh vs app.ordering.transition_order.
+
+old: SELECT the order, set order_status in Python, commit, then refresh, as the
+     handlers did; concurrent updaters all "succeed" and overwrite each other
+new: transition_order, one conditional UPDATE ... RETURNING per attempt; one
+     updater wins each transition, the others get a 409
+
+Every order gets --updaters concurrent staff updaters that each try to move it
+PENDING -> IN-TRANSIT -> DELIVERED. "applied" counts the updates reported as
+successful, a state machine allows exactly 2 per order.
+
+    python -m app.benchmarks.transitions --restaurant-id 1 --user-id 1 --orders 200 --updaters 8
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+
+from fastapi.exceptions import HTTPException
+from sqlalchemy import event, insert, delete
+
+from app.database import AsyncSession, async_engine
+from app.models import Orders
+from app.notifications import order_status_hub
+from app.ordering import transition_order
+from app.stats import record_status_change, rebuild_stats
+
+COMMENT = 'transition-benchmark'
+PATH = ('IN-TRANSIT', 'DELIVERED')
+
+
+async def old_update(order_id, order_status, restaurant_id):
+    async with AsyncSession() as session:
+        order = await session.get(Orders, order_id)
+        await record_status_change(session, order.restaurant_id, order.order_status, order_status)
+        order.order_status = order_status
+        await order_status_hub.notify(session, order.id, order_status)
+        await session.commit()
+        await session.refresh(order)
+    return True
+
+
+async def new_update(order_id, order_status, restaurant_id):
+    async with AsyncSession() as session:
+        try:
+            await transition_order(session, order_id, order_status, restaurant_id=restaurant_id)
+        except HTTPException as e:
+            if e.status_code != 409:
+                raise
+            return False
+        await session.commit()
+    return True
+
+
+async def create_orders(args):
+    now = datetime.datetime.utcnow()
+    async with AsyncSession() as session:
+        result = await session.execute(insert(Orders).returning(Orders.id), [
+            {'order_status': 'PENDING', 'order_time': now, 'delivery_address': '1960 W CHELSEA AVE', 'comment': COMMENT,
+             'user_id': args.user_id, 'restaurant_id': args.restaurant_id, 'total_price': 10}
+            for _ in range(args.orders)
+        ])
+        order_ids = result.scalars().all()
+        await session.commit()
+    return order_ids
+
+
+async def cleanup(restaurant_id):
+    async with AsyncSession() as session:
+        await session.execute(delete(Orders).filter(Orders.comment == COMMENT))
+        # The old handler's overlapping updates skewed the status counts
+        await rebuild_stats(session, restaurant_id)
+        await session.commit()
+
+
+async def run(handler, order_ids, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    outcomes = []
+
+    async def updater(order_id):
+        for order_status in PATH:
+            async with semaphore:
+                start = time.perf_counter()
+                outcomes.append(await handler(order_id, order_status, args.restaurant_id))
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(updater(order_id) for order_id in order_ids for _ in range(args.updaters)))
+    elapsed = time.perf_counter() - start
+    return elapsed, latencies, outcomes
+
+
+async def main(args):
+    statements = 0
+
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', count)
+    print(f"{'':6}{'wall_s':>9}{'updates/s':>11}{'p50_ms':>9}{'p95_ms':>9}{'stmts/upd':>11}"
+          f"{'applied':>9}{'conflicts':>11}{'expected':>10}")
+    try:
+        for name, handler in (('old', old_update), ('new', new_update)):
+            order_ids = await create_orders(args)
+            statements = 0
+            elapsed, latencies, outcomes = await run(handler, order_ids, args)
+            latencies.sort()
+            applied = sum(outcomes)
+            print(f"{name:6}{elapsed:>9.2f}{len(outcomes) / elapsed:>11.1f}"
+                  f"{statistics.median(latencies) * 1000:>9.2f}{latencies[int(len(latencies) * 0.95)] * 1000:>9.2f}"
+                  f"{statements / len(outcomes):>11.2f}{applied:>9}{len(outcomes) - applied:>11}{len(order_ids) * len(PATH):>10}")
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute', count)
+        await cleanup(args.restaurant_id)
+        await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restaurant-id', type=int, required=True)
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--updaters', type=int, default=8, help="concurrent updaters per order")
+    parser.add_argument('--concurrency', type=int, default=15, help="updates in flight, keep within the pool")
+    asyncio.run(main(parser.parse_args()))
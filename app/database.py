@@ -1,9 +1,12 @@
+import time
+import threading
 from sqlalchemy import create_engine, URL
 import os
 from dotenv import load_dotenv
 load_dotenv()
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 url_object = URL.create(
     "postgresql",
@@ -13,31 +16,147 @@ url_object = URL.create(
     database=os.environ.get("DB_NAME"),
 )
 
-# database_str = 'postgresql://' + os.environ.get('DB_HOST') + ":" + os.environ.get('DB_USER_PASSWORD') + "@" + os.environ.get('DB_HOST') + "/" + os.environ.get("DB_NaDB_NAMEm")
+# Used by the request handlers, the sync psycopg2 engine stays for app.archive, app.datagen and the benchmarks
+async_url_object = url_object.set(drivername="postgresql+asyncpg")
+
+# Size the pool so that workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below
+# Postgres max_connections (minus the connections reserved for superusers/maintenance)
+POOL_SETTINGS = {
+    'pool_size': int(os.environ.get("DB_POOL_SIZE", 10)),
+    'max_overflow': int(os.environ.get("DB_MAX_OVERFLOW", 5)),
+    'pool_timeout': float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    'pool_recycle': int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    'pool_pre_ping': os.environ.get("DB_POOL_PRE_PING", "true").lower() in ('1', 'true', 'yes'),
+}
+
+# Sent with every asyncpg connection. pg_trgm.word_similarity_threshold is the cut-off of the <%
+# operator in app.search, at its default (0.6) a single typo in a short word ("margarta") misses
+SERVER_SETTINGS = {
+    'pg_trgm.word_similarity_threshold': os.environ.get("SEARCH_WORD_SIMILARITY", "0.5"),
+}
+
+# Logs every statement, for local debugging only; app.slowlog reports the slow ones
+DB_ECHO = os.environ.get("DB_ECHO", "false").lower() in ('1', 'true', 'yes')
+
+
+class PoolCheckoutStats:
+    """Checkout wait times recorded by the pool, read by /pool-status."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }
+
+
+class _TimedPoolMixin:
+    checkout_stats = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except Exception:
+            self.checkout_stats.record(0.0, timed_out=True)
+            raise
+        self.checkout_stats.record(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    checkout_stats = PoolCheckoutStats()
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    checkout_stats = PoolCheckoutStats()
+
+
+class TimedReplicaQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    checkout_stats = PoolCheckoutStats()
+
+
+# create_engine doesn't connect, the pool opens connections on first use; app.health warms it up at startup
 engine = create_engine(url_object,
-                       echo=True
+                       echo=DB_ECHO,
+                       poolclass=TimedQueuePool,
+                       **POOL_SETTINGS
                        )
 
-try:
-    engine.connect()
-    print('Connection with DB is active and working')
 
-except DBAPIError as e:
-    print("Connection Error :", str(e))
+Base = declarative_base()
 
-    try:
-        engine.dispose()
-        engine = create_engine(url_object,
-                               echo=True
-                               )
-        engine.connect()
+Session = sessionmaker(bind=engine)
 
-    except DBAPIError as e:
-        print("Reconnection Error :", str(e))
+async_engine = create_async_engine(async_url_object,
+                                   echo=DB_ECHO,
+                                   poolclass=TimedAsyncQueuePool,
+                                   connect_args={'server_settings': SERVER_SETTINGS},
+                                   **POOL_SETTINGS
+                                   )
 
+# expire_on_commit=False: attributes can't be lazily reloaded after commit without an await
+AsyncSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 
+# Optional streaming replica for the read-only routes, credentials default to the primary's; see app.replicas
+DB_REPLICA_HOST = os.environ.get("DB_REPLICA_HOST")
+replica_engine = None
+ReplicaSession = None
+if DB_REPLICA_HOST:
+    replica_url_object = async_url_object.set(
+        username=os.environ.get("DB_REPLICA_USER", url_object.username),
+        password=os.environ.get("DB_REPLICA_PASSWORD", url_object.password),
+        host=DB_REPLICA_HOST,
+        port=int(os.environ["DB_REPLICA_PORT"]) if os.environ.get("DB_REPLICA_PORT") else None,
+        database=os.environ.get("DB_REPLICA_NAME", url_object.database),
+    )
+    replica_engine = create_async_engine(replica_url_object,
+                                         echo=DB_ECHO,
+                                         poolclass=TimedReplicaQueuePool,
+                                         connect_args={'server_settings': SERVER_SETTINGS},
+                                         **POOL_SETTINGS
+                                         )
+    ReplicaSession = async_sessionmaker(bind=replica_engine, expire_on_commit=False)
 
-Base = declarative_base()
 
-Session = sessionmaker()
+async def get_async_session():
+    async with AsyncSession() as session:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+
 
+def pool_stats(db_engine=None):
+    pool = (db_engine or async_engine).pool
+    size = pool.size()
+    checked_out = pool.checkedout()
+    capacity = size + max(pool._max_overflow, 0)
+    return {
+        'pool_size': size,
+        'max_overflow': pool._max_overflow,
+        'checked_in': pool.checkedin(),
+        'checked_out': checked_out,
+        'overflow': max(pool.overflow(), 0),
+        'saturation': round(checked_out / capacity, 3) if capacity else 0.0,
+        **pool.checkout_stats.snapshot(),
+    }
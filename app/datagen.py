@@ -0,0 +1,259 @@
+"""Synthetic data for load tests, written with COPY in parallel chunks.
+
+    python -m app.datagen --restaurants 2000 --users 200000 --orders 5000000 --workers 8
+
+The same --seed and sizes on the same database give the same rows, whatever
+the number of workers (times are relative to the start of the run). Rows get explicit ids after each table's current
+maximum and the sequences are moved past them at the end, so run it while
+nothing else writes. Popularity is skewed (Zipf): a few restaurants, dishes
+and users get most of the orders. Recent months hold more orders than old
+ones and only the last hours have orders that aren't DELIVERED yet.
+
+Generated accounts are gen_user_<id> / gen_shop_<id>, all with the password
+--password. The app.stats summary tables are rebuilt at the end.
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import itertools
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from app.archive import ensure_partitions
+from app.database import engine, async_engine, AsyncSession
+from app.hashing import HASH_METHOD, HASH_SALT_LENGTH
+from app.stats import rebuild_stats
+
+
+DEFAULT_PASSWORD = 'datagen'
+USERNAME_PREFIX = 'gen'
+CATEGORIES = ('pizza', 'burger', 'sushi', 'salad', 'pasta', 'dessert', 'drinks', 'curry', 'soup', 'vegan')
+DISHES = ('margherita', 'diavola', 'carbonara', 'lasagna', 'ramen', 'pad thai', 'cheeseburger', 'caesar', 'tiramisu',
+          'falafel', 'maki roll', 'tacos', 'tikka', 'pho', 'gyoza', 'risotto', 'kebab', 'poke bowl', 'lemonade', 'brownie')
+WORDS = ('spicy', 'cheese', 'chicken', 'tomato', 'basil', 'garlic', 'vegan', 'salmon', 'rice', 'beef', 'mushroom',
+         'lemon', 'crispy', 'fresh', 'smoked', 'homemade', 'grilled', 'sweet', 'tofu', 'pepper')
+STREETS = ('Main street', 'Oak avenue', 'Station road', 'Harbour lane', 'Market square', 'Mill road', 'Park row')
+
+MAX_MENU_SIZE = 500
+# Zipf exponents: higher is more skewed
+RESTAURANT_SKEW = 1.1
+DISH_SKEW = 0.9
+USER_SKEW = 0.7
+# Order age is days * random() ** RECENCY, above 1 packs orders towards the present
+RECENCY = 1.5
+OPEN_ORDER_AGE = 2 * 3600
+OPEN_STATUSES = ('PENDING', 'IN-TRANSIT')
+LINE_COUNTS = (1, 2, 3, 4, 5, 6, 7, 8)
+LINE_WEIGHTS = tuple(itertools.accumulate((30, 25, 18, 11, 7, 4, 3, 2)))
+QUANTITIES = (1, 2, 3, 4)
+QUANTITY_WEIGHTS = tuple(itertools.accumulate((70, 20, 7, 3)))
+# Months of partitions created ahead, as app.archive does
+MONTHS_AHEAD = 3
+
+ORDER_COLUMNS = 'id, order_status, order_time, delivery_address, user_id, restaurant_id, total_price'
+ORDER_ITEM_COLUMNS = 'orders_id, food_item_id, quantity, unit_price'
+
+_context = None
+
+
+def zipf_weights(count, exponent):
+    """Cumulative weights for random.choices, rank 1 most likely."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def _money(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def _copy(cursor, table, columns, lines):
+    buffer = io.StringIO()
+    buffer.writelines(lines)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+
+
+def _next_id(connection, table):
+    return connection.execute(text(f"SELECT coalesce(max(id), 0) + 1 FROM {table}")).scalar()
+
+
+def generate_catalog(connection, args, password, now):
+    """Write categories, restaurants, users and menus; return what the order chunks pick from."""
+    rng = random.Random(f'{args.seed}:catalog')
+    cursor = connection.connection.cursor()
+
+    category_ids = connection.execute(text("SELECT id FROM food_category ORDER BY id")).scalars().all()
+    if not category_ids:
+        first_id = _next_id(connection, 'food_category')
+        _copy(cursor, 'food_category', 'id, category_name',
+              (f'{first_id + n}\t{name}\n' for n, name in enumerate(CATEGORIES)))
+        category_ids = list(range(first_id, first_id + len(CATEGORIES)))
+
+    first_id = _next_id(connection, 'restaurant')
+    restaurant_ids = list(range(first_id, first_id + args.restaurants))
+    _copy(cursor, 'restaurant', 'id, username, name, email, phone_number, address, password, is_staff, is_administrator', (
+        f'{id}\t{USERNAME_PREFIX}_shop_{id}\t{USERNAME_PREFIX} shop {id}\t{USERNAME_PREFIX}_shop_{id}@example.com\t'
+        f'+2{id:012d}\t{rng.choice(STREETS)}\t{password}\tt\tt\n'
+        for id in restaurant_ids
+    ))
+
+    first_id = _next_id(connection, 'users')
+    user_ids = list(range(first_id, first_id + args.users))
+    span = args.days * 86400
+    _copy(cursor, 'users', 'id, username, name, lastname, email, phone_number, address, password, is_active, time_joined', (
+        f'{id}\t{USERNAME_PREFIX}_user_{id}\tUser\t{id}\t{USERNAME_PREFIX}_user_{id}@example.com\t+1{id:012d}\t'
+        f'{rng.choice(STREETS)}\t{password}\tt\t{datetime.datetime.utcfromtimestamp(now - span * rng.random()):%Y-%m-%d %H:%M:%S}\n'
+        for id in user_ids
+    ))
+
+    next_item_id = _next_id(connection, 'fooditem')
+    menus = {}
+    items = []
+    for restaurant_id in restaurant_ids:
+        size = min(MAX_MENU_SIZE, max(5, int(rng.lognormvariate(math.log(args.menu_size), 0.6))))
+        item_ids = list(range(next_item_id, next_item_id + size))
+        prices = [rng.randrange(350, 2800, 10) for _ in item_ids]
+        next_item_id += size
+        menus[restaurant_id] = (item_ids, prices, zipf_weights(size, DISH_SKEW))
+        for n, (item_id, price) in enumerate(zip(item_ids, prices)):
+            active = 't' if rng.random() < 0.95 else 'f'
+            items.append(
+                f'{item_id}\t{rng.choice(DISHES)} {n}\t{" ".join(rng.choices(WORDS, k=6))}\t{", ".join(rng.choices(WORDS, k=3))}\t'
+                f'{_money(price)}\t{active}\t{rng.choice(category_ids)}\t{restaurant_id}\n'
+            )
+    _copy(cursor, 'fooditem', 'id, name, description, ingredients, price, is_active, category_id, restaurant_id', items)
+
+    # Popularity isn't tied to the id order
+    rng.shuffle(restaurant_ids)
+    rng.shuffle(user_ids)
+    return {
+        'seed': args.seed,
+        'now': now,
+        'span': span,
+        'restaurant_ids': restaurant_ids,
+        'restaurant_weights': zipf_weights(len(restaurant_ids), RESTAURANT_SKEW),
+        'user_ids': user_ids,
+        'user_weights': zipf_weights(len(user_ids), USER_SKEW),
+        'menus': menus,
+    }
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+    # Connections inherited from the parent process must not be used here
+    engine.dispose(close=False)
+
+
+def copy_orders(chunk):
+    """Generate one chunk of orders with their lines and COPY it in its own transaction."""
+    index, first_id, count = chunk
+    context = _context
+    rng = random.Random(f"{context['seed']}:orders:{index}")
+    restaurants = rng.choices(context['restaurant_ids'], cum_weights=context['restaurant_weights'], k=count)
+    users = rng.choices(context['user_ids'], cum_weights=context['user_weights'], k=count)
+    line_counts = rng.choices(LINE_COUNTS, cum_weights=LINE_WEIGHTS, k=count)
+    menus, now, span = context['menus'], context['now'], context['span']
+
+    orders, lines = [], []
+    for order_id, restaurant_id, user_id, line_count in zip(itertools.count(first_id), restaurants, users, line_counts):
+        item_ids, prices, weights = menus[restaurant_id]
+        total = 0
+        for position, quantity in zip(rng.choices(range(len(item_ids)), cum_weights=weights, k=line_count),
+                                      rng.choices(QUANTITIES, cum_weights=QUANTITY_WEIGHTS, k=line_count)):
+            total += prices[position] * quantity
+            lines.append(f'{order_id}\t{item_ids[position]}\t{quantity}\t{_money(prices[position])}\n')
+        age = span * rng.random() ** RECENCY
+        order_status = 'DELIVERED' if age > OPEN_ORDER_AGE else rng.choice(OPEN_STATUSES)
+        orders.append(f'{order_id}\t{order_status}\t{datetime.datetime.utcfromtimestamp(now - age):%Y-%m-%d %H:%M:%S}\t'
+                      f'{rng.choice(STREETS)}\t{user_id}\t{restaurant_id}\t{_money(total)}\n')
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        _copy(cursor, 'orders', ORDER_COLUMNS, orders)
+        _copy(cursor, 'order_item', ORDER_ITEM_COLUMNS, lines)
+        connection.commit()
+    finally:
+        connection.close()
+    return count, len(lines)
+
+
+async def _rebuild_stats():
+    async with AsyncSession() as session:
+        await rebuild_stats(session)
+        await session.commit()
+    await async_engine.dispose()
+
+
+def main(args):
+    started = time.perf_counter()
+    now = time.time()
+    password = generate_password_hash(args.password, method=HASH_METHOD, salt_length=HASH_SALT_LENGTH)
+
+    with engine.connect() as connection:
+        with connection.begin():
+            since = datetime.datetime.utcfromtimestamp(now - args.days * 86400).date()
+            ensure_partitions(connection, MONTHS_AHEAD, since=since)
+        with connection.begin():
+            context = generate_catalog(connection, args, password, now)
+            first_order_id = _next_id(connection, 'orders')
+    item_count = sum(len(item_ids) for item_ids, _, _ in context['menus'].values())
+    print(f"catalog: {args.restaurants} restaurants, {item_count} food items, {args.users} users "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    chunks = [
+        (index, first_order_id + start, min(args.chunk_size, args.orders - start))
+        for index, start in enumerate(range(0, args.orders, args.chunk_size))
+    ]
+    orders_started = time.perf_counter()
+    written = lines = 0
+    if args.workers > 1:
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(context,)) as pool:
+            results = pool.map(copy_orders, chunks)
+            for chunk_orders, chunk_lines in results:
+                written += chunk_orders
+                lines += chunk_lines
+                print(f"  {written}/{args.orders} orders", end='\r', flush=True)
+    else:
+        _init_worker(context)
+        for chunk in chunks:
+            chunk_orders, chunk_lines = copy_orders(chunk)
+            written += chunk_orders
+            lines += chunk_lines
+            print(f"  {written}/{args.orders} orders", end='\r', flush=True)
+    elapsed = time.perf_counter() - orders_started
+    print(f"\rorders: {written} orders, {lines} lines in {elapsed:.1f}s ({written / max(elapsed, 1e-9) * 60:,.0f} orders/min)")
+
+    with engine.begin() as connection:
+        for table in ('food_category', 'restaurant', 'users', 'fooditem', 'orders', 'order_item'):
+            connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
+    if not args.skip_stats:
+        asyncio.run(_rebuild_stats())
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text("ANALYZE"))
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--restaurants', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--menu-size', type=int, default=40, help="median food items per restaurant")
+    parser.add_argument('--days', type=int, default=365, help="order history length")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=50_000, help="orders per COPY transaction")
+    parser.add_argument('--skip-stats', action='store_true', help="don't rebuild the summary tables")
+    return parser
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -0,0 +1,111 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+# werkzeug method string, e.g. "pbkdf2:sha256:600000" or "scrypt:32768:8:1".
+# Stored hashes made with other parameters are upgraded on the next successful login.
+HASH_METHOD = os.environ.get("HASH_METHOD", "pbkdf2:sha256:600000")
+HASH_SALT_LENGTH = int(os.environ.get("HASH_SALT_LENGTH", 16))
+
+# process: hashing never competes with the event loop for the GIL; thread: no fork, less memory
+HASH_POOL = os.environ.get("HASH_POOL", "process").lower()
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Hashes waiting for or running on a worker, past that sign-ups and logins get a 503
+HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", HASH_WORKERS * 8))
+HASH_RETRY_AFTER = 1
+
+
+def stored_method(method):
+    """The method as werkzeug writes it into the hash, its defaults spelled out ("pbkdf2" -> "pbkdf2:sha256:600000")."""
+    name, *args = method.split(':')
+    if name == 'pbkdf2' and len(args) < 2:
+        hash_name = args[0] if args else 'sha256'
+        return f'pbkdf2:{hash_name}:{DEFAULT_PBKDF2_ITERATIONS}'
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    return method
+
+
+class PasswordHasher:
+    """Runs password hashing on a small dedicated pool instead of the event loop.
+
+    A PBKDF2/scrypt hash takes tens to hundreds of milliseconds of CPU; done
+    inline it stalls every other request on the worker. The number of hashes
+    in flight is capped so a burst of logins is shed with a 503 rather than
+    queueing behind each other until the clients time out.
+    """
+
+    def __init__(self, method, salt_length, workers, max_pending, pool='process'):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = pool
+        self.pending = 0
+        self.rejected = 0
+        self.rehashes_skipped = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.pool == 'thread':
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='hashing')
+            else:
+                self._executor = ProcessPoolExecutor(self.workers)
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many authentication requests, try again shortly",
+                                headers={'Retry-After': str(HASH_RETRY_AFTER)})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        return await self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    async def verify(self, pwhash, password):
+        """Return (valid, new_hash), new_hash is set when the stored hash should be replaced."""
+        if not await self._run(check_password_hash, pwhash, password):
+            return False, None
+        if self.needs_rehash(pwhash):
+            if self.pending >= self.max_pending:
+                # Best effort: the password is right, the upgrade can wait for a quieter login
+                self.rehashes_skipped += 1
+                return True, None
+            return True, await self.hash(password)
+        return True, None
+
+    def needs_rehash(self, pwhash):
+        method, _, rest = pwhash.partition('$')
+        salt = rest.partition('$')[0]
+        return method != stored_method(self.method) or len(salt) != self.salt_length
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            'method': self.method,
+            'pool': self.pool,
+            'workers': self.workers,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected,
+            'rehashes_skipped': self.rehashes_skipped,
+        }
+
+
+password_hasher = PasswordHasher(HASH_METHOD, HASH_SALT_LENGTH, HASH_WORKERS, HASH_MAX_PENDING, HASH_POOL)
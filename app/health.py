@@ -0,0 +1,104 @@
+"""Database warm-up and the state behind /healthz and /readyz.
+
+Nothing connects at import: the engines in app.database open connections on
+first use. At startup the worker schedules warm_up() in the background and
+starts serving right away; it retries with exponential backoff until the
+database answers, then opens DB_WARMUP_CONNECTIONS pool connections so the
+first requests don't pay the connect. /readyz stays 503 until then, and again
+whenever a ping fails or the pool has no connection left to give.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import text
+
+from app.database import async_engine, pool_stats
+
+
+logger = logging.getLogger(__name__)
+
+DB_WARMUP_CONNECTIONS = int(os.environ.get("DB_WARMUP_CONNECTIONS", 0))
+DB_CONNECT_BACKOFF = float(os.environ.get("DB_CONNECT_BACKOFF", 0.5))
+DB_CONNECT_BACKOFF_MAX = float(os.environ.get("DB_CONNECT_BACKOFF_MAX", 30))
+DB_READY_TIMEOUT = float(os.environ.get("DB_READY_TIMEOUT", 2))
+
+
+class DatabaseReadiness:
+
+    def __init__(self, db_engine):
+        self.engine = db_engine
+        self.ready = False
+        self.attempts = 0
+        self.last_error = None
+        self.warmed = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.warm_up())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def warm_up(self):
+        delay = DB_CONNECT_BACKOFF
+        while True:
+            self.attempts += 1
+            try:
+                self.warmed = await self._open(max(DB_WARMUP_CONNECTIONS, 1))
+                break
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                logger.warning("Database not reachable (attempt %d), retrying in %.1fs: %s", self.attempts, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, DB_CONNECT_BACKOFF_MAX)
+        self.ready = True
+        self.last_error = None
+        logger.info("Database ready after %d attempt(s), %d pooled connection(s)", self.attempts, self.warmed)
+
+    async def _open(self, count):
+        # Held together so the pool keeps `count` distinct connections when they are returned
+        count = min(count, self.engine.pool.size())
+        connections = []
+        try:
+            for _ in range(count):
+                async with asyncio.timeout(DB_READY_TIMEOUT):
+                    connection = await self.engine.connect()
+                connections.append(connection)
+                await connection.execute(text('SELECT 1'))
+        finally:
+            for connection in connections:
+                await connection.close()
+        return count
+
+    async def ping(self):
+        start = time.perf_counter()
+        async with asyncio.timeout(DB_READY_TIMEOUT):
+            async with self.engine.connect() as connection:
+                await connection.execute(text('SELECT 1'))
+        return round((time.perf_counter() - start) * 1000, 3)
+
+    async def check(self):
+        """(ready, details) for /readyz."""
+        pool = pool_stats(self.engine)
+        details = {'warm_up': {'done': self.ready, 'attempts': self.attempts, 'connections': self.warmed}, 'pool': pool}
+        if not self.ready:
+            details['error'] = self.last_error
+            return False, details
+        if pool['saturation'] >= 1:
+            # Every connection is checked out, a ping would only wait for pool_timeout
+            details['error'] = 'pool exhausted'
+            return False, details
+        try:
+            details['ping_ms'] = await self.ping()
+        except Exception as e:
+            details['error'] = str(e) or type(e).__name__
+            return False, details
+        return True, details
+
+
+database_readiness = DatabaseReadiness(async_engine)
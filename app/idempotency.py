@@ -0,0 +1,130 @@
+"""Idempotency-Key support for /order/place-order.
+
+The key is claimed with an INSERT ... ON CONFLICT in the order's own
+transaction, and the response is stored by the same transaction before it
+commits, so a key is either unused or has a complete response. A retry of a
+committed request gets that response back without pricing or inserting
+anything. A duplicate sent while the first request is still running waits on
+the key's row in the unique index, not on the table, and then replays it. If
+the first request fails it rolls the claim back, and the retry runs normally.
+
+Keys belong to the user who sent them and expire after IDEMPOTENCY_KEY_TTL
+seconds. An expired key is claimed again as if it were new, and every worker
+deletes expired keys in small batches every IDEMPOTENCY_PURGE_INTERVAL seconds.
+"""
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from fastapi.responses import Response
+from sqlalchemy import select, delete, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import AsyncSession
+from app.models import IdempotencyKey
+
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_TTL = datetime.timedelta(seconds=float(os.environ.get("IDEMPOTENCY_KEY_TTL", 24 * 3600)))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", 300))
+IDEMPOTENCY_PURGE_BATCH = 1000
+
+# SKIP LOCKED: workers purging at the same time take different rows instead of queueing
+PURGE_EXPIRED = text("""
+    DELETE FROM idempotency_keys WHERE (user_id, key) IN (
+        SELECT user_id, key FROM idempotency_keys WHERE expires_at < :now
+        ORDER BY expires_at LIMIT :batch FOR UPDATE SKIP LOCKED
+    )
+""")
+
+
+def request_hash(body):
+    """Fingerprint of a validated request model, a reused key must come with the same request."""
+    return hashlib.sha256(body.json(sort_keys=True).encode()).hexdigest()
+
+
+def _insert(session):
+    dialect = postgresql if session.bind.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(IdempotencyKey)
+
+
+async def claim(session, user_id, key, fingerprint):
+    """Reserve `key` in the current transaction, or return the stored response of the request that used it."""
+    now = datetime.datetime.utcnow()
+    statement = _insert(session).values(user_id=user_id, key=key, request_hash=fingerprint,
+                                        created_at=now, expires_at=now + IDEMPOTENCY_KEY_TTL)
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'key'],
+        set_={name: statement.excluded[name] for name in ('request_hash', 'created_at', 'expires_at')}
+             | {'status_code': None, 'response': None},
+        where=IdempotencyKey.expires_at < now,
+    ).returning(IdempotencyKey.key)
+    while (await session.execute(statement)).first() is None:
+        stored = (await session.execute(
+            select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response)
+            .filter_by(user_id=user_id, key=key)
+        )).first()
+        if stored is None:
+            # Purged between the two statements, claim it again
+            continue
+        if stored.request_hash != fingerprint:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Idempotency-Key was already used with a different request")
+        return Response(content=stored.response, status_code=stored.status_code, media_type='application/json',
+                        headers={'Idempotent-Replayed': 'true'})
+    return None
+
+
+async def store(session, user_id, key, response):
+    """Save the response for replays, before the transaction that claimed `key` commits."""
+    table = IdempotencyKey.__table__
+    await session.execute(
+        table.update()
+        .where(table.c.user_id == user_id, table.c.key == key)
+        .values(status_code=response.status_code, response=response.body)
+    )
+
+
+async def purge_expired(session):
+    now = datetime.datetime.utcnow()
+    if session.bind.dialect.name == 'postgresql':
+        result = await session.execute(PURGE_EXPIRED, {'now': now, 'batch': IDEMPOTENCY_PURGE_BATCH})
+    else:
+        result = await session.execute(delete(IdempotencyKey).filter(IdempotencyKey.expires_at < now))
+    await session.commit()
+    return result.rowcount
+
+
+class ExpiredKeyPurger:
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with AsyncSession() as session:
+                    # A full batch means there is more, keep going before sleeping again
+                    while await purge_expired(session) >= IDEMPOTENCY_PURGE_BATCH:
+                        pass
+            except Exception as e:
+                logger.warning("Purging expired idempotency keys failed: %s", e)
+
+
+expired_key_purger = ExpiredKeyPurger(IDEMPOTENCY_PURGE_INTERVAL)
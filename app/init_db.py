@@ -1,4 +1,7 @@
-from database import engine
-from models import Base
+import os
+import subprocess
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+# The Alembic revisions own the schema: create_all would skip what they add in SQL (the search
+# vector, triggers, partitions) and leave a database that `alembic upgrade head` can't migrate.
+# Run as a command, this directory's alembic/ package would shadow the library on import
+subprocess.run(['alembic', 'upgrade', 'head'], cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.database import Base
+
+
+logger = logging.getLogger(__name__)
+
+# off: no counting; warn: log routes over budget; raise: answer 500 instead (use in tests/CI)
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "warn").lower()
+
+
+class QueryStats:
+    __slots__ = ('scope', 'statements', 'rows', 'entities', 'db_time', 'serialization_time')
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.statements = 0
+        self.rows = 0
+        self.entities = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+
+
+current_stats = ContextVar('current_query_stats', default=None)
+
+
+# The start time goes on the statement's execution context, not the connection: a statement
+# that fails never reaches after_cursor_execute and would leave it behind on the pooled connection
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats.get() is not None and context is not None:
+        context.query_stats_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats.get()
+    start = getattr(context, 'query_stats_start', None)
+    if stats is None or start is None:
+        return
+    stats.db_time += time.perf_counter() - start
+    stats.statements += 1
+    if cursor.description is not None:
+        # psycopg2 reports the row count of a SELECT, asyncpg's adapter buffers the rows instead
+        rowcount = cursor.rowcount if cursor.rowcount >= 0 else len(getattr(cursor, '_rows', ()))
+        stats.rows += rowcount
+
+
+@event.listens_for(Base, 'load', propagate=True)
+def _on_load(target, context):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.entities += 1
+
+
+def query_budget(statements=None, rows=None, entities=None):
+    """Declare the most work a route may do per request.
+
+        @core_router.get('/categories')
+        @query_budget(statements=1)
+        async def list_categories(...):
+    """
+    budget = {'statements': statements, 'rows': rows, 'entities': entities}
+
+    def decorator(endpoint):
+        endpoint.query_budget = {name: limit for name, limit in budget.items() if limit is not None}
+        return endpoint
+    return decorator
+
+
+def over_budget(endpoint, stats):
+    budget = getattr(endpoint, 'query_budget', None)
+    if not budget:
+        return {}
+    return {
+        name: {'limit': limit, 'actual': getattr(stats, name)}
+        for name, limit in budget.items() if getattr(stats, name) > limit
+    }
+
+
+class QueryStatsMiddleware:
+    """Counts statements, rows and hydrated entities per request.
+
+    The counts are returned in X-Query-* headers and compared to the route's
+    query_budget. Pure ASGI so the handler runs in the same context and the
+    SQLAlchemy events above see this request's QueryStats.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or QUERY_BUDGET_MODE == 'off':
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats(scope)
+        token = current_stats.set(stats)
+        replaced = False
+
+        async def send_with_stats(message):
+            nonlocal replaced
+            if replaced:
+                return
+            if message['type'] == 'http.response.start':
+                exceeded = over_budget(scope.get('endpoint'), stats)
+                if exceeded:
+                    route = getattr(scope.get('endpoint'), '__name__', scope['path'])
+                    logger.warning("Query budget exceeded by %s: %s", route, exceeded)
+                    if QUERY_BUDGET_MODE == 'raise':
+                        replaced = True
+                        body = json.dumps({'detail': 'Query budget exceeded', 'route': route, 'exceeded': exceeded}).encode()
+                        await send({'type': 'http.response.start', 'status': 500,
+                                    'headers': [(b'content-type', b'application/json')]})
+                        await send({'type': 'http.response.body', 'body': body})
+                        return
+                headers = list(message.get('headers', []))
+                headers += [
+                    (b'x-query-count', str(stats.statements).encode()),
+                    (b'x-query-rows', str(stats.rows).encode()),
+                    (b'x-query-entities', str(stats.entities).encode()),
+                ]
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_stats.reset(token)
@@ -0,0 +1,23 @@
+from sqlalchemy.orm import joinedload, selectinload, raiseload
+from app.models import Restaurant, User, FoodItem, Orders
+
+
+# Relationships default to lazy='raise_on_sql', each endpoint states what it loads instead.
+# raiseload() rather than noload(): unloaded relationships are left out of the response
+# instead of showing up empty, and touching one by mistake fails loudly.
+LOADER_PROFILES = {
+    # username -> principal lookups in the auth checks and order routes
+    'principal': [raiseload('*')],
+    # one menu item, or a page of them: many-to-one, joined in the same statement
+    'food': [joinedload(FoodItem.category)],
+    # a restaurant with its menu: second SELECT ... WHERE restaurant_id IN (...) instead of a wide join
+    'shop_menu': [selectinload(Restaurant.food_items).joinedload(FoodItem.category)],
+    'shop_list': [raiseload(Restaurant.food_items)],
+    'order': [raiseload('*')],
+    'shop_orders': [joinedload(Orders.user).raiseload(User.orders)],
+    'user_orders': [raiseload(User.orders)],
+}
+
+
+def loader_profile(name):
+    return LOADER_PROFILES[name]
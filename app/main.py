@@ -4,19 +4,42 @@ from app.routers.auth_routes import auth_router
 from app.routers.orders_router import order_router
 from app.routers.shop_router import shop_router
 from app.routers.core_router import core_router
+from app.routers.ops_router import ops_router
+from app.notifications import order_status_hub
+from app.hashing import password_hasher
+from app.health import database_readiness
+from app.idempotency import expired_key_purger
+from app.instrumentation import QueryStatsMiddleware
+from app.metrics import MetricsMiddleware
+from app.profiler import ProfilerMiddleware
+from app.replicas import ReadYourWritesMiddleware
+import app.slowlog  # registers the slow query listeners
 from fastapi_jwt_auth import AuthJWT
 from pydantic import BaseModel
-import inspect, re
 from fastapi import FastAPI
-from fastapi.routing import APIRoute
-from fastapi.openapi.utils import get_openapi
+from app.openapi import cached_openapi
 
 app = FastAPI()
 
+# Added first so it runs inside QueryStatsMiddleware and sees the request's QueryStats
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+
 app.include_router(auth_router)
 app.include_router(order_router)
 app.include_router(shop_router)
 app.include_router(core_router)
+app.include_router(ops_router)
+
+
+@app.on_event('shutdown')
+async def close_listeners():
+    await database_readiness.stop()
+    await expired_key_purger.stop()
+    await order_status_hub.stop()
+    password_hasher.shutdown()
 
 
 class Settings(BaseModel):
@@ -27,49 +50,18 @@ class Settings(BaseModel):
 def get_settings():
     return Settings()
 
-def custom_openapi():
-    if app.openapi_schema:
-        return app.openapi_schema
-
-    openapi_schema = get_openapi(
-        title = "My Auth API",
-        version = "1.0",
-        description = "An API with an Authorize Button",
-        routes = app.routes,
-    )
-
-    openapi_schema["components"]["securitySchemes"] = {
-        "Bearer Auth": {
-            "type": "apiKey",
-            "in": "header",
-            "name": "Authorization",
-            "description": "Enter: **'Bearer &lt;JWT&gt;'**, where JWT is the access token"
-        }
-    }
-
-    # Get all routes where jwt_optional() or jwt_required
-    api_router = [route for route in app.routes if isinstance(route, APIRoute)]
-
-    for route in api_router:
-        path = getattr(route, "path")
-        endpoint = getattr(route,"endpoint")
-        methods = [method.lower() for method in getattr(route, "methods")]
-
-        for method in methods:
-            # access_token
-            if (
-                re.search("jwt_required", inspect.getsource(endpoint)) or
-                re.search("fresh_jwt_required", inspect.getsource(endpoint)) or
-                re.search("jwt_optional", inspect.getsource(endpoint))
-            ):
-                openapi_schema["paths"][path][method]["security"] = [
-                    {
-                        "Bearer Auth": []
-                    }
-                ]
-
-    app.openapi_schema = openapi_schema
-    return app.openapi_schema
-
-
-app.openapi = custom_openapi
\ No newline at end of file
+
+# Built when the worker starts, not on the first /docs hit, see app.openapi
+app.openapi = lambda: cached_openapi(app)
+
+
+@app.on_event('startup')
+async def build_openapi_schema():
+    app.openapi()
+
+
+@app.on_event('startup')
+async def warm_up_database():
+    # In the background: the worker serves /healthz while the database comes up
+    database_readiness.start()
+    expired_key_purger.start()
@@ -0,0 +1,354 @@
+"""Bulk menu import and export, CSV or NDJSON, streamed in both directions.
+
+Columns: name, description, ingredients, price, is_active and either
+category (the category name) or category_id. Rows are matched to existing
+items of the restaurant by name, so exporting, editing and importing the
+file again updates the menu in place.
+"""
+import csv
+import decimal
+import io
+import json
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.dialects import sqlite
+
+from app.models import FoodItem, FoodCategory
+from app.serializers import dumps
+
+
+IMPORT_BATCH_SIZE = 5000
+MAX_IMPORT_ROWS = 200_000
+MAX_IMPORT_BYTES = 100 * 1024 * 1024
+# A row, or a CSV record spanning lines
+MAX_LINE_LENGTH = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+EXPORT_COLUMNS = ('id', 'name', 'description', 'ingredients', 'price', 'is_active', 'category')
+STAGING_COLUMNS = ('row_number', 'name', 'description', 'ingredients', 'price', 'is_active', 'category_id', 'category_name')
+
+_TRUE = {'1', 'true', 't', 'yes', 'y'}
+_FALSE = {'0', 'false', 'f', 'no', 'n'}
+
+
+class ImportReport:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def to_dict(self):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'rejected': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'errors_truncated': self.error_count > len(self.errors),
+        }
+
+
+def _decode(line, encoding):
+    try:
+        return line.decode(encoding)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The upload is not valid UTF-8")
+
+
+def _check_line_length(length):
+    if length > MAX_LINE_LENGTH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"A row is longer than {MAX_LINE_LENGTH} bytes")
+
+
+async def _lines(chunks):
+    # Split on the bytes, searching only the new chunk: b'\n' never occurs inside a UTF-8 sequence.
+    # Only the first line may start with a byte order mark
+    pending = bytearray()
+    encoding = 'utf-8-sig'
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > MAX_IMPORT_BYTES:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"At most {MAX_IMPORT_BYTES} bytes per import")
+        start = 0
+        while (end := chunk.find(b'\n', start)) != -1:
+            _check_line_length(len(pending) + end + 1 - start)
+            pending += chunk[start:end + 1]
+            yield _decode(pending, encoding)
+            pending.clear()
+            encoding = 'utf-8'
+            start = end + 1
+        pending += chunk[start:]
+        _check_line_length(len(pending))
+    if pending:
+        yield _decode(pending, encoding)
+
+
+async def _csv_records(chunks):
+    # csv.reader can't await the next chunk, so it is fed whole records: a record is complete once
+    # its quotes are balanced, quoted fields may contain newlines
+    header = None
+    record = []
+    record_length = 0
+    quotes = 0
+    async for line in _lines(chunks):
+        record.append(line)
+        record_length += len(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            _check_line_length(record_length)
+            continue
+        values = next(csv.reader(io.StringIO(''.join(record))), None)
+        record.clear()
+        record_length = quotes = 0
+        if not values:
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            continue
+        yield dict(zip(header, values))
+    if record:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unterminated quoted field in CSV")
+
+
+async def _ndjson_records(chunks):
+    async for line in _lines(chunks):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def _text(value, field, max_length, required=False):
+    if isinstance(value, list):
+        value = ', '.join(str(part) for part in value)
+    value = (str(value) if value is not None else '').strip()
+    if required and not value:
+        raise ValueError(f"{field} is required")
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def parse_item(record):
+    """Validate one decoded row, raise ValueError with a message for the report."""
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    try:
+        price = decimal.Decimal(str(record.get('price', '')).strip())
+    except decimal.InvalidOperation:
+        raise ValueError("price is not a number")
+    if not price.is_finite() or price < 0 or price >= 10 ** 6:
+        raise ValueError("price out of range")
+    is_active = record.get('is_active', True)
+    if not isinstance(is_active, bool):
+        flag = str(is_active).strip().lower()
+        if flag and flag not in _TRUE | _FALSE:
+            raise ValueError("is_active is not a boolean")
+        is_active = flag not in _FALSE
+    category_id = record.get('category_id')
+    category_name = record.get('category', record.get('category_name'))
+    if category_id not in (None, ''):
+        try:
+            category_id = int(category_id)
+        except ValueError:
+            raise ValueError("category_id is not an integer")
+        category_name = None
+    else:
+        category_id = None
+        category_name = _text(category_name, 'category', 10, required=True)
+    return {
+        'name': _text(record.get('name'), 'name', 20, required=True),
+        'description': _text(record.get('description'), 'description', 100),
+        'ingredients': _text(record.get('ingredients'), 'ingredients', 100),
+        'price': price.quantize(decimal.Decimal('0.01')),
+        'is_active': is_active,
+        'category_id': category_id,
+        'category_name': category_name,
+    }
+
+
+async def parse_upload(chunks, format, report):
+    """Yield batches of valid rows (with their row_number) from the request body."""
+    records = _csv_records(chunks) if format == 'csv' else _ndjson_records(chunks)
+    batch = []
+    async for record in records:
+        report.received += 1
+        row_number = report.received
+        if row_number > MAX_IMPORT_ROWS:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"At most {MAX_IMPORT_ROWS} rows per import")
+        try:
+            item = parse_item(record)
+        except ValueError as e:
+            report.error(row_number, str(e))
+            continue
+        item['row_number'] = row_number
+        batch.append(item)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def import_menu(session, restaurant_id, chunks, format, partial=False):
+    """Upsert the uploaded items into the restaurant's menu in the session's transaction.
+
+    Returns (report, ids of the written items). Unless `partial`, any rejected
+    row rejects the whole upload with a 422 carrying the report.
+    """
+    report = ImportReport()
+    if session.bind.dialect.name == 'postgresql':
+        food_item_ids = await _import_postgres(session, restaurant_id, parse_upload(chunks, format, report), report)
+    else:
+        food_item_ids = await _import_fallback(session, restaurant_id, parse_upload(chunks, format, report), report)
+    if report.error_count and not partial:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=report.to_dict())
+    return report, food_item_ids
+
+
+async def _import_postgres(session, restaurant_id, batches, report):
+    await session.execute(text("""
+        CREATE TEMPORARY TABLE menu_import (
+            row_number integer PRIMARY KEY,
+            name varchar(20) NOT NULL,
+            description varchar(100),
+            ingredients varchar(100),
+            price numeric(8, 2) NOT NULL,
+            is_active boolean NOT NULL,
+            category_id integer,
+            category_name varchar(10)
+        ) ON COMMIT DROP
+    """))
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    copy_connection = raw_connection.driver_connection
+    async for batch in batches:
+        await copy_connection.copy_records_to_table(
+            'menu_import', columns=STAGING_COLUMNS,
+            records=[tuple(item[column] for column in STAGING_COLUMNS) for item in batch],
+        )
+
+    # Categories are resolved and checked with one join over the whole upload
+    await session.execute(text("""
+        UPDATE menu_import SET category_id = food_category.id
+        FROM food_category
+        WHERE menu_import.category_id IS NULL AND food_category.category_name = menu_import.category_name
+    """))
+    rejected = await session.execute(text("""
+        DELETE FROM menu_import
+        WHERE NOT EXISTS (SELECT 1 FROM food_category WHERE food_category.id = menu_import.category_id)
+        RETURNING row_number, coalesce(category_name, category_id::text) AS category
+    """))
+    for row in rejected:
+        report.error(row.row_number, f"unknown category {row.category}")
+    superseded = await session.execute(text("""
+        DELETE FROM menu_import USING (
+            SELECT row_number, max(row_number) OVER (PARTITION BY name) AS last_row FROM menu_import
+        ) AS latest
+        WHERE menu_import.row_number = latest.row_number AND latest.row_number <> latest.last_row
+        RETURNING menu_import.row_number, latest.last_row
+    """))
+    for row in superseded:
+        report.error(row.row_number, f"duplicate name, superseded by row {row.last_row}")
+
+    written = await session.execute(text("""
+        INSERT INTO fooditem (name, description, ingredients, price, is_active, category_id, restaurant_id)
+        SELECT name, description, ingredients, price, is_active, category_id, :restaurant_id FROM menu_import
+        ON CONFLICT (restaurant_id, name) DO UPDATE SET
+            description = EXCLUDED.description,
+            ingredients = EXCLUDED.ingredients,
+            price = EXCLUDED.price,
+            is_active = EXCLUDED.is_active,
+            category_id = EXCLUDED.category_id
+        RETURNING id, (xmax = 0) AS inserted
+    """), {'restaurant_id': restaurant_id})
+    food_item_ids = []
+    for row in written:
+        food_item_ids.append(row.id)
+        if row.inserted:
+            report.inserted += 1
+        else:
+            report.updated += 1
+    return food_item_ids
+
+
+async def _import_fallback(session, restaurant_id, batches, report):
+    # Databases without COPY: same checks in Python, batched upserts
+    categories = await session.execute(select(FoodCategory.id, FoodCategory.category_name))
+    category_ids = {}
+    for category_id, category_name in categories:
+        category_ids[category_id] = category_id
+        category_ids.setdefault(category_name, category_id)
+    existing = set((await session.execute(select(FoodItem.name).filter(FoodItem.restaurant_id == restaurant_id))).scalars())
+
+    latest = {}
+    async for batch in batches:
+        for item in batch:
+            category_id = category_ids.get(item['category_id'] if item['category_id'] is not None else item['category_name'])
+            if category_id is None:
+                report.error(item['row_number'], f"unknown category {item['category_name'] or item['category_id']}")
+                continue
+            item['category_id'] = category_id
+            previous = latest.get(item['name'])
+            if previous is not None:
+                report.error(previous['row_number'], f"duplicate name, superseded by row {item['row_number']}")
+            latest[item['name']] = item
+
+    columns = ('name', 'description', 'ingredients', 'price', 'is_active', 'category_id')
+    items = list(latest.values())
+    for start in range(0, len(items), IMPORT_BATCH_SIZE):
+        values = [{**{column: item[column] for column in columns}, 'restaurant_id': restaurant_id}
+                  for item in items[start:start + IMPORT_BATCH_SIZE]]
+        statement = sqlite.insert(FoodItem).values(values)
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=['restaurant_id', 'name'],
+            set_={column: getattr(statement.excluded, column) for column in columns if column != 'name'},
+        ))
+    report.inserted = sum(1 for name in latest if name not in existing)
+    report.updated = len(latest) - report.inserted
+    if not latest:
+        return []
+    written = await session.execute(
+        select(FoodItem.id).filter(tuple_(FoodItem.restaurant_id, FoodItem.name).in_([(restaurant_id, name) for name in latest]))
+    )
+    return written.scalars().all()
+
+
+async def export_menu(session, restaurant_id, format):
+    """Yield the restaurant's menu as CSV or NDJSON chunks, reading it in batches."""
+    statement = (
+        select(FoodItem.id, FoodItem.name, FoodItem.description, FoodItem.ingredients, FoodItem.price,
+               FoodItem.is_active, FoodCategory.category_name.label('category'))
+        .outerjoin(FoodCategory, FoodCategory.id == FoodItem.category_id)
+        .filter(FoodItem.restaurant_id == restaurant_id)
+        .order_by(FoodItem.id)
+        .execution_options(yield_per=IMPORT_BATCH_SIZE)
+    )
+    result = await session.stream(statement)
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_COLUMNS)
+    async for rows in result.partitions():
+        if format == 'csv':
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield b''.join(dumps(row._asdict()) + b'\n' for row in rows)
+    if format == 'csv' and buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,191 @@
+"""Request, database, pool and serialization metrics in the Prometheus text format.
+
+Served by GET /metrics. Routes are labelled with their template (/food/{id}),
+requests that match no route share the label "unmatched", so the number of
+series stays bounded whatever paths clients send. Each worker process keeps
+its own numbers: scrape every worker, or run one worker per container.
+"""
+import bisect
+import os
+import threading
+import time
+
+from fastapi.routing import APIRoute
+
+from app.database import engine, async_engine, replica_engine, pool_stats
+from app.instrumentation import QueryStats, current_stats
+from app.replicas import replica_monitor
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ('1', 'true', 'yes')
+# Starlette appends the charset
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SERIALIZATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"')) for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per bucket counts (the last one is +Inf), sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + (bound,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Gauge:
+    """Read when scraped: `collect` returns {label values: value}."""
+
+    def __init__(self, name, help, labelnames=(), collect=None, type='gauge'):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.type = type
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type}'
+        for labels, value in sorted(self.collect().items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+POOLS = (('async', async_engine), ('sync', engine)) + ((('replica', replica_engine),) if replica_engine is not None else ())
+
+
+def _pool_values(key):
+    def collect():
+        return {(name,): pool_stats(db_engine)[key] for name, db_engine in POOLS}
+    return collect
+
+
+def _replica_lag():
+    if replica_monitor is None or replica_monitor.error is not None or replica_monitor.lag is None:
+        return {}
+    return {(): replica_monitor.lag}
+
+
+_in_progress = 0
+
+request_duration = Histogram('http_request_duration_seconds', "Time to the end of the response body.",
+                             ('method', 'route', 'status'))
+request_db_time = Histogram('http_request_db_seconds', "Time spent waiting on database statements per request.",
+                            ('route',))
+request_statements = Histogram('http_request_statements', "Database statements per request.",
+                               ('route',), STATEMENT_BUCKETS)
+request_serialization = Histogram('http_request_serialization_seconds', "Time spent encoding JSON per request.",
+                                  ('route',), SERIALIZATION_BUCKETS)
+
+METRICS = (
+    request_duration,
+    request_db_time,
+    request_statements,
+    request_serialization,
+    Gauge('http_requests_in_progress', "Requests being handled.", collect=lambda: {(): _in_progress}),
+    Gauge('db_pool_size', "Connections kept in the pool.", ('engine',), _pool_values('pool_size')),
+    Gauge('db_pool_checked_out', "Connections in use.", ('engine',), _pool_values('checked_out')),
+    Gauge('db_pool_overflow', "Connections open beyond pool_size.", ('engine',), _pool_values('overflow')),
+    Gauge('db_pool_checkouts_total', "Connections handed out by the pool.", ('engine',),
+          _pool_values('checkouts'), type='counter'),
+    Gauge('db_pool_checkout_timeouts_total', "Checkouts that failed waiting for a connection.", ('engine',),
+          _pool_values('timeouts'), type='counter'),
+    Gauge('db_replica_lag_seconds', "Replication lag at the last check, absent while the replica is unreachable.",
+          collect=_replica_lag),
+)
+
+
+def render_metrics():
+    lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+_route_templates = {}
+
+
+def route_template(scope):
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    template = _route_templates.get(endpoint)
+    if template is None:
+        for route in scope['app'].routes:
+            if isinstance(route, APIRoute):
+                _route_templates.setdefault(route.endpoint, route.path)
+        template = _route_templates.get(endpoint, 'unmatched')
+    return template
+
+
+class MetricsMiddleware:
+    """Observes every HTTP request once its response is finished.
+
+    Added before QueryStatsMiddleware so it runs inside it and reads the same
+    QueryStats; with QUERY_BUDGET_MODE=off it counts on its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_progress
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        stats = current_stats.get()
+        token = None
+        if stats is None:
+            stats = QueryStats(scope)
+            token = current_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+        _in_progress += 1
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _in_progress -= 1
+            route = route_template(scope)
+            request_duration.observe(time.perf_counter() - start, scope['method'], route, status)
+            request_db_time.observe(stats.db_time, route)
+            request_statements.observe(stats.statements, route)
+            request_serialization.observe(stats.serialization_time, route)
+            if token is not None:
+                current_stats.reset(token)
@@ -1,6 +1,6 @@
 import datetime
 from .database import Base
-from sqlalchemy import Table, Column, Integer, String, Text, Boolean, ForeignKey, DateTime, DECIMAL
+from sqlalchemy import Table, Column, Integer, String, Text, Boolean, ForeignKey, DateTime, Date, DECIMAL, Index, UniqueConstraint, LargeBinary
 from sqlalchemy_utils.types import ChoiceType
 from sqlalchemy.orm import relationship
 
@@ -15,7 +15,9 @@ class Restaurant(Base):
     phone_number = Column(String(20), unique=True)
     is_administrator = Column(Boolean, default=True)
     is_staff = Column(Boolean, default=True)
-    food_items = relationship('FoodItem', back_populates='restaurant', lazy='joined')
+    # Bumped whenever is_staff or is_administrator change, access tokens carry the version they were issued at
+    roles_version = Column(Integer, nullable=False, default=1, server_default='1')
+    food_items = relationship('FoodItem', back_populates='restaurant', lazy='raise_on_sql')
 
     def __repr__(self):
         return self.username
@@ -33,7 +35,7 @@ class User(Base):
     phone_number = Column(String(20), nullable=False)
     address = Column(String(25))
     time_joined = Column(DateTime, default=datetime.datetime.utcnow())
-    orders = relationship('Orders', back_populates='user', lazy='joined')
+    orders = relationship('Orders', back_populates='user', lazy='raise_on_sql')
 
     def __repr__(self):
         return f"<User {self.username}"
@@ -46,6 +48,8 @@ class FoodCategory(Base):
 
 class FoodItem(Base):
     __tablename__ = "fooditem"
+    # Bulk imports upsert on it, see app.menus
+    __table_args__ = (UniqueConstraint('restaurant_id', 'name', name='uq_fooditem_restaurant_name'),)
     id = Column(Integer, primary_key=True)
     name = Column(String(20), nullable=False)
     description = Column(String(100))
@@ -54,7 +58,7 @@ class FoodItem(Base):
     is_active = Column(Boolean, default=True)
     category_id = Column(Integer, ForeignKey('food_category.id'))
     restaurant_id = Column(Integer, ForeignKey('restaurant.id'))
-    category = relationship('FoodCategory', lazy='joined')
+    category = relationship('FoodCategory', lazy='raise_on_sql')
     restaurant = relationship('Restaurant', back_populates='food_items')
     order = relationship('OrderItem', back_populates='food_item')
 
@@ -80,19 +84,46 @@ class Orders(Base):
     ORDER_STATUSES = (
         ('PENDING', 'pending'),
         ('IN-TRANSIT', 'in-transit'),
-        ('DELIVERED', 'delivered')
+        ('DELIVERED', 'delivered'),
+        ('CANCELED', 'canceled'),
     )
+    # order_status -> statuses it can move to, applied by app.ordering.transition_order
+    TRANSITIONS = {
+        'PENDING': ('IN-TRANSIT', 'CANCELED'),
+        'IN-TRANSIT': ('DELIVERED', 'CANCELED'),
+        'DELIVERED': (),
+        'CANCELED': (),
+    }
     __tablename__ = 'orders'
+    # In Postgres orders is range partitioned by order_time and its primary key is (id, order_time),
+    # see the d41f8a6c2e97 migration and app.archive. id stays unique, it's what the ORM maps on.
+    __table_args__ = (
+        Index('ix_orders_restaurant_status_time', 'restaurant_id', 'order_status', 'order_time', 'id'),
+        Index('ix_orders_restaurant_time', 'restaurant_id', 'order_time', 'id'),
+        Index('ix_orders_user_time', 'user_id', 'order_time', 'id'),
+    )
     id = Column(Integer, primary_key=True)
     order_status = Column(ChoiceType(choices = ORDER_STATUSES), default='PENDING')
-    order_time = Column(DateTime, default=datetime.datetime.utcnow())
+    order_time = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
     estimated_time = Column(DateTime, nullable=True)
     delivery_address = Column(String(100), default=False)
     comment = Column(String(300))
     user_id = Column(Integer, ForeignKey('users.id'))
     restaurant_id = Column(Integer, ForeignKey('restaurant.id'))
+    total_price = Column(DECIMAL(precision=10, scale=2))
+    # Incremented by every update, a client sending back the version it read can't overwrite a newer change
+    version = Column(Integer, nullable=False, default=1, server_default='1')
     orders_list = relationship('OrderItem', back_populates='orders')
-    user = relationship('User', back_populates='orders', lazy='joined')
+    user = relationship('User', back_populates='orders', lazy='raise_on_sql')
+
+    @classmethod
+    def previous_statuses(cls, order_status):
+        return tuple(source for source, targets in cls.TRANSITIONS.items() if order_status in targets)
+
+    @classmethod
+    def open_statuses(cls):
+        # Orders that can still move on, the only ones whose details may change
+        return tuple(source for source, targets in cls.TRANSITIONS.items() if targets)
 
     def __repr__(self):
         return f"<Order : {self.id}>"
@@ -105,11 +136,49 @@ class OrderItem(Base):
     quantity = Column(Integer, nullable=False)
     comment = Column(String(20))
     food_item_id = Column(Integer, ForeignKey('fooditem.id'))
-    orders_id = Column(Integer, ForeignKey('orders.id'))
-    food_item = relationship('FoodItem', back_populates='order', lazy='joined')
+    # No foreign key constraint in Postgres once orders is partitioned, kept here for the relationship
+    orders_id = Column(Integer, ForeignKey('orders.id'), index=True)
+    unit_price = Column(DECIMAL(precision=8, scale=2))
+    food_item = relationship('FoodItem', back_populates='order', lazy='raise_on_sql')
     orders = relationship('Orders', back_populates='orders_list')
 
     def __repr__(self):
         return f"<Order Item : {self.id}>"
 
 
+
+
+# Summary tables maintained by app.stats in the same transaction as the order writes
+class RestaurantDailyStats(Base):
+    __tablename__ = 'restaurant_daily_stats'
+    restaurant_id = Column(Integer, ForeignKey('restaurant.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(precision=12, scale=2), nullable=False, default=0)
+
+
+class RestaurantStatusCount(Base):
+    __tablename__ = 'restaurant_status_count'
+    restaurant_id = Column(Integer, ForeignKey('restaurant.id'), primary_key=True)
+    order_status = Column(String(255), primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+
+
+class RestaurantItemSales(Base):
+    __tablename__ = 'restaurant_item_sales'
+    restaurant_id = Column(Integer, ForeignKey('restaurant.id'), primary_key=True)
+    food_item_id = Column(Integer, ForeignKey('fooditem.id'), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(precision=12, scale=2), nullable=False, default=0)
+
+
+# Stored responses of /order/place-order by Idempotency-Key, see app.idempotency
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    response = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
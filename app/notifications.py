@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import json
+import logging
+from collections import defaultdict
+
+import asyncpg
+from sqlalchemy import event, select, func
+
+from app.database import async_url_object
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_STATUS_CHANNEL = 'order_status'
+SUBSCRIBER_QUEUE_SIZE = 8
+RESYNC_SQL = 'SELECT id, order_status, version FROM orders WHERE id = any($1::integer[])'
+
+
+class OrderStatusHub:
+    """Fans order status changes out to the streaming clients of this worker.
+
+    Every worker keeps a single LISTEN connection, outside the pool, and
+    dispatches the NOTIFY payloads to in-memory queues, so an idle subscriber
+    costs a queue and a suspended coroutine instead of a DB connection.
+    A NOTIFY sent while that connection is down is lost, so after a
+    reconnect the subscribed orders are read again and published.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._subscribers = defaultdict(set)   # order id -> queues
+        self._connection = None
+        self._lock = None
+        self._closing = False
+        self._disconnected = False
+
+    def __len__(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def start(self):
+        if self._connection is not None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._connection is not None:
+                return
+            connection = await asyncpg.connect(
+                user=self.url.username,
+                password=self.url.password,
+                host=self.url.host,
+                port=self.url.port,
+                database=self.url.database,
+            )
+            await connection.add_listener(ORDER_STATUS_CHANNEL, self._on_notify)
+            connection.add_termination_listener(self._on_terminated)
+            self._closing = False
+            self._connection = connection
+            if self._disconnected:
+                self._disconnected = False
+                await self._resync(connection)
+
+    async def stop(self):
+        self._closing = True
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await connection.close()
+
+    def _on_terminated(self, connection):
+        self._connection = None
+        if not self._closing:
+            self._disconnected = True
+            logger.warning("LISTEN connection for %s lost, reconnecting", ORDER_STATUS_CHANNEL)
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 0.5
+        while not self._closing and self._connection is None:
+            try:
+                await self.start()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("LISTEN reconnect failed: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _resync(self, connection):
+        # Streams skip an event whose version they already sent
+        order_ids = list(self._subscribers)
+        if not order_ids:
+            return
+        try:
+            rows = await connection.fetch(RESYNC_SQL, order_ids)
+        except (OSError, asyncpg.PostgresError) as e:
+            # The connection is lost again: the next reconnect resyncs
+            logger.warning("Resync of %s subscribers failed: %s", ORDER_STATUS_CHANNEL, e)
+            return
+        for row in rows:
+            self.publish(dict(row))
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.publish(json.loads(payload))
+
+    def publish(self, event):
+        for queue in self._subscribers.get(event['id'], ()):
+            if queue.full():
+                # A slow client only needs the latest status
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, order_id):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[order_id].add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers[order_id]
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[order_id]
+
+    async def notify(self, session, order_id, order_status, version=None):
+        # Sent inside the caller's transaction: subscribers only hear about committed changes
+        payload = {'id': order_id, 'order_status': order_status, 'version': version}
+        if session.bind.dialect.name == 'postgresql':
+            await session.execute(select(func.pg_notify(ORDER_STATUS_CHANNEL, json.dumps(payload))))
+        else:
+            event.listen(session.sync_session, 'after_commit', lambda _: self.publish(payload), once=True)
+
+
+order_status_hub = OrderStatusHub(async_url_object)
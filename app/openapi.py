@@ -0,0 +1,81 @@
+"""OpenAPI schema built once per deploy and shared by the workers through a file.
+
+Which routes need a token comes from their dependencies: the auth checks in
+routers.base declare the bearer_token security scheme, and FastAPI adds it to
+every operation that depends on them. The first worker to start writes the
+schema to OPENAPI_CACHE together with a fingerprint of the loaded app code;
+workers started later with the same code load the file instead of walking
+every route and model again. Set OPENAPI_CACHE to an empty string to keep it
+in memory only.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import fastapi
+from fastapi.openapi.utils import get_openapi
+
+
+OPENAPI_CACHE = os.environ.get("OPENAPI_CACHE", os.path.join(tempfile.gettempdir(), 'hunger-go-openapi.json'))
+TITLE = "My Auth API"
+VERSION = "1.0"
+DESCRIPTION = "An API with an Authorize Button"
+
+
+def app_fingerprint():
+    """Hash of the app modules as deployed, .py or .pyc, and the FastAPI version."""
+    digest = hashlib.sha256(fastapi.__version__.encode())
+    for name in sorted(sys.modules):
+        if name != 'app' and not name.startswith('app.') or name.startswith('app.benchmarks'):
+            continue
+        path = getattr(sys.modules[name], '__file__', None)
+        if not path:
+            continue
+        digest.update(name.encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_openapi(app):
+    return get_openapi(title=TITLE, version=VERSION, description=DESCRIPTION, routes=app.routes)
+
+
+def _load(path, fingerprint):
+    try:
+        with open(path, 'rb') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('fingerprint') != fingerprint:
+        return None
+    return cached.get('schema')
+
+
+def _store(path, fingerprint, schema):
+    # Written next to the target and renamed, workers starting together never read half a file
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'schema': schema}, f, separators=(',', ':'))
+        os.replace(temporary, path)
+    except OSError:
+        pass
+
+
+def cached_openapi(app):
+    if app.openapi_schema:
+        return app.openapi_schema
+    if not OPENAPI_CACHE:
+        app.openapi_schema = build_openapi(app)
+        return app.openapi_schema
+
+    fingerprint = app_fingerprint()
+    schema = _load(OPENAPI_CACHE, fingerprint)
+    if schema is None:
+        schema = build_openapi(app)
+        _store(OPENAPI_CACHE, fingerprint, schema)
+    app.openapi_schema = schema
+    return schema
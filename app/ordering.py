@@ -0,0 +1,237 @@
+import datetime
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from sqlalchemy import select, update, text, bindparam, Integer, String, DateTime
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.models import Orders, OrderItem, FoodItem
+from app.notifications import order_status_hub
+from app.stats import record_order_placed, record_status_change
+
+
+# Prices the lines against the menu, inserts the order and its lines and returns the order in one
+# round trip. A line that doesn't match an active, priced item of the restaurant drops out of
+# `priced`, the HAVING then rejects the whole order and nothing is written.
+PLACE_ORDER = text("""
+    WITH lines AS (
+        SELECT * FROM unnest(:food_item_ids, :quantities, :comments) AS l(food_item_id, quantity, comment)
+    ), priced AS (
+        SELECT lines.food_item_id, lines.quantity, lines.comment, fooditem.price
+        FROM lines JOIN fooditem ON fooditem.id = lines.food_item_id
+        WHERE fooditem.restaurant_id = :restaurant_id AND fooditem.is_active AND fooditem.price IS NOT NULL
+    ), new_order AS (
+        INSERT INTO orders (order_status, order_time, delivery_address, comment, user_id, restaurant_id, total_price)
+        SELECT :order_status, :order_time, :delivery_address, :comment, :user_id, :restaurant_id,
+               sum(priced.price * priced.quantity)
+        FROM priced
+        HAVING count(*) = :line_count
+        RETURNING *
+    ), new_lines AS (
+        INSERT INTO order_item (quantity, comment, food_item_id, orders_id, unit_price)
+        SELECT priced.quantity, priced.comment, priced.food_item_id, new_order.id, priced.price
+        FROM priced CROSS JOIN new_order
+    )
+    SELECT * FROM new_order
+""").bindparams(
+    bindparam('food_item_ids', type_=ARRAY(Integer)),
+    bindparam('quantities', type_=ARRAY(Integer)),
+    bindparam('comments', type_=ARRAY(String)),
+    # Typed so asyncpg casts them, Postgres can't infer parameter types in an INSERT ... SELECT list
+    bindparam('order_status', type_=String),
+    bindparam('order_time', type_=DateTime),
+    bindparam('delivery_address', type_=String),
+    bindparam('comment', type_=String),
+    bindparam('user_id', type_=Integer),
+    bindparam('restaurant_id', type_=Integer),
+    bindparam('line_count', type_=Integer),
+)
+
+
+async def place_order(session, user_id, order):
+    """Insert `order` (a CreateOrders) for `user_id`, return the new order as a dict.
+
+    Raises a 400 naming the offending food_item_ids when a line can't be priced.
+    """
+    values = {
+        'order_status': 'PENDING',
+        'order_time': datetime.datetime.utcnow(),
+        'delivery_address': order.delivery_address,
+        'comment': order.comment,
+        'user_id': user_id,
+        'restaurant_id': order.restaurant_id,
+    }
+    if session.bind.dialect.name == 'postgresql':
+        result = await session.execute(PLACE_ORDER, {
+            **values,
+            'food_item_ids': [line.food_item_id for line in order.list_orders],
+            'quantities': [line.quantity for line in order.list_orders],
+            'comments': [line.comment for line in order.list_orders],
+            'line_count': len(order.list_orders),
+        })
+        row = result.mappings().first()
+        if row is None:
+            await _raise_invalid_lines(session, order)
+        new_order = dict(row)
+    else:
+        new_order = await _place_order_fallback(session, values, order)
+    await record_order_placed(session, new_order)
+    return new_order
+
+
+async def _menu_prices(session, order):
+    food_item_ids = {line.food_item_id for line in order.list_orders}
+    statement = (
+        select(FoodItem.id, FoodItem.restaurant_id, FoodItem.is_active, FoodItem.price)
+        .filter(FoodItem.id.in_(food_item_ids))
+    )
+    return {row.id: row for row in await session.execute(statement)}
+
+
+async def _raise_invalid_lines(session, order):
+    menu = await _menu_prices(session, order)
+    _check_lines(menu, order)
+    # Every line was valid when re-checked: the menu changed in between
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Menu changed, please retry")
+
+
+def _check_lines(menu, order):
+    errors = {'unknown': [], 'other_restaurant': [], 'unavailable': []}
+    for line in order.list_orders:
+        item = menu.get(line.food_item_id)
+        if item is None:
+            errors['unknown'].append(line.food_item_id)
+        elif item.restaurant_id != order.restaurant_id:
+            errors['other_restaurant'].append(line.food_item_id)
+        elif not item.is_active or item.price is None:
+            errors['unavailable'].append(line.food_item_id)
+    errors = {reason: ids for reason, ids in errors.items() if ids}
+    if errors:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail={'message': "Invalid order lines", 'food_item_ids': errors})
+
+
+async def _place_order_fallback(session, values, order):
+    # Same checks for databases without unnest/writable CTEs: one IN query, then a batched insert
+    menu = await _menu_prices(session, order)
+    _check_lines(menu, order)
+    lines = [
+        OrderItem(quantity=line.quantity, comment=line.comment, food_item_id=line.food_item_id,
+                  unit_price=menu[line.food_item_id].price)
+        for line in order.list_orders
+    ]
+    new_order = Orders(**values, total_price=sum(line.unit_price * line.quantity for line in lines), orders_list=lines)
+    session.add(new_order)
+    await session.flush()
+    return {column.key: getattr(new_order, column.key) for column in Orders.__table__.columns}
+
+
+async def transition_order(session, order_id, order_status, expected_status=None, version=None, values=None, **scope):
+    """Move an order to `order_status` with one conditional UPDATE ... RETURNING, return the updated order.
+
+    The UPDATE only matches while the order is still in `expected_status` (by
+    default any status allowed to move to `order_status`) and, when given,
+    still at `version`; a concurrent change makes it match nothing and a 409 is
+    raised with the order's current status and version. `scope` (user_id=...,
+    restaurant_id=...) restricts the orders the caller may change, anything
+    outside it is a 404. `values` are other columns to set in the same
+    statement. The stats, the status notification and the commit are left to
+    the caller's transaction, like place_order.
+    """
+    if order_status not in Orders.TRANSITIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown order status {order_status}")
+    sources = (expected_status,) if expected_status is not None else Orders.previous_statuses(order_status)
+    sources = [source for source in sources if order_status in Orders.TRANSITIONS.get(source, ())]
+    table = Orders.__table__
+    conditions = [table.c.order_status.in_(sources)]
+    if version is not None:
+        conditions.append(table.c.version == version)
+    row = None
+    if sources:
+        row = await _update_status(session, table, order_id, order_status, conditions, values or {}, scope)
+    if row is None:
+        await _raise_transition_conflict(session, order_id, order_status, version, scope)
+    order = dict(row)
+    previous_status = order.pop('previous_status')
+    await record_status_change(session, order['restaurant_id'], previous_status, order_status)
+    await order_status_hub.notify(session, order_id, order_status, order['version'])
+    return order
+
+
+async def _update_status(session, table, order_id, order_status, conditions, values, scope):
+    # The order's row, with the status it has right before the UPDATE: the CTE locks it, so a
+    # concurrent transition is either done by then or waits for this one
+    current = (
+        select(table.c.id, table.c.order_time, table.c.order_status.label('previous_status'))
+        .where(table.c.id == order_id, *[table.c[name] == value for name, value in scope.items()])
+    )
+    changes = {**values, 'order_status': order_status, 'version': table.c.version + 1}
+    if session.bind.dialect.name == 'postgresql':
+        previous = current.with_for_update().cte('previous')
+        statement = (
+            update(table)
+            .where(table.c.id == previous.c.id, table.c.order_time == previous.c.order_time, *conditions)
+            .values(**changes)
+            .returning(*table.c, previous.c.previous_status)
+        )
+        return (await session.execute(statement)).mappings().first()
+    # sqlite can't return columns of an UPDATE's FROM: read the status, then only update the order
+    # while it still has it; writers are serialized on the database file anyway
+    previous = (await session.execute(current)).first()
+    if previous is None:
+        return None
+    statement = (
+        update(table)
+        .where(table.c.id == order_id, table.c.order_status == previous.previous_status, *conditions)
+        .values(**changes)
+        .returning(*table.c)
+    )
+    row = (await session.execute(statement)).mappings().first()
+    return {**row, 'previous_status': previous.previous_status} if row is not None else None
+
+
+async def update_order_details(session, order_id, values, **scope):
+    """Set `values` on an open order without changing its status, one UPDATE ... RETURNING.
+
+    A delivered or canceled order is a 409, like a transition it can't make.
+    """
+    table = Orders.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == order_id, table.c.order_status.in_(Orders.open_statuses()),
+               *[table.c[name] == value for name, value in scope.items()])
+        .values(**values, version=table.c.version + 1)
+        .returning(*table.c)
+    )
+    row = (await session.execute(statement)).mappings().first()
+    if row is None:
+        current_status, current_version = await _current_order(session, order_id, scope)
+        _raise_conflict(f"Order is {current_status}, it can't be changed", current_status, current_version)
+    return dict(row)
+
+
+async def _raise_transition_conflict(session, order_id, order_status, version, scope):
+    # Only reached when the UPDATE matched nothing: find out whether the order is missing or moved on
+    current_status, current_version = await _current_order(session, order_id, scope)
+    if version is not None and version != current_version:
+        message = f"Order changed since version {version}"
+    else:
+        message = f"Order can't move from {current_status} to {order_status}"
+    _raise_conflict(message, current_status, current_version)
+
+
+async def _current_order(session, order_id, scope):
+    statement = select(Orders.order_status, Orders.version).filter(Orders.id == order_id).filter_by(**scope)
+    current = (await session.execute(statement)).first()
+    if current is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return getattr(current.order_status, 'code', current.order_status), current.version
+
+
+def _raise_conflict(message, current_status, current_version):
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail={
+        'message': message,
+        'order_status': current_status,
+        'version': current_version,
+    })
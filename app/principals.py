@@ -0,0 +1,134 @@
+import datetime
+import os
+
+from sqlalchemy import event, select, inspect
+
+from app.cache import TTLCache, MISSING
+from app.models import User, Restaurant
+from app.loaders import loader_profile
+
+
+ACCESS_TOKEN_EXPIRES = datetime.timedelta(days=1)
+REFRESH_TOKEN_EXPIRES = datetime.timedelta(days=30)
+
+# Tokens issued before role claims existed are resolved from the database and kept here
+# for PRINCIPAL_CACHE_TTL seconds
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 30))
+# A shop's role claims are only trusted while they carry the restaurant's current roles_version,
+# which the database bumps on every role change; it is re-read at most every ROLES_VERSION_TTL seconds
+ROLES_VERSION_TTL = float(os.environ.get("ROLES_VERSION_TTL", 5))
+
+PRINCIPAL_MODELS = {'user': User, 'shop': Restaurant}
+
+
+class Principal:
+    """Who is calling: enough to authorize a request without loading the row."""
+
+    __slots__ = ('id', 'username', 'kind', 'is_staff', 'is_administrator', 'roles_version')
+
+    def __init__(self, id, username, kind, is_staff=False, is_administrator=False, roles_version=None):
+        self.id = id
+        self.username = username
+        self.kind = kind
+        self.is_staff = is_staff
+        self.is_administrator = is_administrator
+        self.roles_version = roles_version
+
+    @classmethod
+    def from_model(cls, obj, kind):
+        return cls(obj.id, obj.username, kind,
+                   bool(getattr(obj, 'is_staff', False)), bool(getattr(obj, 'is_administrator', False)),
+                   getattr(obj, 'roles_version', None))
+
+    @classmethod
+    def from_claims(cls, claims):
+        if 'pid' not in claims or 'staff' not in claims:
+            return None
+        return cls(claims['pid'], claims['sub'], claims['kind'], claims['staff'], claims['admin'], claims.get('rv'))
+
+    def claims(self):
+        return {'pid': self.id, 'kind': self.kind, 'staff': self.is_staff, 'admin': self.is_administrator,
+                'rv': self.roles_version}
+
+    def refresh_claims(self):
+        # Enough to find the principal again, the roles are read from the database on refresh
+        return {'pid': self.id, 'kind': self.kind}
+
+
+principal_cache = TTLCache(maxsize=int(os.environ.get("PRINCIPAL_CACHE_SIZE", 4096)), ttl=PRINCIPAL_CACHE_TTL)
+roles_versions = TTLCache(maxsize=4096, ttl=ROLES_VERSION_TTL)
+
+
+def create_tokens(Authorize, principal):
+    return {
+        'access_token': Authorize.create_access_token(subject=principal.username, user_claims=principal.claims(),
+                                                      expires_time=ACCESS_TOKEN_EXPIRES),
+        'refresh_token': Authorize.create_refresh_token(subject=principal.username, user_claims=principal.refresh_claims(),
+                                                        expires_time=REFRESH_TOKEN_EXPIRES),
+    }
+
+
+async def current_roles_version(session, principal_id):
+    version = roles_versions.get(principal_id)
+    if version is MISSING:
+        result = await session.execute(select(Restaurant.roles_version).filter_by(id=principal_id))
+        version = result.scalar()
+        roles_versions.set(principal_id, version, tags=[f'shop:{principal_id}'])
+    return version
+
+
+async def load_principal(session, kind, username):
+    """The principal as stored in the database, None if there is no such `kind` principal."""
+    model = PRINCIPAL_MODELS[kind]
+    result = await session.execute(select(model).filter_by(username=username).options(*loader_profile('principal')))
+    obj = result.scalars().first()
+    return Principal.from_model(obj, kind) if obj is not None else None
+
+
+async def _stored_principal(session, kind, username):
+    principal = principal_cache.get((kind, username))
+    if principal is MISSING:
+        principal = await load_principal(session, kind, username)
+        if principal is not None:
+            principal_cache.set((kind, username), principal, tags=[f'{kind}:{principal.id}'])
+    return principal
+
+
+async def get_principal(Authorize, session, kind):
+    """Resolve the caller of an already verified token, None if it isn't a `kind` principal.
+
+    User claims are trusted as they are, users have no roles. Shop claims are
+    trusted while their roles_version matches the restaurant's; otherwise, and
+    for tokens without claims, the principal is read from the database.
+    """
+    claims = Authorize.get_raw_jwt()
+    if claims.get('kind', kind) != kind:
+        return None
+    principal = Principal.from_claims(claims)
+    if principal is not None and kind == 'user':
+        return principal
+
+    username = claims['sub']
+    if principal is None:
+        principal = await _stored_principal(session, kind, username)
+    if principal is not None and kind == 'shop':
+        if principal.roles_version != await current_roles_version(session, principal.id):
+            principal_cache.invalidate(f'shop:{principal.id}')
+            principal = await _stored_principal(session, kind, username)
+            if principal is not None:
+                roles_versions.set(principal.id, principal.roles_version, tags=[f'shop:{principal.id}'])
+    return principal
+
+
+@event.listens_for(Restaurant, 'before_update')
+def _bump_roles_version(mapper, connection, target):
+    # The restaurant_roles_version trigger does the same for changes made outside the ORM
+    state = inspect(target)
+    if state.attrs.is_staff.history.has_changes() or state.attrs.is_administrator.history.has_changes():
+        target.roles_version = Restaurant.roles_version + 1
+
+
+@event.listens_for(Restaurant, 'after_update')
+def _roles_changed(mapper, connection, target):
+    principal_cache.invalidate(f'shop:{target.id}')
+    roles_versions.invalidate(f'shop:{target.id}')
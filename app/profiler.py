@@ -0,0 +1,118 @@
+"""Opt-in sampling profiler for single requests.
+
+With PROFILING_ENABLED=true, a request sent with `X-Profile: <PROFILE_TOKEN>`
+is sampled every PROFILE_INTERVAL_MS while it runs. Only samples taken while
+the request's own task holds the event loop are kept, so concurrent requests
+don't leak into the profile. The stacks are written to PROFILE_DIR in the
+folded format read by flamegraph.pl and speedscope, and the file name is
+returned in the X-Profile-File header:
+
+    curl -H 'X-Profile: secret' -H 'Authorization: Bearer ...' localhost:8000/foods
+    flamegraph.pl /tmp/profiles/<file>.folded > foods.svg
+
+Profiling stays off without a PROFILE_TOKEN: anyone could otherwise make the
+worker sample requests and write files.
+"""
+import asyncio
+import collections
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from app.metrics import route_template
+
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() in ('1', 'true', 'yes')
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 2))
+PROFILE_HEADER = b'x-profile'
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}"
+
+
+class Sampler(threading.Thread):
+    """Samples the event loop thread while `task` is the running task."""
+
+    def __init__(self, loop, task, interval):
+        super().__init__(daemon=True, name='request-profiler')
+        self.loop = loop
+        self.task = task
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = collections.Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            if asyncio.current_task(self.loop) is not self.task:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def profile_name(scope):
+    route = re.sub(r'[^A-Za-z0-9]+', '_', route_template(scope)).strip('_') or 'root'
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(scope):x}-{scope['method'].lower()}-{route}.folded"
+
+
+def write_folded(stacks, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.enabled = PROFILING_ENABLED and bool(PROFILE_TOKEN)
+        if PROFILING_ENABLED and not PROFILE_TOKEN:
+            logger.warning("PROFILING_ENABLED is set without a PROFILE_TOKEN, X-Profile headers are ignored")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.enabled or not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        sampler = Sampler(asyncio.get_running_loop(), asyncio.current_task(), PROFILE_INTERVAL_MS / 1000)
+        sampler.start()
+        name = None
+
+        async def send_with_profile(message):
+            nonlocal name
+            if message['type'] == 'http.response.start':
+                # Named once routing is done, written when the body has been sent
+                name = profile_name(scope)
+                message = {**message, 'headers': [*message.get('headers', []), (b'x-profile-file', name.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            sampler.stop()
+            write_folded(sampler.stacks, name or profile_name(scope))
+
+    @staticmethod
+    def _requested(scope):
+        for key, value in scope['headers']:
+            if key == PROFILE_HEADER:
+                return hmac.compare_digest(value, PROFILE_TOKEN.encode())
+        return False
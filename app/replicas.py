@@ -0,0 +1,173 @@
+"""Routing of read-only requests to the streaming replica.
+
+Routes that take a ReadSession are served by the replica configured with
+DB_REPLICA_* (see app.database) while it is reachable and less than
+REPLICA_MAX_LAG seconds behind, and by the primary otherwise. The lag is
+measured in the background every REPLICA_CHECK_INTERVAL seconds, requests
+only read the last measurement. A request that fails on the replica marks it
+down at once, so the following ones go to the primary.
+
+A replica that lost the primary has replayed all it received and looks caught
+up, so the check also requires its WAL receiver to be streaming and to have
+heard from the primary in the last REPLICA_RECEIVER_TIMEOUT seconds. An idle
+primary only sends a keepalive every wal_sender_timeout / 2 (30s by default),
+keep the timeout above that. Reading pg_stat_wal_receiver takes a superuser or
+a member of pg_read_all_stats.
+
+A client that sent a write (any authenticated non-GET request that didn't
+fail) reads from the primary for READ_YOUR_WRITES_WINDOW seconds, so an
+order shows up in /my-orders right after /place-order whichever worker serves
+it. The time of the write travels with the client: ReadYourWritesMiddleware
+sets it as the last_write cookie and the Last-Write response header, and reads
+look for either one, so clients that don't keep cookies can send the header
+back. Keep the window above REPLICA_MAX_LAG.
+
+Catalog responses read from the replica may predate a write that has just
+invalidated them, read_cache_ttl() keeps them cached for REPLICA_MAX_LAG at most.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.database import ReplicaSession, replica_engine
+
+
+logger = logging.getLogger(__name__)
+
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", 1))
+REPLICA_CHECK_TIMEOUT = float(os.environ.get("REPLICA_CHECK_TIMEOUT", 1))
+REPLICA_RECEIVER_TIMEOUT = float(os.environ.get("REPLICA_RECEIVER_TIMEOUT", 60))
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", 10))
+LAST_WRITE_COOKIE = 'last_write'
+LAST_WRITE_HEADER = 'Last-Write'
+
+# lag: seconds since the last replayed transaction, 0 once everything received is replayed (an
+# idle primary doesn't make the replica look late). receiving: whether it is still getting WAL
+REPLICA_STATUS_SQL = text("""
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END AS lag,
+        NOT pg_is_in_recovery() OR EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE status = 'streaming' AND last_msg_receipt_time > now() - make_interval(secs => :receiver_timeout)
+        ) AS receiving
+""")
+
+
+class ReplicaMonitor:
+
+    def __init__(self, db_engine):
+        self.engine = db_engine
+        self.lag = None
+        self.error = None
+        self.checked_at = float('-inf')
+        self.fallbacks = 0
+        self._task = None
+
+    def usable(self):
+        """Whether reads can go to the replica, refreshing the lag in the background when it is stale."""
+        if time.monotonic() - self.checked_at >= REPLICA_CHECK_INTERVAL and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self.check())
+        usable = self.error is None and self.lag is not None and self.lag <= REPLICA_MAX_LAG
+        if not usable:
+            self.fallbacks += 1
+        return usable
+
+    async def check(self):
+        try:
+            async with asyncio.timeout(REPLICA_CHECK_TIMEOUT):
+                async with self.engine.connect() as connection:
+                    status = (await connection.execute(REPLICA_STATUS_SQL,
+                                                       {'receiver_timeout': REPLICA_RECEIVER_TIMEOUT})).one()
+        except Exception as e:
+            self.mark_down(e)
+            return
+        self.lag = float(status.lag)
+        if not status.receiving:
+            self.mark_down(f"WAL receiver not streaming, or silent for over {REPLICA_RECEIVER_TIMEOUT:g}s")
+            return
+        if self.error is not None:
+            logger.info("Replica is back, lag %.3fs", self.lag)
+        self.error = None
+        self.checked_at = time.monotonic()
+
+    def mark_down(self, error):
+        if self.error is None:
+            logger.warning("Replica unavailable, reading from the primary: %s", error)
+        self.error = str(error) or type(error).__name__
+        self.checked_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'lag': self.lag,
+            'max_lag': REPLICA_MAX_LAG,
+            'error': self.error,
+            'usable': self.error is None and self.lag is not None and self.lag <= REPLICA_MAX_LAG,
+            'fallbacks': self.fallbacks,
+        }
+
+
+replica_monitor = ReplicaMonitor(replica_engine) if replica_engine is not None else None
+
+
+def mark_write(request):
+    # ReadYourWritesMiddleware hands the time of the write to the client once the response is known
+    request.state.wrote = True
+
+
+def recently_wrote(request):
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return time.time() - float(value) < READ_YOUR_WRITES_WINDOW
+    except (TypeError, ValueError):
+        return False
+
+
+def read_cache_ttl(session):
+    """TTL for caching what `session` read: the cache's own for the primary, REPLICA_MAX_LAG for the replica."""
+    return REPLICA_MAX_LAG if replica_engine is not None and session.bind is replica_engine else None
+
+
+async def get_read_session(request, primary):
+    """A replica session, or `primary` (the request's DBSession) when the replica can't be used."""
+    if replica_monitor is None or recently_wrote(request) or not replica_monitor.usable():
+        yield primary
+        return
+    async with ReplicaSession() as session:
+        try:
+            yield session
+        except Exception as e:
+            await session.rollback()
+            if isinstance(e, (DBAPIError, OSError)):
+                replica_monitor.mark_down(e)
+            raise
+
+
+class ReadYourWritesMiddleware:
+    """Give the client the time of its write, for the reads that follow it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] in ('GET', 'HEAD', 'OPTIONS'):
+            return await self.app(scope, receive, send)
+
+        async def send_with_last_write(message):
+            if message['type'] == 'http.response.start' and message['status'] < 400 \
+                    and scope.get('state', {}).get('wrote'):
+                now = f'{time.time():.3f}'
+                cookie = f'{LAST_WRITE_COOKIE}={now}; Max-Age={int(READ_YOUR_WRITES_WINDOW) + 1}; Path=/; HttpOnly; SameSite=Lax'
+                message['headers'] = [*message.get('headers', ()),
+                                      (b'set-cookie', cookie.encode()), (LAST_WRITE_HEADER.lower().encode(), now.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_last_write)
@@ -1,12 +1,14 @@
-import datetime
 from fastapi import APIRouter, status, Depends
 from app.schemas import CreateRestaurant, LoginRestaurant, CreateUser, LoginForm
 from app.models import User, Restaurant
 from fastapi.exceptions import HTTPException
-from werkzeug.security import generate_password_hash, check_password_hash
 from fastapi_jwt_auth import AuthJWT
 from fastapi.encoders import jsonable_encoder
-from .base import handle_refresh_token, session
+from sqlalchemy import select
+from .base import RefreshSubject, DBSession, fetch_one, from_query_to_object, json_response
+from app.cache import catalog_cache
+from app.hashing import password_hasher
+from app.principals import Principal, create_tokens, load_principal, PRINCIPAL_MODELS, ACCESS_TOKEN_EXPIRES
 
 auth_router = APIRouter(
     prefix='/auth',
@@ -15,77 +17,85 @@ auth_router = APIRouter(
 
 @auth_router.post('/sign_up', response_model=CreateUser, status_code=status.HTTP_201_CREATED)
 async def sign_up_user(
-        user : CreateUser
+        user : CreateUser,
+        session: DBSession
 ):
-    db_email = session.query(User).filter(User.email==user.email).first()
+    db_email = await fetch_one(session, select(User).filter(User.email==user.email))
     if db_email is not None:
-        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                             detail="User with that email already exists")
-    db_username = session.query(User).filter(User.username==user.username).first()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="User with that email already exists")
+    db_username = await fetch_one(session, select(User).filter(User.username==user.username))
     if db_username is not None:
-        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                             detail="User with that username already exists")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="User with that username already exists")
 
     new_user = User(
         username = user.username.lower(),
         name = user.name,
         lastname = user.lastname,
         email = user.email,
-        password = generate_password_hash(user.password),
+        password = await password_hasher.hash(user.password),
         phone_number = user.phone_number,
         address = user.address,
-        is_active= user.is_active,
     )
     session.add(new_user)
-    session.commit()
-    session.refresh()
-    return new_user
+    await session.commit()
+    await session.refresh(new_user)
+    return json_response(from_query_to_object(new_user, exclude_fields={'password'}), status_code=status.HTTP_201_CREATED)
 
 
 @auth_router.post('/login', status_code=status.HTTP_200_OK)
-def login(
+async def login(
         user : LoginForm,
+        session: DBSession,
         Autherize : AuthJWT=Depends()
 ):
-    db_user = session.query(User).filter_by(username=user.username).first()
-    if user is None:
+    db_user = await fetch_one(session, select(User).filter_by(username=user.username))
+    if db_user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                              detail="Wrong username")
-    if not check_password_hash(db_user.password, user.password):
+    valid, new_hash = await password_hasher.verify(db_user.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                              detail= "Wrong Password")
+    if new_hash is not None:
+        db_user.password = new_hash
+        await session.commit()
 
-    access_token = Autherize.create_access_token(subject=db_user.username, expires_time=datetime.timedelta(days=1))
-    refresh_token = Autherize.create_refresh_token(subject=db_user.username)
-
-    response = {
-        "access_token" : access_token,
-        "refresh_token" : refresh_token
-    }
+    response = create_tokens(Autherize, Principal.from_model(db_user, 'user'))
 
     return jsonable_encoder(response)
 
 
 @auth_router.get('/refresh-token')
-async def refresh_token( Autherize : AuthJWT = Depends() ):
-    current_user = handle_refresh_token( Autherize )
-    access_token = Autherize.create_access_token(subject=current_user, expires_time=datetime.timedelta(days=1))
+async def refresh_token( current_user : RefreshSubject, session: DBSession, Autherize : AuthJWT = Depends() ):
+    # The roles come from the database, never from the 30 day refresh token
+    kind = Autherize.get_raw_jwt().get('kind')
+    claims = {}
+    if kind in PRINCIPAL_MODELS:
+        principal = await load_principal(session, kind, current_user)
+        if principal is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail="Please provide a valid refresh_token")
+        claims = principal.claims()
+    access_token = Autherize.create_access_token(subject=current_user, user_claims=claims, expires_time=ACCESS_TOKEN_EXPIRES)
     return jsonable_encoder({'access_token' : access_token})
 
 
 
 @auth_router.post('/shop/sign-up', status_code=status.HTTP_201_CREATED)
 async def sign_up_restaurant(
-        shop : CreateRestaurant
+        shop : CreateRestaurant,
+        session: DBSession
 ):
-    db_email = session.query(Restaurant).filter_by(email=shop.email).first()
+    db_email = await fetch_one(session, select(Restaurant).filter_by(email=shop.email))
     if db_email is not None:
-        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                             detail="Restaurant registered this email already exists")
-    db_username = session.query(Restaurant).filter(Restaurant.username==shop.username).first()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Restaurant registered this email already exists")
+    db_username = await fetch_one(session, select(Restaurant).filter(Restaurant.username==shop.username))
     if db_username is not None:
-        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                             detail="Restaurant with this username already exists")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Restaurant with this username already exists")
 
     new_shop = Restaurant(
         username = shop.username.lower(),
@@ -93,34 +103,34 @@ async def sign_up_restaurant(
         name = shop.name,
         address = shop.address,
         phone_number = shop.phone_number,
-        password = generate_password_hash(shop.password),
+        password = await password_hasher.hash(shop.password),
         is_staff= shop.is_staff,
         is_administrator = shop.is_administrator
     )
     session.add(new_shop)
-    session.commit()
-    session.refresh(new_shop)
-    return jsonable_encoder(new_shop, exclude={'password'})
+    await session.commit()
+    await session.refresh(new_shop)
+    catalog_cache.invalidate('shops')
+    return json_response(from_query_to_object(new_shop, exclude_fields={'password'}), status_code=status.HTTP_201_CREATED)
 
 
 @auth_router.post('/shop/login', status_code=status.HTTP_200_OK)
 async def login_restaurant(
         shop : LoginRestaurant,
+        session: DBSession,
         Autherize : AuthJWT=Depends()
 ):
-    db_shop = session.query(Restaurant).filter_by(username=shop.username).first()
+    db_shop = await fetch_one(session, select(Restaurant).filter_by(username=shop.username))
     if db_shop is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Wrong username")
-    if not check_password_hash(db_shop.password, shop.password):
+    valid, new_hash = await password_hasher.verify(db_shop.password, shop.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Wrong Password")
+    if new_hash is not None:
+        db_shop.password = new_hash
+        await session.commit()
 
-    access_token = Autherize.create_access_token(subject=db_shop.username, expires_time=datetime.timedelta(days=1))
-    refresh_token = Autherize.create_refresh_token(subject=db_shop.username)
-
-    response = {
-        "access_token": access_token,
-        "refresh_token": refresh_token
-    }
+    response = create_tokens(Autherize, Principal.from_model(db_shop, 'shop'))
     return response
\ No newline at end of file
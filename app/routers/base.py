@@ -1,18 +1,182 @@
-from fastapi import status, Query, Path, APIRouter, Depends
+import base64
+import datetime
+import json
+from operator import itemgetter
+from fastapi import status, Query, Path, APIRouter, Depends, Security, Request
+from fastapi.security import APIKeyHeader
 from fastapi_jwt_auth import AuthJWT
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
-from app.database import Session, engine
+from app.database import get_async_session
 from app.models import Restaurant
 from pydantic.typing import Annotated, Union, List
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, tuple_, inspect, DateTime
+from sqlalchemy.orm import joinedload, load_only, raiseload
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.serializers import serializer_for, json_response, dumps, PRIVATE_FIELDS
+from app.loaders import loader_profile
+from app.instrumentation import query_budget
+from app.principals import Principal, get_principal
+from app.replicas import get_read_session, mark_write, read_cache_ttl
 
 
+# Request scoped session, checked out from the pool on first use and closed after the response
+DBSession = Annotated[AsyncSession, Depends(get_async_session)]
 
-session = Session(bind=engine)
 
+async def fetch_one(session, statement):
+    # unique() is required once a joined eager collection is part of the statement
+    result = await session.execute(statement)
+    return result.unique().scalars().first()
 
-def check_authorization(Authorize:AuthJWT=Depends()):
+
+async def fetch_all(session, statement):
+    result = await session.execute(statement)
+    return result.unique().scalars().all()
+
+
+async def fetch_rows(session, statement):
+    result = await session.execute(statement)
+    return result.all()
+
+
+DEFAULT_PAGE_SIZE = 50
+STREAM_BATCH_SIZE = 1000
+MAX_PAGE_SIZE = 200
+
+PageLimit = Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE, title="Page size")]
+PageCursor = Annotated[Union[str, None], Query(title="next_cursor of the previous page")]
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [_cursor_value(key, value) for key, value in zip(keys, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid cursor")
+
+
+def _cursor_value(key, value):
+    # A cursor comes from the client: a value of the wrong type must not reach the comparison
+    if isinstance(key.type, DateTime):
+        return datetime.datetime.fromisoformat(value)
+    if type(value) is not key.type.python_type:
+        raise TypeError(f"{key.key} cursor value {value!r}")
+    return value
+
+
+def seek(statement, keys, cursor=None, descending=False):
+    # Keyset pagination: seek past the last key of the previous page instead of OFFSET,
+    # so every page costs the same index range scan however deep the client is
+    if cursor is not None:
+        values = decode_cursor(cursor, keys)
+        last = tuple_(*values)
+        statement = statement.filter(tuple_(*keys) < last if descending else tuple_(*keys) > last)
+        # Implied by the row comparison, but only a plain bound on the leading key lets Postgres
+        # prune orders partitions by order_time and bound the index scans
+        if len(keys) > 1:
+            statement = statement.filter(keys[0] <= values[0] if descending else keys[0] >= values[0])
+    return statement.order_by(*[key.desc() if descending else key.asc() for key in keys])
+
+
+async def paginate(session, statement, keys, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False, rows=False):
+    statement = seek(statement, keys, cursor, descending)
+    fetch = fetch_rows if rows else fetch_all
+    results = await fetch(session, statement.limit(limit + 1))
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor([getattr(results[-1], key.key) for key in keys])
+    return results, next_cursor
+
+
+async def stream_ndjson(session, statement, to_dict, rows=False, batch_size=STREAM_BATCH_SIZE):
+    """Yield one JSON line per result, fetched batch by batch from a server side cursor."""
+    result = await session.stream(statement.execution_options(yield_per=batch_size))
+    if not rows:
+        result = result.scalars()
+    async for batch in result.partitions():
+        yield b''.join(dumps(to_dict(item)) + b'\n' for item in batch)
+        # Already serialized: don't let the identity map keep the whole history alive
+        session.expunge_all()
+
+
+FieldSelection = Annotated[Union[str, None], Query(title="Comma separated fields to return, e.g. id,name,price")]
+
+
+class Fieldset:
+    """A parsed ?fields= selection, pushed down into the SELECT.
+
+    Columns only: a column SELECT returning Row tuples, no entities, no
+    identity map and no eager joins. When a relationship is requested the
+    entity is loaded with load_only() plus that one relationship.
+    """
+
+    def __init__(self, model, fields, relations=(), exclude=frozenset()):
+        requested = list(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+        columns = {attr.key for attr in inspect(model).column_attrs} - exclude
+        unknown = [name for name in requested if name not in columns and name not in relations]
+        if not requested or unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields requested")
+        self.model = model
+        self.fields = requested
+        self.columns = [name for name in requested if name in columns]
+        self.relations = [name for name in requested if name in relations]
+
+    @property
+    def rows(self):
+        return not self.relations
+
+    def statement(self, keys=()):
+        # Pagination keys are selected too, the cursor is built from the last row
+        names = list(dict.fromkeys(self.columns + [key.key for key in keys]))
+        attributes = [getattr(self.model, name) for name in names]
+        if self.rows:
+            return select(*attributes)
+        loaders = [joinedload(getattr(self.model, name)) for name in self.relations]
+        return select(self.model).options(load_only(*attributes), *loaders, raiseload('*'))
+
+    def to_list(self, results):
+        if not self.rows:
+            return from_query_to_list(results, include_fields=self.fields)
+        if not results:
+            return []
+        positions = itemgetter(*[results[0]._fields.index(name) for name in self.fields])
+        if len(self.fields) == 1:
+            return [{self.fields[0]: positions(row)} for row in results]
+        return [dict(zip(self.fields, positions(row))) for row in results]
+
+    def to_dict(self, result):
+        if not self.rows:
+            return from_query_to_object(result, include_fields=self.fields)
+        return {name: getattr(result, name) for name in self.fields}
+
+
+def parse_fields(model, fields, relations=(), exclude=frozenset()):
+    return Fieldset(model, fields, relations, exclude) if fields is not None else None
+
+
+# Declared by the auth dependencies below, so the OpenAPI schema marks exactly the routes that use
+# them as needing a token. AuthJWT reads the header itself, the value is not used.
+bearer_token = APIKeyHeader(name='Authorization', scheme_name='Bearer Auth', auto_error=False,
+                            description="Enter: **'Bearer &lt;JWT&gt;'**, where JWT is the access token")
+
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+def check_authorization(request:Request, Authorize:AuthJWT=Depends(), token:str=Security(bearer_token)):
     try:
         Authorize.jwt_required()
 
@@ -21,10 +185,14 @@ def check_authorization(Authorize:AuthJWT=Depends()):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Token"
         )
-    return Authorize.get_jwt_subject()
+    subject = Authorize.get_jwt_subject()
+    if request.method not in SAFE_METHODS:
+        # The caller's next reads go to the primary for a while, see app.replicas
+        mark_write(request)
+    return subject
 
 
-def handle_refresh_token( Authorize : AuthJWT=Depends() ):
+def handle_refresh_token( Authorize : AuthJWT=Depends(), token:str=Security(bearer_token) ):
     try:
         Authorize.jwt_refresh_token_required()
     except Exception as e:
@@ -32,31 +200,52 @@ def handle_refresh_token( Authorize : AuthJWT=Depends() ):
                             detail="Please provide a valid refresh_token"
                             )
     current_user = Authorize.get_jwt_subject()
+    return current_user
+
+
+async def check_user_authorization(session:DBSession, subject:str=Depends(check_authorization), Authorize:AuthJWT=Depends()):
+    user = await get_principal(Authorize, session, 'user')
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid Token")
+    return user
 
 
-def check_shop_authorization(Authorize:AuthJWT):
-    check_authorization(Authorize)
-    username = Authorize.get_jwt_subject()
-    shop_user = session.query(Restaurant).filter_by(username=username).first()
-    if not shop_user.is_staff or not shop_user.is_administrator:
+async def check_shop_authorization(session:DBSession, subject:str=Depends(check_authorization), Authorize:AuthJWT=Depends()):
+    shop_user = await get_principal(Authorize, session, 'shop')
+    if shop_user is None or not shop_user.is_staff or not shop_user.is_administrator:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Not a staff or administrator")
     return shop_user
 
 
+# Statements CurrentShop may add to a route's query budget: the roles_version check, see app.principals
+SHOP_AUTH_STATEMENTS = 1
+
+
+# Route parameters: declaring one runs the check before the handler (sharing the request's session)
+JWTSubject = Annotated[str, Depends(check_authorization)]
+RefreshSubject = Annotated[str, Depends(handle_refresh_token)]
+CurrentUser = Annotated[Principal, Depends(check_user_authorization)]
+CurrentShop = Annotated[Principal, Depends(check_shop_authorization)]
+
+
+async def read_session(request:Request, primary:DBSession, subject:str=Depends(check_authorization)):
+    async for session in get_read_session(request, primary):
+        yield session
+
+
+# For read-only routes: the replica when it is caught up, the primary otherwise
+ReadSession = Annotated[AsyncSession, Depends(read_session)]
+
+
 def from_query_to_object(result, include_fields=None, exclude_fields=None):
-    if exclude_fields is not False:
-        return jsonable_encoder(result, exclude=exclude_fields)
-    elif exclude_fields is not False:
-        return jsonable_encoder(result, include=include_fields)
-    else:
-        return jsonable_encoder(result)
+    if result is None:
+        return None
+    return serializer_for(type(result), include_fields, exclude_fields).to_dict(result)
 
 def from_query_to_list(results, include_fields=None, exclude_fields=None):
-    if exclude_fields is not False:
-        return [ jsonable_encoder(result, exclude=exclude_fields) for result in results ]
-    elif exclude_fields is not False:
-        return [ jsonable_encoder(result, include=include_fields)for result in results ]
-    else:
-        return [ jsonable_encoder(result) for result in results]
+    if not results:
+        return []
+    return serializer_for(type(results[0]), include_fields, exclude_fields).to_list(results)
 
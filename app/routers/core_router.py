@@ -1,34 +1,71 @@
 from .base import *
-from sqlalchemy import or_
-from app.schemas import GetRestaurant, GetCategories, GetFoodItem, GetRestaurantModel
+from sqlalchemy import select
+from app.schemas import GetRestaurant, GetCategories, GetFoodItem, GetRestaurantModel, RestaurantPage, FoodItemPage
 from app.models import Restaurant, FoodItem, FoodCategory
+from app.search import search_food_items, MAX_SEARCH_OFFSET
+from app.cache import catalog_cache, MISSING
+
+RESTAURANT_EXCLUDE = PRIVATE_FIELDS | {'food_items'}
 
 core_router = APIRouter(
     prefix='',
     tags=['core']
 )
 
-@core_router.get('/shops', response_model = List[GetRestaurant])
-async def list_restaurants(Authorize:AuthJWT=Depends()):
-    user = check_authorization(Authorize)
-    restaurants = session.query(Restaurant).all()
-    restaurant_list = from_query_to_list(restaurants, exclude_fields={'password', 'is_staff', 'is_administrator', 'food_items'})
-    return restaurant_list
+@core_router.get('/shops', response_model = RestaurantPage)
+@query_budget(statements=1, entities=MAX_PAGE_SIZE + 1)
+async def list_restaurants(
+        session: ReadSession,
+        user: JWTSubject,
+        cursor: PageCursor = None,
+        limit: PageLimit = DEFAULT_PAGE_SIZE,
+        fields: FieldSelection = None):
+    fieldset = parse_fields(Restaurant, fields, exclude=RESTAURANT_EXCLUDE)
+    key = ('shops', cursor, limit, fields)
+    cached = catalog_cache.get(key)
+    if cached is not MISSING:
+        return json_response(cached)
+
+    if fieldset is None:
+        statement = select(Restaurant).options(*loader_profile('shop_list'))
+        restaurants, next_cursor = await paginate(session, statement, [Restaurant.id], cursor, limit)
+        restaurant_list = from_query_to_list(restaurants, exclude_fields=RESTAURANT_EXCLUDE)
+        response = json_response({'items' : restaurant_list, 'next_cursor' : next_cursor}, response_model=RestaurantPage)
+    else:
+        restaurants, next_cursor = await paginate(session, fieldset.statement([Restaurant.id]), [Restaurant.id], cursor, limit, rows=fieldset.rows)
+        response = json_response({'items' : fieldset.to_list(restaurants), 'next_cursor' : next_cursor})
+    catalog_cache.set(key, response.body, tags=['shops'], ttl=read_cache_ttl(session))
+    return response
 
 @core_router.get('/shop/{id}', response_model=GetRestaurantModel)
-async def get_shop(id: int, Authorize:AuthJWT=Depends()):
-    user = check_authorization(Authorize)
-    result = session.query(Restaurant).options(joinedload(Restaurant.food_items)).first()
-    response = from_query_to_object(result, exclude_fields={'password', 'is_staff', "is_administrator", 'food_items'})
+@query_budget(statements=2)
+async def get_shop(id: int, session: ReadSession, user: JWTSubject):
+    key = ('shop', id)
+    cached = catalog_cache.get(key)
+    if cached is not MISSING:
+        return json_response(cached)
+
+    result = await fetch_one(session, select(Restaurant).options(*loader_profile('shop_menu')).filter(Restaurant.id == id))
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    response = from_query_to_object(result, exclude_fields=RESTAURANT_EXCLUDE)
     food_items = from_query_to_list(result.food_items)
     response['food_items'] = food_items
+    response = json_response(response, response_model=GetRestaurantModel)
+    catalog_cache.set(key, response.body, tags=[f'restaurant:{id}'], ttl=read_cache_ttl(session))
     return response
 
 @core_router.get('/categories', response_model=List[GetCategories])
-async def list_categories(Authorize:AuthJWT=Depends()):
-    user = check_authorization(Authorize)
-    categories = session.query(FoodCategory).all()
-    list_categories = from_query_to_list(categories)
+@query_budget(statements=1)
+async def list_categories(session: ReadSession, user: JWTSubject):
+    key = ('categories',)
+    cached = catalog_cache.get(key)
+    if cached is not MISSING:
+        return json_response(cached)
+
+    categories = await fetch_all(session, select(FoodCategory))
+    list_categories = json_response(from_query_to_list(categories), response_model=List[GetCategories])
+    catalog_cache.set(key, list_categories.body, tags=['categories'], ttl=read_cache_ttl(session))
     return list_categories
 
 
@@ -36,28 +73,53 @@ async def list_categories(Authorize:AuthJWT=Depends()):
 
 
 @core_router.get('/food/{id}', response_model = GetFoodItem)
-async def get_food_item(id: int, Authorize:AuthJWT=Depends()):
-    user = check_authorization(Authorize)
-    query = session.get(FoodItem, id)
-    response = from_query_to_object(query)
+@query_budget(statements=1, entities=2)
+async def get_food_item(id: int, session: ReadSession, user: JWTSubject):
+    key = ('food', id)
+    cached = catalog_cache.get(key)
+    if cached is not MISSING:
+        return json_response(cached)
+
+    query = await session.get(FoodItem, id, options=loader_profile('food'))
+    if query is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    response = json_response(from_query_to_object(query), response_model=GetFoodItem)
+    catalog_cache.set(key, response.body, tags=[f'food:{id}', f'restaurant:{query.restaurant_id}'], ttl=read_cache_ttl(session))
     return response
 
 
-@core_router.get('/foods', response_model = List[GetFoodItem])
+@core_router.get('/foods', response_model = FoodItemPage)
+@query_budget(statements=2)
 async def get_food_item(
+        session: ReadSession,
+        user: JWTSubject,
         q : Annotated[Union[str, float, int ,None], Query(title='Query by name, price, category')] =None,
-        Authorize:AuthJWT=Depends()):
-    user = check_authorization(Authorize)
-
-    if q is None: # Paginate
-        query = session.query(FoodItem).all()
-    elif isinstance(q, str):
-        query = session.query(FoodItem).filter(or_(FoodItem.name.ilike(f'%{q}%'), FoodItem.description.ilike(f'%{q}%'))).all()
-    elif isinstance(q, float) or isinstance(q, int):
-        query = session.query(FoodItem).filter(FoodItem.price==q).all()
-    response = from_query_to_list(query)
-
-    return response
+        cursor: PageCursor = None,
+        limit: PageLimit = DEFAULT_PAGE_SIZE,
+        offset: Annotated[int, Query(ge=0, le=MAX_SEARCH_OFFSET, title="Offset into ranked search results")] = 0,
+        fields: FieldSelection = None):
+    fieldset = parse_fields(FoodItem, fields, relations=('category',))
+    response_model = FoodItemPage if fieldset is None else None
+
+    if isinstance(q, str):
+        # Relevance ranked, so it pages by offset instead of by cursor
+        query = await search_food_items(session, q, limit + 1, offset)
+        next_offset = offset + limit if len(query) > limit else None
+        include_fields = fieldset.fields if fieldset is not None else None
+        return json_response({'items' : from_query_to_list(query[:limit], include_fields=include_fields), 'next_offset' : next_offset},
+                             response_model=response_model)
+
+    statement = select(FoodItem).options(*loader_profile('food')) if fieldset is None else fieldset.statement([FoodItem.id])
+    if isinstance(q, float) or isinstance(q, int):
+        statement = statement.filter(FoodItem.price==q)
+    if fieldset is None:
+        query, next_cursor = await paginate(session, statement, [FoodItem.id], cursor, limit)
+        response = from_query_to_list(query)
+    else:
+        query, next_cursor = await paginate(session, statement, [FoodItem.id], cursor, limit, rows=fieldset.rows)
+        response = fieldset.to_list(query)
+
+    return json_response({'items' : response, 'next_cursor' : next_cursor}, response_model=response_model)
 
 
 
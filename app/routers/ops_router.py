@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Response, status
+from fastapi.responses import JSONResponse
+from app.database import pool_stats
+from app.cache import catalog_cache
+from app.hashing import password_hasher
+from app.health import database_readiness
+from app.replicas import replica_monitor
+from app.metrics import render_metrics, CONTENT_TYPE
+from app.routers.base import CurrentShop
+
+
+ops_router = APIRouter(
+    prefix='',
+    tags=['ops']
+)
+
+
+# Liveness: the process answers, whatever the state of the database
+@ops_router.get('/healthz')
+async def healthz():
+    return {'status': 'ok'}
+
+
+@ops_router.get('/readyz')
+async def readyz():
+    ready, details = await database_readiness.check()
+    return JSONResponse({'status': 'ready' if ready else 'unavailable', **details},
+                        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+# Internals (pool, replica, cache and hashing state) are for the shop administrators only
+@ops_router.get('/pool-status')
+async def get_pool_status(shop_user: CurrentShop):
+    return pool_stats()
+
+
+@ops_router.get('/replica-status')
+async def get_replica_status(shop_user: CurrentShop):
+    if replica_monitor is None:
+        return {'configured': False}
+    return {'configured': True, **replica_monitor.stats()}
+
+
+@ops_router.get('/cache-stats')
+async def get_cache_stats(shop_user: CurrentShop):
+    return catalog_cache.stats()
+
+
+@ops_router.get('/hash-stats')
+async def get_hash_stats(shop_user: CurrentShop):
+    return password_hasher.stats()
+
+
+@ops_router.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
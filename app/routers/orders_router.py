@@ -3,6 +3,18 @@ from app.schemas import User, GetOrders, OrderItem
 from app.schemas import CreateOrders, UpdateOrderStatus
 from fastapi.exceptions import HTTPException
 from app.models import Orders, User, OrderItem
+import asyncio
+import json
+from fastapi import Request, Header
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete
+from app.notifications import order_status_hub
+from app import idempotency
+from app.ordering import place_order, transition_order, update_order_details
+from app.stats import record_order_removed
+
+STREAM_HEARTBEAT_SECONDS = 15
+FINAL_ORDER_STATUSES = {'DELIVERED', 'CANCELED'}
 
 
 
@@ -16,125 +28,161 @@ order_router = APIRouter(
 @order_router.post('/place-order', status_code=status.HTTP_201_CREATED)
 async def place_new_order(
         order : CreateOrders,
-        Authorize:AuthJWT=Depends()
+        session: DBSession,
+        user: CurrentUser,
+        idempotency_key: Annotated[Union[str, None], Header(max_length=255, title="Retries with the same key get the first response back")] = None
 ):
-    current_user = check_authorization(Authorize)
-    user = session.query(User).filter_by(username=current_user).first()
-    new_order = Orders(
-        delivery_address = order.delivery_address,
-        comment = order.comment,
-        user_id = user.id,
-        restaurant_id = order.restaurant_id,
-    )
-
-    order_items = [
-        OrderItem(
-        quantity=o.quantity,
-        comment = o.comment,
-        food_item_id = o.food_item_id
-        )
-        for o in order.list_orders
-    ]
-    new_order.list_orders = order_items
-    # new_order.user = user
-    session.add(new_order)
-    session.commit()
-    session.refresh(new_order)
-    return jsonable_encoder(new_order)
+    if idempotency_key is not None:
+        stored = await idempotency.claim(session, user.id, idempotency_key, idempotency.request_hash(order))
+        if stored is not None:
+            return stored
+    new_order = await place_order(session, user.id, order)
+    response = json_response(new_order, status_code=status.HTTP_201_CREATED)
+    if idempotency_key is not None:
+        await idempotency.store(session, user.id, idempotency_key, response)
+    await session.commit()
+    return response
 
 
 @order_router.get('/order/{id}')
-async def get_order(id:int, Authorize:AuthJWT=Depends()):
-    check_authorization(Authorize)
-    current_user = Authorize.get_jwt_subject()
-    order = session.query(Orders).filter(Orders.id==id).first()
+async def get_order(id:int, session: DBSession, current_user: JWTSubject):
+    order = await fetch_one(session, select(Orders).filter(Orders.id==id).options(*loader_profile('order')))
     if order is None:
         return {}
-    return jsonable_encoder(order)
+    return json_response(from_query_to_object(order))
+
+
+# Server-Sent Events: pushes every order_status change instead of clients polling /order/{id}
+@order_router.get('/order/{id}/stream')
+async def stream_order_status(id:int, request:Request, session: DBSession, user: CurrentUser):
+    statement = select(Orders.order_status, Orders.version).filter(Orders.id==id, Orders.user_id==user.id)
+    if (await session.execute(statement)).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if session.bind.dialect.name == 'postgresql':
+        await order_status_hub.start()
+    # Hand the connection back to the pool, the stream may stay open for a long time
+    await session.close()
+
+    async def event_stream():
+        async with order_status_hub.subscribe(id) as queue:
+            # Read once subscribed, so a change committed in between is in the queue rather than lost
+            current = (await session.execute(statement)).first()
+            await session.close()
+            if current is None:
+                return
+            event = {'id': id, 'order_status': getattr(current.order_status, 'code', current.order_status),
+                     'version': current.version}
+            while True:
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+                if event['order_status'] in FINAL_ORDER_STATUSES:
+                    return
+                sent = event
+                while True:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                        continue
+                    if not _already_sent(event, sent):
+                        break
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _already_sent(event, sent):
+    # The status read at subscription may already include changes still queued as notifications
+    if event.get('version') is not None and sent.get('version') is not None:
+        return event['version'] <= sent['version']
+    return event['order_status'] == sent['order_status']
 
 
 @order_router.get('/my-orders')
+@query_budget(statements=2)
 async def user_orders(
+        session: ReadSession,
+        current_user: CurrentUser,
         q : Annotated[Union[str, int, None], Query(title="Filter by time, price")] =None,
-        Authorize:AuthJWT=Depends()
+        cursor: PageCursor = None,
+        limit: PageLimit = DEFAULT_PAGE_SIZE,
+        fields: FieldSelection = None
 ):
-    current_user = check_authorization(Authorize)
-    if q is None:
-        query = session.query(User).filter_by(username=current_user).options(joinedload(User.orders)).first()
+    fieldset = parse_fields(Orders, fields, exclude={'user_id'})
+    query = await session.get(User, current_user.id, options=loader_profile('user_orders'))
+
+    # Newest first, (order_time, id) keeps the order stable when timestamps collide
+    keys = [Orders.order_time, Orders.id]
+    if fieldset is None:
+        statement = select(Orders).options(*loader_profile('order')).filter(Orders.user_id == query.id)
+        results, next_cursor = await paginate(session, statement, keys, cursor, limit, descending=True)
+        orders = from_query_to_list(results, exclude_fields={'user_id', 'user'})
+    else:
+        statement = fieldset.statement(keys).filter(Orders.user_id == query.id)
+        results, next_cursor = await paginate(session, statement, keys, cursor, limit, descending=True, rows=fieldset.rows)
+        orders = fieldset.to_list(results)
 
     user = from_query_to_object(query, exclude_fields={'password', 'orders'})
-    orders = from_query_to_list(query.orders, exclude_fields={'user_id'})
     user['orders'] = orders
-    return user
+    user['next_cursor'] = next_cursor
+    return json_response(user)
 
 
-#UPDATE ORDER
+#UPDATE ORDER : users can change the delivery details and cancel a pending order
 @order_router.put('order/update-order/{id}')
 async def update_order(
         id: int,
        new_order : GetOrders,
-        Authorize:AuthJWT=Depends()
+        session: DBSession,
+        user: CurrentUser
 ):
-    current_user = check_authorization(Authorize)
-    user = session.query(User).filter_by(username=current_user).first()
-    order = session.query(Orders).filter(Orders.id == id).first()
-    if user.id != order.user_id:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="This order don't exists")
-    #ONLY CANCEL ORDERS
+    values = {'delivery_address': new_order.delivery_address, 'comment': new_order.comment}
     if new_order.order_status == 'CANCELED':
-        order.order_status = new_order.order_status
-    order.quantity = new_order.quantity
-    order.delivery_address = new_order.delivery_address
-    order.comment = new_order.comment
-    session.add(order)
-    session.commit()
-    session.refresh(order)
-
-    return {
+        order = await transition_order(session, id, 'CANCELED', expected_status='PENDING', version=new_order.version,
+                                       values=values, user_id=user.id)
+    else:
+        order = await update_order_details(session, id, values, user_id=user.id)
+    await session.commit()
+
+    return json_response({
         "message" : "success" ,
-        "order" : jsonable_encoder(order)
-    }
+        "order" : order
+    })
 
 
-# UPDATE ORDER : Users can update order_status == CANCEL
+# UPDATE ORDER STATUS : the restaurant's staff move its orders along Orders.TRANSITIONS
 @order_router.patch('/update-order-status/{id}')
 async def update_order_status(
         id:int,
         order_status: UpdateOrderStatus,
-        Authorize:AuthJWT=Depends()
+        session: DBSession,
+        shop: CurrentShop
 ):
-    username = check_authorization(Authorize)
-    user = session.query(User).filter_by(username=username).first()
-    if not user.is_staff or user.is_administrator or order_status=='CANCEL':
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Should be staff to modify order status rather than cancel")
-
-    order = session.query(Orders).filter_by(id=id).first()
-    order.order_status = order_status.order_status
-    session.commit()
-    session.refresh(order)
-    return {
+    order = await transition_order(session, id, order_status.order_status, order_status.expected_status,
+                                   order_status.version, restaurant_id=shop.id)
+    await session.commit()
+    return json_response({
              'message': 'success',
-             'order' : jsonable_encoder(order)
-             }
+             'order' : order
+             })
 
 
 # DELETE ORDER
 @order_router.delete('/delete/{id}', status_code=status.HTTP_204_NO_CONTENT)
 async def delete_order(
         id : Annotated[int, Path(title="Order ID to delete")],
-        Authorize:AuthJWT=Depends()
+        session: DBSession,
+        user: CurrentUser
 ):
-    check_authorization(Authorize)
-    username = Authorize.get_jwt_subject()
-    user = session.query(User).filter_by(username=username).first()
-    order = session.query(Orders).filter_by(id=id).first()
+    order = await fetch_one(session, select(Orders).filter_by(id=id).options(*loader_profile('order')))
+    if order is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     if user.id != order.user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail='Not authorized to delete this order'
                             )
 
-    session.delete(order)
-    session.commit()
+    await record_order_removed(session, from_query_to_object(order))
+    await session.execute(delete(OrderItem).filter(OrderItem.orders_id == order.id))
+    await session.execute(delete(Orders).filter(Orders.id == order.id))
+    await session.commit()
     return {'message' : 'success'}
@@ -1,7 +1,14 @@
 from .base import *
 from app.schemas import CreateFoodItem, CreateCategory, UpdateFoodItem
-from app.models import FoodItem, FoodCategory, Orders
-from sqlalchemy.orm import joinedload
+from app.models import FoodItem, FoodCategory, Orders, Restaurant
+from app.search import food_search_index
+from app.cache import catalog_cache
+from app.stats import restaurant_stats
+from app.menus import import_menu, export_menu
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 
 
 shop_router = APIRouter(
@@ -10,13 +17,27 @@ shop_router = APIRouter(
 )
 
 
+async def commit_food_item(session, name):
+    """Commit a created or renamed food item, a name the restaurant already uses is a 409."""
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        # Named by Postgres, by its columns on sqlite
+        message = str(e.orig)
+        if 'uq_fooditem_restaurant_name' not in message and 'fooditem.restaurant_id, fooditem.name' not in message:
+            raise
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"A food item named {name} already exists")
+
+
 @shop_router.post('/create-food/')
-def create_food_item(
+async def create_food_item(
         item : CreateFoodItem,
-        Authorize : AuthJWT = Depends()
+        session: DBSession,
+        shop_user: CurrentShop
 ):
-    shop_user = check_shop_authorization(Authorize)
-    category = session.query(FoodCategory).filter_by(id=item.category_id).first()
+    category = await fetch_one(session, select(FoodCategory).filter_by(id=item.category_id))
     if category is None:
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT,
                             detail=f"{item.category_name} not found")
@@ -30,56 +51,62 @@ def create_food_item(
         restaurant_id = shop_user.id
     )
     session.add(add_menu)
-    session.commit()
-    session.refresh(add_menu)
+    await commit_food_item(session, item.name)
+    await session.refresh(add_menu)
+    food_search_index.add_item(add_menu)
+    catalog_cache.invalidate(f'restaurant:{shop_user.id}')
 
-    return jsonable_encoder(add_menu)
+    return json_response(from_query_to_object(add_menu))
 
 #UPDATE only one field
 @shop_router.patch('/update-food/{id}')
-def update_food_item(
+async def update_food_item(
         id : int,
         item : UpdateFoodItem,
-        Authorize : AuthJWT=Depends()
+        session: DBSession,
+        shop_user: CurrentShop
 ):
-    shop_user = check_shop_authorization(Authorize)
-    db_item = session.get(FoodItem, id)
+    db_item = await session.get(FoodItem, id)
     if db_item is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"This item {item.name} doesn't exist")
     item_data = item.dict(exclude_unset=True)
     for key, value in item_data.items():
         setattr(db_item, key, value)
-    session.commit()
-    session.refresh(db_item)
-    return jsonable_encoder(db_item)
+    await commit_food_item(session, db_item.name)
+    await session.refresh(db_item)
+    food_search_index.add_item(db_item)
+    catalog_cache.invalidate(f'food:{id}', f'restaurant:{db_item.restaurant_id}')
+    return json_response(from_query_to_object(db_item))
 
 
 @shop_router.delete('delete-food/{id}')
-def delete_item(
+async def delete_item(
         id : int,
-        Authorize : AuthJWT = Depends()
+        session: DBSession,
+        shop_user: CurrentShop
 ):
-    shop_user = check_shop_authorization(Authorize)
-    db_item = session.query(FoodItem).filter(FoodItem.id == id).first()
+    db_item = await fetch_one(session, select(FoodItem).filter(FoodItem.id == id))
     if db_item is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     if db_item.restaurant_id != shop_user.id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    session.delete(db_item)
-    session.commit()
+    await session.delete(db_item)
+    await session.commit()
+    food_search_index.remove(id)
+    catalog_cache.invalidate(f'food:{id}', f'restaurant:{shop_user.id}')
     return {"operation" : 'success'}
 
 
 
 @shop_router.post('/add-category/', status_code=status.HTTP_201_CREATED)
-def add_category(
+async def add_category(
         category : CreateCategory,
-        Authorize:AuthJWT=Depends()
+        session: DBSession,
+        shop_user: CurrentShop
 ):
-    shop_user = check_shop_authorization(Authorize)
-    check_category = session.query(FoodCategory).filter_by(category_name=category.category_name).first()
+    check_category = await fetch_one(session, select(FoodCategory).filter_by(category_name=category.category_name))
     if check_category is not None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=f"{category.name} exists.")
@@ -87,33 +114,58 @@ def add_category(
         category_name = category.category_name
     )
     session.add(new_category)
-    session.commit()
-    session.refresh(new_category)
-    return jsonable_encoder(new_category)
+    await session.commit()
+    await session.refresh(new_category)
+    catalog_cache.invalidate('categories')
+    return json_response(from_query_to_object(new_category), status_code=status.HTTP_201_CREATED)
+
+
+def order_with_user(result):
+    order = from_query_to_object(result, exclude_fields={'user'})
+    order['user'] = from_query_to_object(result.user, exclude_fields={'password'})
+    return order
 
 
 #LIST ALL ORDER or FILTER BY order_status
 @shop_router.get('/orders')
+@query_budget(statements=2 + SHOP_AUTH_STATEMENTS)
 async def list_orders(
+        session: DBSession,
+        shop_user: CurrentShop,
         q: Annotated[str | None, Query(max_length=20, title="Filter by pending/in-transit/delivered fields")] = None,
-        Authorize : AuthJWT=Depends()
+        cursor: PageCursor = None,
+        limit: PageLimit = DEFAULT_PAGE_SIZE,
+        fields: FieldSelection = None,
+        format: Annotated[Union[str, None], Query(regex='^ndjson$', title="ndjson: stream every order, one per line")] = None
 ):
-    shop_user = check_shop_authorization(Authorize)
-    if q is not None:
-        results = session.query(Orders).options(joinedload(Orders.user)).options(joinedload(Orders.restaurant)).filter(Orders.restaurant_id == shop_user.id).filter(Orders.order_status==q).all()
+    fieldset = parse_fields(Orders, fields, relations=('user',))
+    keys = [Orders.order_time, Orders.id]
+    if fieldset is None:
+        statement = select(Orders).options(*loader_profile('shop_orders'))
     else:
-        results = session.query(Orders).options(joinedload(Orders.user)).filter(Orders.restaurant_id == shop_user.id).all()
+        statement = fieldset.statement(keys)
+    statement = statement.filter(Orders.restaurant_id == shop_user.id)
+    if q is not None:
+        statement = statement.filter(Orders.order_status==q)
+    rows = fieldset is not None and fieldset.rows
+    if format == 'ndjson':
+        # Whole history from the cursor on, memory stays at one batch however many orders there are
+        to_dict = fieldset.to_dict if fieldset is not None else order_with_user
+        statement = seek(statement, keys, cursor, descending=True)
+        return StreamingResponse(stream_ndjson(session, statement, to_dict, rows=rows), media_type='application/x-ndjson')
+    restaurant = await session.get(Restaurant, shop_user.id, options=loader_profile('principal'))
+    results, next_cursor = await paginate(session, statement, keys, cursor, limit, descending=True, rows=rows)
     response = {
-        'restaurant' : from_query_to_object(shop_user, exclude_fields={'password'}),
+        'restaurant' : from_query_to_object(restaurant, exclude_fields={'password'}),
         'orders' : [],
+        'next_cursor' : next_cursor,
     }
-    for result in results:
-        order = from_query_to_object(result, exclude_fields={'user'})
-        user = from_query_to_object(result.user, exclude_fields={'password'})
-        order['user'] = user
-        response['orders'].append(order)
+    if fieldset is not None:
+        response['orders'] = fieldset.to_list(results)
+        return json_response(response)
+    response['orders'] = [order_with_user(result) for result in results]
 
-    return response
+    return json_response(response)
 
 
 
@@ -121,12 +173,55 @@ async def list_orders(
 @shop_router.get('/orders/{id}')
 async def list_orders(
         id: Annotated[int, Path(title="Order ID")],
-        Authorize:AuthJWT=Depends()
+        session: DBSession,
+        shop: CurrentShop
 ):
-    shop = check_shop_authorization(Authorize)
 
-    results = session.query(Orders).options(joinedload(Orders.user)).filter(Orders.restaurant_id == shop.id).filter(Orders.id==id).all()
+    results = await fetch_all(session, select(Orders).options(*loader_profile('shop_orders')).filter(Orders.restaurant_id == shop.id).filter(Orders.id==id))
 
     response = from_query_to_list(results)
 
-    return response
\ No newline at end of file
+    return json_response(response)
+
+# Dashboard figures, read from the summary tables kept by app.stats
+@shop_router.get('/stats')
+@query_budget(statements=3 + SHOP_AUTH_STATEMENTS)
+async def shop_stats(
+        session: DBSession,
+        shop_user: CurrentShop,
+        days: Annotated[int, Query(ge=1, le=366, title="Daily figures for the last N days")] = 30,
+        top: Annotated[int, Query(ge=1, le=100, title="Number of best selling items")] = 10
+):
+    return json_response(await restaurant_stats(session, shop_user.id, days, top))
+
+
+MENU_MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+MenuFormat = Annotated[Union[str, None], Query(regex='^(csv|ndjson)$', title="csv or ndjson, defaults to the Content-Type")]
+
+
+# Bulk upsert of the shop's menu: the body is read as a stream and loaded through COPY
+@shop_router.post('/menu/import')
+async def import_menu_items(
+        request: Request,
+        session: DBSession,
+        shop_user: CurrentShop,
+        format: MenuFormat = None,
+        partial: Annotated[bool, Query(title="Apply the valid rows even if some rows are rejected")] = False
+):
+    if format is None:
+        format = 'csv' if 'csv' in request.headers.get('content-type', '') else 'ndjson'
+    report, food_item_ids = await import_menu(session, shop_user.id, request.stream(), format, partial)
+    await session.commit()
+    food_search_index.clear()
+    catalog_cache.invalidate(f'restaurant:{shop_user.id}', *[f'food:{id}' for id in food_item_ids])
+    return json_response(report.to_dict())
+
+
+@shop_router.get('/menu/export')
+async def export_menu_items(
+        session: DBSession,
+        shop_user: CurrentShop,
+        format: MenuFormat = 'csv'
+):
+    return StreamingResponse(export_menu(session, shop_user.id, format), media_type=MENU_MEDIA_TYPES[format],
+                             headers={'Content-Disposition': f'attachment; filename="menu.{format}"'})
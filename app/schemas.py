@@ -1,4 +1,4 @@
-from pydantic import BaseModel, condecimal
+from pydantic import BaseModel, condecimal, conint, conlist
 from pydantic.typing import Optional, Union, List
 from datetime import datetime
 from pydantic.typing import Annotated
@@ -125,7 +125,10 @@ class _BaseOrderItem(BaseModel):
 
 
 class CreateOrderItem(_BaseOrderItem):
-    pass
+    food_item_id : int
+    quantity : conint(gt=0, le=100)
+
+MAX_ORDER_LINES = 100
 
 class OrderItem(_BaseOrderItem):
     id : int
@@ -137,7 +140,7 @@ class CreateOrders(BaseModel):
     restaurant_id : int
     delivery_address : str
     comment : str
-    list_orders : Union[List[CreateOrderItem], None] = None
+    list_orders : conlist(CreateOrderItem, min_items=1, max_items=MAX_ORDER_LINES)
 
     class Config:
         orm_mode = True
@@ -166,12 +169,17 @@ class CreateOrders(BaseModel):
 
 
 class UpdateOrderStatus(BaseModel):
-    order_status: Optional[str] = 'PENDING'
+    order_status: str
+    # Status and version the client last saw, the change is refused with a 409 if the order moved on since
+    expected_status: Optional[str] = None
+    version: Optional[int] = None
     class Config:
         orm_mode = True
         schema_extra = {
             'example' : {
-                'order_status' : "CANCEL"
+                'order_status' : "IN-TRANSIT",
+                'expected_status' : "PENDING",
+                'version' : 1
             }
         }
 
@@ -266,6 +274,17 @@ class GetRestaurantModel(GetRestaurant):
 
 class GetOrders(_BaseOrders):
     id : int
+    version : Optional[int] = None
     restaurant_name : str
     restaurant_id : int
-    list_orders : List[OrderItem]
\ No newline at end of file
+    list_orders : List[OrderItem]
+
+class RestaurantPage(BaseModel):
+    items : List[GetRestaurant]
+    next_cursor : Optional[str] = None
+
+
+class FoodItemPage(BaseModel):
+    items : List[GetFoodItem]
+    next_cursor : Optional[str] = None
+    next_offset : Optional[int] = None
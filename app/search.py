@@ -0,0 +1,156 @@
+import heapq
+import os
+import re
+import time
+from collections import defaultdict
+from sqlalchemy import select, func, literal, literal_column, or_
+from app.models import FoodItem
+from app.loaders import loader_profile
+
+
+MAX_SEARCH_OFFSET = 1000
+
+# The fallback index is per worker: each one updates it for its own writes and reloads it from the
+# database after FOOD_SEARCH_INDEX_TTL seconds, which is how writes made through other workers get in
+FOOD_SEARCH_INDEX_TTL = float(os.environ.get("FOOD_SEARCH_INDEX_TTL", 30))
+
+# tsvector column and trigram index are maintained by the c2d8f4a1b9e3 migration
+search_vector = literal_column('fooditem.search_vector')
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+async def search_food_items(session, q, limit, offset=0):
+    if session.bind.dialect.name == 'postgresql':
+        return await _search_postgres(session, q, limit, offset)
+    return await _search_fallback(session, q, limit, offset)
+
+
+async def _search_postgres(session, q, limit, offset):
+    query = func.websearch_to_tsquery('simple', q)
+    # Full text match ranks first, word_similarity on the name catches typos ("margarta"); the <%
+    # threshold is pg_trgm.word_similarity_threshold, set on the connections by app.database
+    rank = func.ts_rank_cd(search_vector, query) + func.word_similarity(q, FoodItem.name)
+    statement = (
+        select(FoodItem)
+        .options(*loader_profile('food'))
+        .filter(or_(search_vector.op('@@')(query), literal(q).op('<%')(FoodItem.name)))
+        .order_by(rank.desc(), FoodItem.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    result = await session.execute(statement)
+    return result.unique().scalars().all()
+
+
+async def _search_fallback(session, q, limit, offset):
+    await food_search_index.ensure_loaded(session)
+    ids = food_search_index.search(q, limit, offset)
+    if not ids:
+        return []
+    result = await session.execute(select(FoodItem).options(*loader_profile('food')).filter(FoodItem.id.in_(ids)))
+    items = {item.id: item for item in result.unique().scalars().all()}
+    return [items[item_id] for item_id in ids if item_id in items]
+
+
+class FoodSearchIndex:
+    """In-process inverted index used when the database isn't Postgres."""
+
+    FIELD_WEIGHTS = {'name': 3.0, 'ingredients': 2.0, 'description': 1.0}
+    # pg_trgm's default similarity threshold: "margarta" is 0.33 similar to "margherita"
+    MIN_SIMILARITY = 0.3
+    PREFIX_SIMILARITY = 0.8
+
+    def __init__(self, ttl=FOOD_SEARCH_INDEX_TTL):
+        self.ttl = ttl
+        self.loaded = False
+        self.loaded_at = float('-inf')
+        self._postings = defaultdict(dict)   # token -> {item id: weight}
+        self._trigrams = defaultdict(set)    # trigram -> tokens, for typo tolerance
+        self._documents = {}                 # item id -> tokens, to unindex on update/delete
+
+    def __len__(self):
+        return len(self._documents)
+
+    async def ensure_loaded(self, session):
+        if self.loaded and time.monotonic() - self.loaded_at < self.ttl:
+            return
+        statement = select(FoodItem.id, FoodItem.name, FoodItem.description, FoodItem.ingredients)
+        rows = (await session.execute(statement)).all()
+        # Swapped in at once, searches running meanwhile keep using the previous contents
+        self.clear()
+        for row in rows:
+            self.add(*row)
+        self.loaded = True
+        self.loaded_at = time.monotonic()
+
+    def add(self, item_id, name, description, ingredients):
+        self.remove(item_id)
+        weights = defaultdict(float)
+        for field, text in (('name', name), ('description', description), ('ingredients', ingredients)):
+            for token in tokenize(text):
+                weights[token] += self.FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            if token not in self._postings:
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].add(token)
+            self._postings[token][item_id] = weight
+        self._documents[item_id] = tuple(weights)
+
+    def clear(self):
+        # Rebuilt from the database on the next search, cheaper than indexing a bulk import item by item
+        self.loaded = False
+        self._postings.clear()
+        self._trigrams.clear()
+        self._documents.clear()
+
+    def add_item(self, item):
+        if self.loaded:
+            self.add(item.id, item.name, item.description, item.ingredients)
+
+    def remove(self, item_id):
+        for token in self._documents.pop(item_id, ()):
+            postings = self._postings[token]
+            postings.pop(item_id, None)
+            if not postings:
+                del self._postings[token]
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+
+    def _expand(self, token):
+        if token in self._postings:
+            return [(token, 1.0)]
+        token_trigrams = trigrams(token)
+        shared = defaultdict(int)
+        for trigram in token_trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        matches = []
+        for candidate, count in shared.items():
+            similarity = count / len(token_trigrams | trigrams(candidate))
+            if candidate.startswith(token):
+                similarity = max(similarity, self.PREFIX_SIMILARITY)
+            if similarity >= self.MIN_SIMILARITY:
+                matches.append((candidate, similarity))
+        return matches
+
+    def search(self, q, limit, offset=0):
+        scores = defaultdict(float)
+        for token in tokenize(q):
+            for match, similarity in self._expand(token):
+                for item_id, weight in self._postings[match].items():
+                    scores[item_id] += weight * similarity
+        ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda entry: (-entry[1], entry[0]))
+        return [item_id for item_id, _ in ranked[offset:]]
+
+
+food_search_index = FoodSearchIndex()
@@ -0,0 +1,111 @@
+import datetime
+import decimal
+import json
+import os
+import time
+
+from fastapi import Response
+from pydantic import parse_obj_as
+from sqlalchemy import inspect
+from sqlalchemy_utils import Choice
+
+from app.instrumentation import current_stats
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# Never serialized to clients
+PRIVATE_FIELDS = frozenset({'password', 'is_staff', 'is_administrator', 'roles_version'})
+
+# Set in development/CI to check fast responses against the route's response_model
+VALIDATE_RESPONSES = os.environ.get("VALIDATE_RESPONSES", "false").lower() in ('1', 'true', 'yes')
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, Choice):
+        return value.code
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    start = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(content, default=_default)
+    else:
+        body = json.dumps(content, default=_default, separators=(',', ':')).encode()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.serialization_time += time.perf_counter() - start
+    return body
+
+
+class ModelSerializer:
+    """Turns ORM instances of one model into plain dicts.
+
+    Field lists are worked out once per (model, include, exclude) instead of
+    walking every row reflectively. Like jsonable_encoder only attributes that
+    are already loaded are read, so serializing never triggers a lazy load.
+    """
+
+    MAX_DEPTH = 3
+
+    def __init__(self, model, include=None, exclude=frozenset()):
+        mapper = inspect(model)
+        self.columns = tuple(
+            attr.key for attr in mapper.column_attrs
+            if attr.key not in exclude and (include is None or attr.key in include)
+        )
+        self.relationships = tuple(
+            (rel.key, rel.mapper.class_, rel.uselist) for rel in mapper.relationships
+            if rel.key not in exclude and (include is None or rel.key in include)
+        )
+
+    def to_dict(self, obj, depth=0):
+        state = obj.__dict__
+        data = {key: state[key] for key in self.columns if key in state}
+        if depth < self.MAX_DEPTH:
+            for key, related_model, uselist in self.relationships:
+                if key not in state:
+                    continue
+                value = state[key]
+                related = serializer_for(related_model, exclude=PRIVATE_FIELDS)
+                if value is None:
+                    data[key] = None
+                elif uselist:
+                    data[key] = [related.to_dict(item, depth + 1) for item in value]
+                else:
+                    data[key] = related.to_dict(value, depth + 1)
+        return data
+
+    def to_list(self, objs):
+        return [self.to_dict(obj) for obj in objs]
+
+
+_serializers = {}
+
+
+def serializer_for(model, include=None, exclude=None):
+    key = (model, frozenset(include) if include is not None else None, frozenset(exclude or ()))
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = _serializers[key] = ModelSerializer(model, key[1], key[2])
+    return serializer
+
+
+def json_response(content, status_code=200, response_model=None):
+    # Returning a Response makes FastAPI skip response_model validation and jsonable_encoder,
+    # the serializers above already produce exactly the documented fields
+    if isinstance(content, bytes):
+        body = content
+    else:
+        if VALIDATE_RESPONSES and response_model is not None:
+            parse_obj_as(response_model, content)
+        body = dumps(content)
+    return Response(content=body, status_code=status_code, media_type='application/json')
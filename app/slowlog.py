@@ -0,0 +1,122 @@
+"""Structured log of slow SQL statements.
+
+Every statement slower than SLOW_QUERY_MS is logged as one JSON line on the
+app.slowlog logger: SQL text, the shape of its parameters (types and sizes,
+never values), duration, row count and the route it ran for. A fraction
+(SLOW_QUERY_EXPLAIN_SAMPLE) of slow read statements on Postgres are run again
+under EXPLAIN (ANALYZE, BUFFERS) and the plan is added to the record. Reads
+that call a function with side effects (pg_notify, nextval, ...) would repeat
+them under ANALYZE, they get a plain EXPLAIN: the plan without actual timings.
+"""
+import json
+import logging
+import os
+import random
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.instrumentation import current_stats
+from app.metrics import route_template
+
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+# 0 disables EXPLAIN; ANALYZE executes the statement a second time, keep it small
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get("SLOW_QUERY_EXPLAIN_SAMPLE", 0))
+SLOW_QUERY_MAX_SQL = 4000
+
+_READ_ONLY = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b|\bFOR\s+(UPDATE|SHARE|NO KEY UPDATE)\b', re.IGNORECASE)
+# Volatile functions that do something besides returning a value
+_SIDE_EFFECTS = re.compile(
+    r'\b(pg_notify|nextval|setval|set_config|pg_(try_)?advisory_\w+|pg_cancel_backend|pg_terminate_backend|lo_\w+|dblink\w*)\s*\(',
+    re.IGNORECASE,
+)
+
+
+def _shape(value):
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}({len(value)})'
+    return type(value).__name__
+
+
+def parameter_shape(parameters, executemany):
+    if executemany:
+        return {'sets': len(parameters), 'first': parameter_shape(parameters[0], False) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: _shape(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_shape(value) for value in parameters]
+    return None
+
+
+def _explainable(conn, statement, context, executemany):
+    return (
+        SLOW_QUERY_EXPLAIN_SAMPLE > 0
+        and not executemany
+        and conn.dialect.name == 'postgresql'
+        and not context.execution_options.get('stream_results')
+        and _READ_ONLY.match(statement) is not None
+        and _WRITES.search(statement) is None
+        and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE
+    )
+
+
+def explain(conn, statement, parameters):
+    """Run the statement under EXPLAIN ANALYZE on a fresh cursor of the same connection.
+
+    Only EXPLAIN it, without running it, when it has side effects. Wrapped in a
+    savepoint so a failing EXPLAIN doesn't abort the request's transaction.
+    """
+    options = 'FORMAT JSON' if _SIDE_EFFECTS.search(statement) else 'ANALYZE, BUFFERS, FORMAT JSON'
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT slowlog_explain")
+        try:
+            cursor.execute(f"EXPLAIN ({options}) {statement}", parameters)
+            plan = cursor.fetchone()[0]
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT slowlog_explain")
+            return {'error': str(e)}
+        cursor.execute("RELEASE SAVEPOINT slowlog_explain")
+    finally:
+        cursor.close()
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, like app.instrumentation: a failing statement never reaches the after hook
+    if context is not None:
+        context.slowlog_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'slowlog_start', None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    if duration * 1000 < SLOW_QUERY_MS:
+        return
+    stats = current_stats.get()
+    scope = stats.scope if stats is not None else None
+    record = {
+        'event': 'slow_query',
+        'duration_ms': round(duration * 1000, 3),
+        'route': route_template(scope) if scope is not None else None,
+        'method': scope['method'] if scope is not None else None,
+        'sql': ' '.join(statement.split())[:SLOW_QUERY_MAX_SQL],
+        'parameters': parameter_shape(parameters, executemany),
+        'executemany': executemany,
+        'rowcount': cursor.rowcount,
+    }
+    if _explainable(conn, statement, context, executemany):
+        record['plan'] = explain(conn, statement, parameters)
+    logger.warning(json.dumps(record, default=str))
@@ -0,0 +1,167 @@
+import datetime
+
+from sqlalchemy import select, update, delete, func, literal
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import Orders, OrderItem, FoodItem, RestaurantDailyStats, RestaurantStatusCount, RestaurantItemSales
+
+
+# Every order write adjusts the restaurant's rows in the summary tables inside the same
+# transaction, so /shop/stats reads O(days + statuses + top items) rows instead of the orders.
+# The upserts lock the restaurant's row for the day until commit: orders of one restaurant
+# commit one after the other, orders of different restaurants don't wait on each other.
+
+def _insert(session, table):
+    dialect = postgresql if session.bind.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
+
+
+def _upsert_counts(session, table, keys, values):
+    statement = _insert(session, table).values(**keys, **values)
+    return statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: getattr(table, name) + getattr(statement.excluded, name) for name in values},
+    )
+
+
+def _order_day(order_time):
+    return order_time.date() if isinstance(order_time, datetime.datetime) else order_time
+
+
+async def _apply_order(session, order, sign):
+    restaurant_id = order['restaurant_id']
+    await session.execute(_upsert_counts(
+        session, RestaurantDailyStats,
+        {'restaurant_id': restaurant_id, 'day': _order_day(order['order_time'])},
+        {'orders': sign, 'revenue': sign * (order['total_price'] or 0)},
+    ))
+    await session.execute(_upsert_counts(
+        session, RestaurantStatusCount,
+        {'restaurant_id': restaurant_id, 'order_status': _status_code(order['order_status'])},
+        {'orders': sign},
+    ))
+    lines = (
+        select(
+            literal(restaurant_id).label('restaurant_id'),
+            OrderItem.food_item_id,
+            (sign * func.sum(OrderItem.quantity)).label('quantity'),
+            (sign * func.sum(OrderItem.quantity * OrderItem.unit_price)).label('revenue'),
+        )
+        .filter(OrderItem.orders_id == order['id'])
+        .group_by(OrderItem.food_item_id)
+    )
+    statement = _insert(session, RestaurantItemSales).from_select(['restaurant_id', 'food_item_id', 'quantity', 'revenue'], lines)
+    await session.execute(statement.on_conflict_do_update(
+        index_elements=['restaurant_id', 'food_item_id'],
+        set_={
+            'quantity': RestaurantItemSales.quantity + statement.excluded.quantity,
+            'revenue': RestaurantItemSales.revenue + statement.excluded.revenue,
+        },
+    ))
+
+
+def _status_code(order_status):
+    return getattr(order_status, 'code', order_status)
+
+
+async def record_order_placed(session, order):
+    """`order` is the new order as a dict, its lines must already be written."""
+    await _apply_order(session, order, 1)
+
+
+async def record_order_removed(session, order):
+    """Call before the order's lines are deleted."""
+    await _apply_order(session, order, -1)
+
+
+async def record_status_change(session, restaurant_id, old_status, new_status):
+    old_status, new_status = _status_code(old_status), _status_code(new_status)
+    if old_status == new_status:
+        return
+    for order_status, delta in ((old_status, -1), (new_status, 1)):
+        await session.execute(_upsert_counts(
+            session, RestaurantStatusCount,
+            {'restaurant_id': restaurant_id, 'order_status': order_status},
+            {'orders': delta},
+        ))
+
+
+async def fill_missing_prices(session, restaurant_id=None):
+    """Price orders placed before prices were copied onto them (5e1b7c9d2a40) at the current menu price."""
+    lines = OrderItem.__table__
+    orders = Orders.__table__
+    statement = (
+        update(lines)
+        .where(lines.c.unit_price.is_(None))
+        .values(unit_price=select(FoodItem.price).where(FoodItem.id == lines.c.food_item_id).scalar_subquery())
+    )
+    if restaurant_id is not None:
+        statement = statement.where(lines.c.orders_id.in_(select(orders.c.id).where(orders.c.restaurant_id == restaurant_id)))
+    await session.execute(statement)
+    statement = (
+        update(orders)
+        .where(orders.c.total_price.is_(None))
+        .values(total_price=select(func.coalesce(func.sum(lines.c.quantity * lines.c.unit_price), 0))
+                .where(lines.c.orders_id == orders.c.id).scalar_subquery())
+    )
+    if restaurant_id is not None:
+        statement = statement.where(orders.c.restaurant_id == restaurant_id)
+    await session.execute(statement)
+
+
+async def rebuild_stats(session, restaurant_id=None):
+    """Recompute the summary tables from orders, e.g. after a backfill or bulk load."""
+    await fill_missing_prices(session, restaurant_id)
+    tables = (RestaurantDailyStats, RestaurantStatusCount, RestaurantItemSales)
+    for table in tables:
+        statement = delete(table)
+        if restaurant_id is not None:
+            statement = statement.filter(table.restaurant_id == restaurant_id)
+        await session.execute(statement)
+
+    def scoped(statement):
+        return statement if restaurant_id is None else statement.filter(Orders.restaurant_id == restaurant_id)
+
+    day = func.date(Orders.order_time)
+    await session.execute(_insert(session, RestaurantDailyStats).from_select(
+        ['restaurant_id', 'day', 'orders', 'revenue'],
+        scoped(select(Orders.restaurant_id, day, func.count(), func.coalesce(func.sum(Orders.total_price), 0))
+               .group_by(Orders.restaurant_id, day)),
+    ))
+    await session.execute(_insert(session, RestaurantStatusCount).from_select(
+        ['restaurant_id', 'order_status', 'orders'],
+        scoped(select(Orders.restaurant_id, Orders.order_status, func.count())
+               .group_by(Orders.restaurant_id, Orders.order_status)),
+    ))
+    await session.execute(_insert(session, RestaurantItemSales).from_select(
+        ['restaurant_id', 'food_item_id', 'quantity', 'revenue'],
+        scoped(select(Orders.restaurant_id, OrderItem.food_item_id, func.sum(OrderItem.quantity),
+                      func.coalesce(func.sum(OrderItem.quantity * OrderItem.unit_price), 0))
+               .join(OrderItem, OrderItem.orders_id == Orders.id)
+               .group_by(Orders.restaurant_id, OrderItem.food_item_id)),
+    ))
+
+
+async def restaurant_stats(session, restaurant_id, days, top):
+    since = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)
+    daily = await session.execute(
+        select(RestaurantDailyStats.day, RestaurantDailyStats.orders, RestaurantDailyStats.revenue)
+        .filter(RestaurantDailyStats.restaurant_id == restaurant_id, RestaurantDailyStats.day >= since)
+        .order_by(RestaurantDailyStats.day)
+    )
+    statuses = await session.execute(
+        select(RestaurantStatusCount.order_status, RestaurantStatusCount.orders)
+        .filter(RestaurantStatusCount.restaurant_id == restaurant_id, RestaurantStatusCount.orders != 0)
+    )
+    top_items = await session.execute(
+        select(RestaurantItemSales.food_item_id, FoodItem.name, RestaurantItemSales.quantity, RestaurantItemSales.revenue)
+        .join(FoodItem, FoodItem.id == RestaurantItemSales.food_item_id)
+        .filter(RestaurantItemSales.restaurant_id == restaurant_id, RestaurantItemSales.quantity > 0)
+        .order_by(RestaurantItemSales.quantity.desc(), RestaurantItemSales.food_item_id)
+        .limit(top)
+    )
+    return {
+        'order_status': {row.order_status: row.orders for row in statuses},
+        'daily': [row._asdict() for row in daily],
+        'top_items': [row._asdict() for row in top_items],
+    }
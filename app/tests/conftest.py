@@ -0,0 +1,31 @@
+import asyncio
+import os
+
+import pytest
+
+# app.database builds its (lazy) engines from these at import
+os.environ.setdefault("DB_USER", "test")
+os.environ.setdefault("DB_HOST", "127.0.0.1")
+os.environ.setdefault("DB_NAME", "test")
+os.environ.setdefault("SECRET_TOKEN_KEY", "test")
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.models import Base
+
+
+@pytest.fixture
+def sessionmaker(tmp_path):
+    """An AsyncSession factory on a fresh sqlite database with the models' tables.
+
+    Unpooled, so it can be used from the event loop of a TestClient as well as asyncio.run.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+
+    async def create():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+    asyncio.run(create())
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
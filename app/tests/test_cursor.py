@@ -0,0 +1,32 @@
+import base64
+import datetime
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app.models import FoodItem, Orders
+from app.routers.base import decode_cursor, encode_cursor
+
+
+def _cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    keys = [Orders.order_time, Orders.id]
+    values = [datetime.datetime(2026, 1, 5, 12), 7]
+    assert decode_cursor(encode_cursor(values), keys) == values
+
+
+@pytest.mark.parametrize('values, keys', [
+    (['a'], [FoodItem.id]),
+    ([True], [FoodItem.id]),
+    ([1.5], [FoodItem.id]),
+    ([5, 3], [Orders.order_time, Orders.id]),
+    (['2026-01-05T12:00:00', '7'], [Orders.order_time, Orders.id]),
+])
+def test_cursor_value_of_the_wrong_type_is_rejected(values, keys):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(_cursor(values), keys)
+    assert error.value.status_code == 400
@@ -0,0 +1,53 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+from app import instrumentation
+from app.instrumentation import QueryStatsMiddleware, query_budget
+from app.models import Restaurant, FoodCategory, FoodItem
+
+
+def n_plus_one_app(sessionmaker):
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware)
+
+    @app.get('/menu')
+    @query_budget(statements=2)
+    async def menu():
+        async with sessionmaker() as session:
+            items = (await session.execute(select(FoodItem))).scalars().all()
+            # One category query per item
+            return [(item.name, (await session.get(FoodCategory, item.category_id, populate_existing=True)).category_name)
+                    for item in items]
+
+    return app
+
+
+def seed(sessionmaker, items):
+    async def run():
+        async with sessionmaker() as session:
+            await session.execute(insert(Restaurant).values(id=1, username='luna'))
+            await session.execute(insert(FoodCategory), [{'id': i, 'category_name': f'c{i}'} for i in range(items)])
+            await session.execute(insert(FoodItem), [{'id': i, 'name': f'item {i}', 'category_id': i, 'restaurant_id': 1}
+                                                      for i in range(items)])
+            await session.commit()
+    asyncio.run(run())
+
+
+def test_n_plus_one_route_fails_its_budget_in_raise_mode(sessionmaker, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'QUERY_BUDGET_MODE', 'raise')
+    seed(sessionmaker, 5)
+    response = TestClient(n_plus_one_app(sessionmaker)).get('/menu')
+    assert response.status_code == 500
+    assert response.json()['exceeded'] == {'statements': {'limit': 2, 'actual': 6}}
+
+
+def test_route_within_budget_passes_in_raise_mode(sessionmaker, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'QUERY_BUDGET_MODE', 'raise')
+    seed(sessionmaker, 1)
+    response = TestClient(n_plus_one_app(sessionmaker)).get('/menu')
+    assert response.status_code == 200
+    assert response.headers['x-query-count'] == '2'
+
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import menus
+from app.menus import ImportReport, parse_upload
+
+
+async def _chunks(body, size):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def _rows(body, format, size=7):
+    async def run():
+        return [item async for batch in parse_upload(_chunks(body, size), format, ImportReport()) for item in batch]
+    return asyncio.run(run())
+
+
+def test_records_split_across_chunks():
+    body = ('\ufeffname,price,category,description\n'
+            'pizza,6.50,pizza,"tomato,\nmozzarella"\n'
+            'caffè,1.20,drinks,\n').encode()
+    rows = _rows(body, 'csv')
+    assert [(row['name'], row['description']) for row in rows] == [('pizza', 'tomato,\nmozzarella'), ('caffè', '')]
+
+
+def test_row_longer_than_the_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(menus, 'MAX_LINE_LENGTH', 64)
+    with pytest.raises(HTTPException) as error:
+        _rows(b'{"name": "' + b'x' * 100, 'ndjson')
+    assert error.value.status_code == 400
+
+
+def test_unterminated_quote_is_capped(monkeypatch):
+    monkeypatch.setattr(menus, 'MAX_LINE_LENGTH', 64)
+    with pytest.raises(HTTPException) as error:
+        _rows(b'name,price,category\n"pizza\n' + b'x,\n' * 100, 'csv')
+    assert error.value.status_code == 400
+
+
+def test_body_larger_than_the_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(menus, 'MAX_IMPORT_BYTES', 1000)
+    with pytest.raises(HTTPException) as error:
+        _rows(b'{"name": "pizza", "price": 1, "category": "pizza"}\n' * 100, 'ndjson')
+    assert error.value.status_code == 413
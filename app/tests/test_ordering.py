@@ -0,0 +1,29 @@
+import asyncio
+import datetime
+
+import pytest
+from fastapi.exceptions import HTTPException
+from sqlalchemy import insert, select
+
+from app.models import Restaurant, Orders, RestaurantStatusCount
+from app.ordering import transition_order
+
+
+def test_transition_matches_any_allowed_source_in_one_update(sessionmaker):
+    async def run():
+        async with sessionmaker() as session:
+            await session.execute(insert(Restaurant).values(id=1, username='luna'))
+            await session.execute(insert(Orders).values(id=1, order_status='IN-TRANSIT', restaurant_id=1,
+                                                        order_time=datetime.datetime(2026, 1, 5, 12)))
+            await session.execute(insert(RestaurantStatusCount).values(restaurant_id=1, order_status='IN-TRANSIT', orders=1))
+            order = await transition_order(session, 1, 'CANCELED', restaurant_id=1)
+            with pytest.raises(HTTPException) as conflict:
+                await transition_order(session, 1, 'CANCELED', restaurant_id=1)
+            counts = dict((await session.execute(
+                select(RestaurantStatusCount.order_status, RestaurantStatusCount.orders))).all())
+            return order, conflict.value, counts
+
+    order, conflict, counts = asyncio.run(run())
+    assert (order['order_status'], order['version']) == ('CANCELED', 2)
+    assert conflict.status_code == 409
+    assert counts == {'IN-TRANSIT': 0, 'CANCELED': 1}
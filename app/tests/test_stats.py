@@ -0,0 +1,33 @@
+import asyncio
+import datetime
+from decimal import Decimal
+
+from sqlalchemy import insert, select
+
+from app.models import Restaurant, FoodCategory, FoodItem, Orders, OrderItem, RestaurantDailyStats, RestaurantItemSales
+from app.stats import rebuild_stats
+
+
+def test_rebuild_prices_orders_placed_before_prices_were_stored(sessionmaker):
+    async def run():
+        async with sessionmaker() as session:
+            await session.execute(insert(Restaurant).values(id=1, username='luna'))
+            await session.execute(insert(FoodCategory).values(id=1, category_name='pizza'))
+            await session.execute(insert(FoodItem).values(id=1, name='margherita', price=Decimal('6.50'),
+                                                          category_id=1, restaurant_id=1))
+            # As the orders were before 5e1b7c9d2a40: no total_price, no unit_price
+            await session.execute(insert(Orders).values(id=1, order_status='DELIVERED', restaurant_id=1,
+                                                        order_time=datetime.datetime(2026, 1, 5, 12)))
+            await session.execute(insert(OrderItem).values(id=1, quantity=2, food_item_id=1, orders_id=1))
+            await rebuild_stats(session)
+            await session.commit()
+
+            daily = (await session.execute(select(RestaurantDailyStats))).scalars().one()
+            sales = (await session.execute(select(RestaurantItemSales))).scalars().one()
+            order = await session.get(Orders, 1)
+            return daily, sales, order
+
+    daily, sales, order = asyncio.run(run())
+    assert order.total_price == Decimal('13.00')
+    assert (daily.day, daily.orders, daily.revenue) == (datetime.date(2026, 1, 5), 1, Decimal('13.00'))
+    assert (sales.quantity, sales.revenue) == (2, Decimal('13.00'))